@@ -0,0 +1,122 @@
+# --------------------------------------------------------
+# Microbenchmark of the box kernels of model.rpn.bbox_transform at the
+# shapes of the RPN and R-CNN layers: bbox_overlaps_batch and
+# bbox_transform_batch of the anchor / proposal target layers,
+# bbox_transform_inv and clip_boxes of the proposal layer and of
+# test_net.py. The last two are compared with their original
+# implementations (deltas.clone() and a per-image clamp_ loop).
+#
+#   python bench_box_kernels.py --batch_sizes 1 4 8
+#   python bench_box_kernels.py --cuda --repeat 50
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import time
+import argparse
+import torch
+
+from model.rpn.bbox_transform import bbox_overlaps_batch, bbox_transform_batch, \
+  bbox_transform_inv, clip_boxes
+
+# (name, boxes per image, gt boxes per image, deltas per box)
+SHAPES = [
+  ('anchor target', 37 * 50 * 9, 20, 1),
+  ('proposal', 37 * 50 * 9, 0, 1),
+  ('proposal target', 2000 + 20, 20, 1),
+  ('test decode', 300, 0, 81),
+]
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Benchmark the box kernels of bbox_transform')
+  parser.add_argument('--batch_sizes', default=[1, 4, 8], type=int, nargs='+')
+  parser.add_argument('--repeat', default=20, type=int)
+  parser.add_argument('--threads', default=0, type=int, help='torch threads, default of torch if 0')
+  parser.add_argument('--cuda', action='store_true')
+  return parser.parse_args()
+
+
+def random_boxes(size, width=1000, height=600):
+  xy = torch.rand(size + (2,)) * torch.Tensor([width, height])
+  wh = torch.rand(size + (2,)) * 300
+  return torch.cat((xy, xy + wh), len(size))
+
+
+def loop_clip_boxes(boxes, im_shape, batch_size):
+  # the original clip_boxes
+  for i in range(batch_size):
+    boxes[i,:,0::4].clamp_(0, im_shape[i, 1]-1)
+    boxes[i,:,1::4].clamp_(0, im_shape[i, 0]-1)
+    boxes[i,:,2::4].clamp_(0, im_shape[i, 1]-1)
+    boxes[i,:,3::4].clamp_(0, im_shape[i, 0]-1)
+  return boxes
+
+
+def clone_transform_inv(boxes, deltas, batch_size):
+  # the original bbox_transform_inv
+  widths = boxes[:, :, 2] - boxes[:, :, 0] + 1.0
+  heights = boxes[:, :, 3] - boxes[:, :, 1] + 1.0
+  ctr_x = boxes[:, :, 0] + 0.5 * widths
+  ctr_y = boxes[:, :, 1] + 0.5 * heights
+  pred_ctr_x = deltas[:, :, 0::4] * widths.unsqueeze(2) + ctr_x.unsqueeze(2)
+  pred_ctr_y = deltas[:, :, 1::4] * heights.unsqueeze(2) + ctr_y.unsqueeze(2)
+  pred_w = torch.exp(deltas[:, :, 2::4]) * widths.unsqueeze(2)
+  pred_h = torch.exp(deltas[:, :, 3::4]) * heights.unsqueeze(2)
+  pred_boxes = deltas.clone()
+  pred_boxes[:, :, 0::4] = pred_ctr_x - 0.5 * pred_w
+  pred_boxes[:, :, 1::4] = pred_ctr_y - 0.5 * pred_h
+  pred_boxes[:, :, 2::4] = pred_ctr_x + 0.5 * pred_w
+  pred_boxes[:, :, 3::4] = pred_ctr_y + 0.5 * pred_h
+  return pred_boxes
+
+
+def timeit(fn, repeat, cuda):
+  fn()
+  if cuda:
+    torch.cuda.synchronize()
+  tic = time.time()
+  for _ in range(repeat):
+    out = fn()
+  if cuda:
+    torch.cuda.synchronize()
+  return out, (time.time() - tic) / repeat * 1000
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  if args.threads > 0:
+    torch.set_num_threads(args.threads)
+  torch.manual_seed(3)
+  device = lambda t: t.cuda() if args.cuda else t
+
+  for batch_size in args.batch_sizes:
+    for name, num_boxes, num_gts, k in SHAPES:
+      boxes = device(random_boxes((batch_size, num_boxes)))
+      deltas = device(torch.randn(batch_size, num_boxes, 4 * k) * 0.2)
+      im_info = device(torch.Tensor([[600, 1000, 1.6]] * batch_size))
+      line = '{:16} batch {:3d}, {:5d} x {:2d}:'.format(name, batch_size, num_boxes, max(num_gts, k))
+
+      if num_gts > 0:
+        gt_boxes = device(torch.cat((random_boxes((batch_size, num_gts)),
+                                     torch.ones(batch_size, num_gts, 1)), 2))
+        anchors = boxes[0] if name == 'anchor target' else boxes
+        overlaps, overlaps_time = timeit(lambda: bbox_overlaps_batch(anchors, gt_boxes), args.repeat, args.cuda)
+        _, assignment = overlaps.max(2)
+        gt_rois = gt_boxes.gather(1, assignment.unsqueeze(2).expand(batch_size, num_boxes, 5))
+        _, targets_time = timeit(lambda: bbox_transform_batch(anchors, gt_rois[:, :, :4]), args.repeat, args.cuda)
+        line += ' overlaps {:7.2f} ms, targets {:7.2f} ms'.format(overlaps_time, targets_time)
+      else:
+        ref, ref_time = timeit(lambda: clone_transform_inv(boxes, deltas, batch_size), args.repeat, args.cuda)
+        pred, inv_time = timeit(lambda: bbox_transform_inv(boxes, deltas, batch_size), args.repeat, args.cuda)
+        same = torch.equal(ref, pred)
+        ref_clip, ref_clip_time = timeit(lambda: loop_clip_boxes(ref.clone(), im_info, batch_size),
+                                         args.repeat, args.cuda)
+        clip, clip_time = timeit(lambda: clip_boxes(pred.clone(), im_info, batch_size), args.repeat, args.cuda)
+        same = same and torch.equal(ref_clip, clip)
+        line += ' transform_inv {:7.2f} / {:7.2f} ms, clip {:7.2f} / {:7.2f} ms (original / batched), ' \
+                'boxes {}'.format(ref_time, inv_time, ref_clip_time, clip_time,
+                                  'identical' if same else 'DIFFER')
+      print(line)
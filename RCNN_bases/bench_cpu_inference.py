@@ -0,0 +1,193 @@
+# --------------------------------------------------------
+# CPU throughput of test_net.py-style inference (images / second):
+# image blob, Faster R-CNN forward, box decoding and class-wise NMS,
+# with the CPU NMS / RoI pooling implementations. Images are grouped by
+# aspect ratio into batches, padded by pad_collate and loaded by
+# DataLoader workers while the model runs.
+#
+#   python bench_cpu_inference.py --net res101 --pooling_mode align
+#   python bench_cpu_inference.py --batch_sizes 1 2 4 --num_workers 2
+#   python bench_cpu_inference.py --image_dir images --load_name faster_rcnn_1_7_10021.pth
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import os
+import time
+import argparse
+import numpy as np
+import cv2
+import torch
+
+from model.utils.config import cfg, cfg_from_file, cfg_from_list
+from model.rpn.bbox_transform import clip_boxes
+from model.nms.nms_wrapper import multiclass_nms
+from model.rpn.bbox_transform import bbox_transform_inv
+from model.utils.blob import im_list_to_blob
+from model.faster_rcnn.vgg16 import vgg16
+from model.faster_rcnn.resnet import resnet
+from roi_data_layer.roibatchLoader import ratio_grouped_batches, pad_collate
+
+pascal_classes = np.asarray(['__background__',
+                     'aeroplane', 'bicycle', 'bird', 'boat',
+                     'bottle', 'bus', 'car', 'cat', 'chair',
+                     'cow', 'diningtable', 'dog', 'horse',
+                     'motorbike', 'person', 'pottedplant',
+                     'sheep', 'sofa', 'train', 'tvmonitor'])
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Benchmark Faster R-CNN inference on the CPU')
+  parser.add_argument('--cfg', dest='cfg_file', default=None, type=str)
+  parser.add_argument('--set', dest='set_cfgs', default=None, nargs=argparse.REMAINDER)
+  parser.add_argument('--net', default='res101', type=str, help='vgg16, res50, res101, res152')
+  parser.add_argument('--pooling_mode', default=None, type=str, help='crop, align or pool')
+  parser.add_argument('--load_name', default=None, type=str,
+                      help='checkpoint to load, random weights if not given')
+  parser.add_argument('--image_dir', default=None, type=str,
+                      help='images to run on, random 480x640 images if not given')
+  parser.add_argument('--num_images', default=20, type=int)
+  parser.add_argument('--warmup', default=2, type=int)
+  parser.add_argument('--threads', default=0, type=int, help='torch threads, default of torch if 0')
+  parser.add_argument('--batch_sizes', default=[1], type=int, nargs='+')
+  parser.add_argument('--num_workers', default=0, type=int, help='DataLoader worker processes')
+  return parser.parse_args()
+
+
+def _get_image_blob(im):
+  # same as demo.py
+  im_orig = im.astype(np.float32, copy=True)
+  im_orig -= cfg.PIXEL_MEANS
+
+  im_shape = im_orig.shape
+  im_size_min = np.min(im_shape[0:2])
+  im_size_max = np.max(im_shape[0:2])
+
+  processed_ims = []
+  im_scale_factors = []
+
+  for target_size in cfg.TEST.SCALES:
+    im_scale = float(target_size) / float(im_size_min)
+    if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
+      im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
+    im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale,
+            interpolation=cv2.INTER_LINEAR)
+    im_scale_factors.append(im_scale)
+    processed_ims.append(im)
+
+  return im_list_to_blob(processed_ims), np.array(im_scale_factors)
+
+
+def load_images(args):
+  if args.image_dir is None:
+    rng = np.random.RandomState(cfg.RNG_SEED)
+    return [rng.randint(0, 256, (480, 640, 3)).astype(np.uint8) for _ in range(args.num_images)]
+  names = sorted(os.listdir(args.image_dir))
+  ims = [cv2.imread(os.path.join(args.image_dir, name)) for name in names]
+  ims = [im for im in ims if im is not None]
+  return [ims[i % len(ims)] for i in range(args.num_images)]
+
+
+class ImageDataset(torch.utils.data.Dataset):
+  """Test-mode samples of roibatchLoader: (data, im_info, gt_boxes, num_boxes)."""
+
+  def __init__(self, ims):
+    self.ims = ims
+
+  def __getitem__(self, index):
+    blobs, im_scales = _get_image_blob(self.ims[index])
+    data = torch.from_numpy(blobs[0]).permute(2, 0, 1).contiguous()
+    im_info = torch.FloatTensor([blobs.shape[1], blobs.shape[2], im_scales[0]])
+    return data, im_info, torch.FloatTensor([1, 1, 1, 1, 1]), 0
+
+  def __len__(self):
+    return len(self.ims)
+
+  def ratio_index(self):
+    ratios = [im.shape[1] / float(im.shape[0]) for im in self.ims]
+    return np.argsort(ratios, kind='mergesort')
+
+
+def im_detect(fasterRCNN, data, thresh=0.05):
+  im_data, im_info, gt_boxes, num_boxes = data
+  batch_size = im_data.size(0)
+
+  det_tic = time.time()
+  rois, cls_prob, bbox_pred, _, _, _, _, _ = fasterRCNN(im_data, im_info, gt_boxes, num_boxes)
+  scores = cls_prob.data
+  boxes = rois.data[:, :, 1:5]
+  box_deltas = bbox_pred.data
+  if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
+    box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS) \
+               + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)
+    box_deltas = box_deltas.view(batch_size, -1, 4 * len(pascal_classes))
+  pred_boxes = bbox_transform_inv(boxes, box_deltas, batch_size)
+  pred_boxes = clip_boxes(pred_boxes, im_info, batch_size)
+  pred_boxes /= im_info[:, 2].contiguous().view(-1, 1, 1)
+  detect_time = time.time() - det_tic
+
+  misc_tic = time.time()
+  num_dets = 0
+  for b in range(batch_size):
+    cls_dets = multiclass_nms(scores[b], pred_boxes[b], thresh, cfg.TEST.NMS, 100)
+    num_dets += sum(len(dets) for dets in cls_dets)
+  nms_time = time.time() - misc_tic
+  return detect_time, nms_time, num_dets
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+  if args.pooling_mode is not None:
+    cfg.POOLING_MODE = args.pooling_mode
+  if args.threads > 0:
+    torch.set_num_threads(args.threads)
+  cfg.CUDA = False
+
+  if args.net == 'vgg16':
+    fasterRCNN = vgg16(pascal_classes, pretrained=False)
+  elif args.net == 'res101':
+    fasterRCNN = resnet(pascal_classes, 101, pretrained=False)
+  elif args.net == 'res50':
+    fasterRCNN = resnet(pascal_classes, 50, pretrained=False)
+  elif args.net == 'res152':
+    fasterRCNN = resnet(pascal_classes, 152, pretrained=False)
+  else:
+    raise ValueError('network {} is not defined'.format(args.net))
+  fasterRCNN.create_architecture()
+  if args.load_name is not None:
+    checkpoint = torch.load(args.load_name, map_location=(lambda storage, loc: storage))
+    fasterRCNN.load_state_dict(checkpoint['model'])
+    if 'pooling_mode' in checkpoint.keys() and args.pooling_mode is None:
+      cfg.POOLING_MODE = checkpoint['pooling_mode']
+  fasterRCNN.eval()
+
+  dataset = ImageDataset(load_images(args))
+  num_images = len(dataset)
+  for batch_size in args.batch_sizes:
+    batches = ratio_grouped_batches(dataset.ratio_index(), batch_size)
+    dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batches,
+                                             num_workers=args.num_workers, collate_fn=pad_collate)
+    detect_time, nms_time, num_dets = 0., 0., 0
+    with torch.no_grad():
+      for i in range(args.warmup):
+        im_detect(fasterRCNN, pad_collate([dataset[i % num_images]] * batch_size))
+      # time spent loading data is included, less what the workers overlap
+      tic = time.time()
+      for data in dataloader:
+        d, n, k = im_detect(fasterRCNN, data)
+        detect_time += d
+        nms_time += n
+        num_dets += k
+      total_time = time.time() - tic
+
+    print('{} {} pooling, {} threads, {} workers, batch size {}, {} images: {:.3f} images/s '
+          '(detect {:.3f}s, nms {:.3f}s per image, {:.1f} dets per image)'.format(
+            args.net, cfg.POOLING_MODE, torch.get_num_threads(), args.num_workers, batch_size,
+            num_images, num_images / total_time, detect_time / num_images, nms_time / num_images,
+            num_dets / float(num_images)))
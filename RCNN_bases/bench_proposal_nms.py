@@ -0,0 +1,110 @@
+# --------------------------------------------------------
+# Benchmark of the batched proposal NMS of _ProposalLayer
+# against the original per-image nms() loop.
+#
+#   python bench_proposal_nms.py --batch_sizes 1 8 16 24
+#   python bench_proposal_nms.py --cuda --pre_nms 12000 --post_nms 2000
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import time
+import argparse
+import numpy as np
+import torch
+
+from model.nms.nms_cpu import nms_cpu
+from model.nms.nms_wrapper import batched_nms
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Benchmark batched proposal NMS')
+  parser.add_argument('--batch_sizes', default=[1, 8, 16, 24], type=int, nargs='+')
+  parser.add_argument('--pre_nms', default=6000, type=int)
+  parser.add_argument('--post_nms', default=300, type=int)
+  parser.add_argument('--thresh', default=0.7, type=float)
+  parser.add_argument('--repeat', default=5, type=int)
+  parser.add_argument('--cuda', action='store_true')
+  return parser.parse_args()
+
+
+def synthetic_proposals(batch_size, num_boxes, width=1000, height=600, seed=0):
+  """Boxes clustered around a few objects per image, sorted by score."""
+  rng = np.random.RandomState(seed)
+  boxes = np.empty((batch_size, num_boxes, 4), dtype=np.float32)
+  for i in range(batch_size):
+    centers = rng.uniform([0, 0], [width, height], (20, 2))
+    sizes = rng.uniform(16, 300, (20, 2))
+    obj = rng.randint(20, size=num_boxes)
+    ctr = centers[obj] + rng.normal(0, 0.2, (num_boxes, 2)) * sizes[obj]
+    wh = sizes[obj] * rng.uniform(0.6, 1.4, (num_boxes, 2))
+    boxes[i, :, :2] = ctr - wh / 2
+    boxes[i, :, 2:] = ctr + wh / 2
+  boxes[:, :, 0::2] = boxes[:, :, 0::2].clip(0, width - 1)
+  boxes[:, :, 1::2] = boxes[:, :, 1::2].clip(0, height - 1)
+  return torch.from_numpy(boxes)
+
+
+def loop_nms(proposals, thresh, post_nms_topN, nms_fn):
+  # the original per-image loop of _ProposalLayer.forward
+  output = proposals.new(proposals.size(0), post_nms_topN, 5).zero_()
+  scores = proposals.new(proposals.size(1), 1).zero_()
+  for i in range(proposals.size(0)):
+    proposals_single = proposals[i]
+    keep_idx_i = nms_fn(torch.cat((proposals_single, scores), 1), thresh)
+    keep_idx_i = keep_idx_i.long().view(-1)[:post_nms_topN]
+    proposals_single = proposals_single[keep_idx_i, :]
+    num_proposal = proposals_single.size(0)
+    output[i,:,0] = i
+    output[i,:num_proposal,1:] = proposals_single
+  return output
+
+
+def batch_nms(proposals, thresh, post_nms_topN):
+  batch_size = proposals.size(0)
+  keep_idx, _ = batched_nms(proposals, thresh, max_keep=post_nms_topN)
+  num_keep = keep_idx.size(1)
+  kept = proposals.gather(1, keep_idx.clamp(min=0).unsqueeze(2).expand(batch_size, num_keep, 4))
+  output = proposals.new(batch_size, post_nms_topN, 5).zero_()
+  output[:, :, 0] = torch.arange(0, batch_size).type_as(proposals).view(-1, 1)
+  output[:, :num_keep, 1:] = kept * (keep_idx >= 0).type_as(proposals).unsqueeze(2)
+  return output
+
+
+def timeit(fn, repeat, cuda):
+  fn()
+  if cuda:
+    torch.cuda.synchronize()
+  tic = time.time()
+  for _ in range(repeat):
+    out = fn()
+  if cuda:
+    torch.cuda.synchronize()
+  return out, (time.time() - tic) / repeat
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  if args.cuda:
+    from model.nms.nms_gpu import nms_gpu as nms_fn
+  else:
+    nms_fn = nms_cpu
+
+  for batch_size in args.batch_sizes:
+    proposals = synthetic_proposals(batch_size, args.pre_nms)
+    if args.cuda:
+      proposals = proposals.cuda()
+
+    loop_out, loop_time = timeit(
+      lambda: loop_nms(proposals, args.thresh, args.post_nms, nms_fn), args.repeat, args.cuda)
+    batch_out, batch_time = timeit(
+      lambda: batch_nms(proposals, args.thresh, args.post_nms), args.repeat, args.cuda)
+
+    # the offset boxes of the GPU path lose a few float32 bits, so allow
+    # for the rare box whose overlap is within rounding of the threshold
+    mismatch = (loop_out != batch_out).any(2).float().mean()
+    print('batch {:3d}: loop {:8.2f} ms, batched {:8.2f} ms, speedup {:5.2f}x, '
+          'mismatched rois {:.4%}'.format(batch_size, loop_time * 1000, batch_time * 1000,
+                                          loop_time / batch_time, float(mismatch)))
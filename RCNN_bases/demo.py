@@ -144,6 +144,10 @@ if __name__ == '__main__':
   print('Called with args:')
   print(args)
 
+  if args.cuda and not torch.cuda.is_available():
+    print("WARNING: CUDA is not available, running on the CPU")
+    args.cuda = False
+
   if args.cfg_file is not None:
     cfg_from_file(args.cfg_file)
   if args.set_cfgs is not None:
@@ -185,7 +189,11 @@ if __name__ == '__main__':
   fasterRCNN.create_architecture()
 
   print("load checkpoint %s" % (load_name))
-  checkpoint = torch.load(load_name)
+  if args.cuda:
+    checkpoint = torch.load(load_name)
+  else:
+    # gpu checkpoints on a cpu-only machine
+    checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
   fasterRCNN.load_state_dict(checkpoint['model'])
   if 'pooling_mode' in checkpoint.keys():
     cfg.POOLING_MODE = checkpoint['pooling_mode']
@@ -294,12 +302,12 @@ if __name__ == '__main__':
           if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
           # Optionally normalize targets by a precomputed mean and stdev
             if args.class_agnostic:
-                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
+                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).type_as(box_deltas) \
+                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).type_as(box_deltas)
                 box_deltas = box_deltas.view(1, -1, 4)
             else:
-                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
+                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).type_as(box_deltas) \
+                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).type_as(box_deltas)
                 box_deltas = box_deltas.view(1, -1, 4 * len(pascal_classes))
 
           pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)
@@ -17,15 +17,14 @@ import pdb
 import time
 import cv2
 import torch
-from torch.autograd import Variable
 import torch.nn as nn
 import torch.optim as optim
 import pickle
 from roi_data_layer.roidb import combined_roidb
-from roi_data_layer.roibatchLoader import roibatchLoader
+from roi_data_layer.roibatchLoader import roibatchLoader, ratio_grouped_batches, pad_collate
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
 from model.rpn.bbox_transform import clip_boxes
-from model.nms.nms_wrapper import nms
+from model.nms.nms_wrapper import multiclass_nms
 from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections
 from model.faster_rcnn.vgg16 import vgg16
@@ -86,6 +85,9 @@ def parse_args():
   parser.add_argument('--bs', dest='batch_size',
                       help='batch_size',
                       default=1, type=int)
+  parser.add_argument('--nw', dest='num_workers',
+                      help='number of worker to load data',
+                      default=4, type=int)
   parser.add_argument('--vis', dest='vis',
                       help='visualization mode',
                       action='store_true')
@@ -105,6 +107,9 @@ if __name__ == '__main__':
 
   if torch.cuda.is_available() and not args.cuda:
     print("WARNING: You have a CUDA device, so you should probably run with --cuda")
+  if args.cuda and not torch.cuda.is_available():
+    print("WARNING: CUDA is not available, running on the CPU")
+    args.cuda = False
 
   np.random.seed(cfg.RNG_SEED)
   if args.dataset == "pascal_voc":
@@ -166,31 +171,17 @@ if __name__ == '__main__':
   fasterRCNN.create_architecture()
 
   print("load checkpoint %s" % (load_name))
-  checkpoint = torch.load(load_name)
+  if args.cuda:
+    checkpoint = torch.load(load_name)
+  else:
+    # gpu checkpoints on a cpu-only machine
+    checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
   fasterRCNN.load_state_dict(checkpoint['model'])
   if 'pooling_mode' in checkpoint.keys():
     cfg.POOLING_MODE = checkpoint['pooling_mode']
 
 
   print('load model successfully!')
-  # initilize the tensor holder here.
-  im_data = torch.FloatTensor(1)
-  im_info = torch.FloatTensor(1)
-  num_boxes = torch.LongTensor(1)
-  gt_boxes = torch.FloatTensor(1)
-
-  # ship to cuda
-  if args.cuda:
-    im_data = im_data.cuda()
-    im_info = im_info.cuda()
-    num_boxes = num_boxes.cuda()
-    gt_boxes = gt_boxes.cuda()
-
-  # make variable
-  im_data = Variable(im_data, volatile=True)
-  im_info = Variable(im_info, volatile=True)
-  num_boxes = Variable(num_boxes, volatile=True)
-  gt_boxes = Variable(gt_boxes, volatile=True)
 
   if args.cuda:
     cfg.CUDA = True
@@ -216,24 +207,29 @@ if __name__ == '__main__':
   output_dir = get_output_dir(imdb, save_name)
   dataset = roibatchLoader(roidb, ratio_list, ratio_index, args.batch_size, \
                         imdb.num_classes, training=False, normalize = False)
-  dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size,
-                            shuffle=False, num_workers=0,
-                            pin_memory=True)
-
-  data_iter = iter(dataloader)
+  # images of similar aspect ratio are batched together and padded to the
+  # largest one; the workers load the next batches while the model runs
+  batches = ratio_grouped_batches(ratio_index, args.batch_size)
+  dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batches,
+                            num_workers=args.num_workers, collate_fn=pad_collate,
+                            pin_memory=args.cuda)
 
   _t = {'im_detect': time.time(), 'misc': time.time()}
   det_file = os.path.join(output_dir, 'detections.pkl')
 
   fasterRCNN.eval()
   empty_array = np.transpose(np.array([[],[],[],[],[]]), (1,0))
-  for i in range(num_images):
-
-      data = next(data_iter)
-      im_data.data.resize_(data[0].size()).copy_(data[0])
-      im_info.data.resize_(data[1].size()).copy_(data[1])
-      gt_boxes.data.resize_(data[2].size()).copy_(data[2])
-      num_boxes.data.resize_(data[3].size()).copy_(data[3])
+  num_done = 0
+  loop_tic = time.time()
+  with torch.no_grad():
+    for batch_inds, data in zip(batches, dataloader):
+      im_data, im_info, gt_boxes, num_boxes = data
+      if args.cuda:
+          im_data = im_data.cuda(non_blocking=True)
+          im_info = im_info.cuda(non_blocking=True)
+          gt_boxes = gt_boxes.cuda(non_blocking=True)
+          num_boxes = num_boxes.cuda(non_blocking=True)
+      batch_size = im_data.size(0)
 
       det_tic = time.time()
       rois, cls_prob, bbox_pred, \
@@ -250,74 +246,54 @@ if __name__ == '__main__':
           if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
           # Optionally normalize targets by a precomputed mean and stdev
             if args.class_agnostic:
-                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                box_deltas = box_deltas.view(1, -1, 4)
+                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).type_as(box_deltas) \
+                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).type_as(box_deltas)
+                box_deltas = box_deltas.view(batch_size, -1, 4)
             else:
-                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                box_deltas = box_deltas.view(1, -1, 4 * len(imdb.classes))
+                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).type_as(box_deltas) \
+                           + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).type_as(box_deltas)
+                box_deltas = box_deltas.view(batch_size, -1, 4 * len(imdb.classes))
 
-          pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)
-          pred_boxes = clip_boxes(pred_boxes, im_info.data, 1)
+          pred_boxes = bbox_transform_inv(boxes, box_deltas, batch_size)
+          pred_boxes = clip_boxes(pred_boxes, im_info.data, batch_size)
       else:
           # Simply repeat the boxes, once for each class
-          pred_boxes = np.tile(boxes, (1, scores.shape[1]))
+          pred_boxes = boxes.repeat(1, 1, scores.size(-1))
 
-      pred_boxes /= data[1][0][2]
+      pred_boxes /= im_info.data[:, 2].contiguous().view(-1, 1, 1)
 
-      scores = scores.squeeze()
-      pred_boxes = pred_boxes.squeeze()
       det_toc = time.time()
       detect_time = det_toc - det_tic
       misc_tic = time.time()
-      if vis:
-          im = cv2.imread(imdb.image_path_at(i))
-          im2show = np.copy(im)
-      for j in xrange(1, imdb.num_classes):
-          inds = torch.nonzero(scores[:,j]>thresh).view(-1)
-          # if there is det
-          if inds.numel() > 0:
-            cls_scores = scores[:,j][inds]
-            _, order = torch.sort(cls_scores, 0, True)
-            if args.class_agnostic:
-              cls_boxes = pred_boxes[inds, :]
-            else:
-              cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-            
-            cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1)), 1)
-            # cls_dets = torch.cat((cls_boxes, cls_scores), 1)
-            cls_dets = cls_dets[order]
-            keep = nms(cls_dets, cfg.TEST.NMS)
-            cls_dets = cls_dets[keep.view(-1).long()]
-            if vis:
-              im2show = vis_detections(im2show, imdb.classes[j], cls_dets.cpu().numpy(), 0.3)
-            all_boxes[j][i] = cls_dets.cpu().numpy()
-          else:
-            all_boxes[j][i] = empty_array
-
-      # Limit to max_per_image detections *over all classes*
-      if max_per_image > 0:
-          image_scores = np.hstack([all_boxes[j][i][:, -1]
-                                    for j in xrange(1, imdb.num_classes)])
-          if len(image_scores) > max_per_image:
-              image_thresh = np.sort(image_scores)[-max_per_image]
-              for j in xrange(1, imdb.num_classes):
-                  keep = np.where(all_boxes[j][i][:, -1] >= image_thresh)[0]
-                  all_boxes[j][i] = all_boxes[j][i][keep, :]
+      for b, i in enumerate(batch_inds):
+          if vis:
+              im = cv2.imread(imdb.image_path_at(i))
+              im2show = np.copy(im)
+          # class-wise NMS and the max_per_image cut over all classes on the
+          # device, then a single copy of the detections to the host
+          cls_dets = multiclass_nms(scores[b], pred_boxes[b], thresh, cfg.TEST.NMS, max_per_image)
+          for j in xrange(1, imdb.num_classes):
+              all_boxes[j][i] = cls_dets[j] if len(cls_dets[j]) > 0 else empty_array
+              if vis:
+                im2show = vis_detections(im2show, imdb.classes[j], cls_dets[j], 0.3)
+
+          if vis:
+              cv2.imwrite('result.png', im2show)
+              pdb.set_trace()
+              #cv2.imshow('test', im2show)
+              #cv2.waitKey(0)
 
       misc_toc = time.time()
       nms_time = misc_toc - misc_tic
+      num_done += batch_size
 
       sys.stdout.write('im_detect: {:d}/{:d} {:.3f}s {:.3f}s   \r' \
-          .format(i + 1, num_images, detect_time, nms_time))
+          .format(num_done, num_images, detect_time, nms_time))
       sys.stdout.flush()
 
-      if vis:
-          cv2.imwrite('result.png', im2show)
-          pdb.set_trace()
-          #cv2.imshow('test', im2show)
-          #cv2.waitKey(0)
+  loop_time = time.time() - loop_tic
+  print('\n{:d} images in {:.1f}s, {:.2f} images/s at batch size {:d}'.format(
+      num_images, loop_time, num_images / loop_time, args.batch_size))
 
   with open(det_file, 'wb') as f:
       pickle.dump(all_boxes, f, pickle.HIGHEST_PROTOCOL)
@@ -27,6 +27,7 @@ from torch.utils.data.sampler import Sampler
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
+from model.rpn.anchor_grid import anchor_grids
 from model.utils.net_utils import weights_normal_init, save_net, load_net, \
       adjust_learning_rate, save_checkpoint, clip_gradient
 
@@ -357,6 +358,7 @@ if __name__ == '__main__':
         print("\t\t\tfg/bg=(%d/%d), time cost: %f" % (fg_cnt, bg_cnt, end-start))
         print("\t\t\trpn_cls: %.4f, rpn_box: %.4f, rcnn_cls: %.4f, rcnn_box %.4f" \
                       % (loss_rpn_cls, loss_rpn_box, loss_rcnn_cls, loss_rcnn_box))
+        print("\t\t\tanchor grids: %(hits)d hits, %(misses)d misses, %(size)d cached" % anchor_grids.stats())
         if args.use_tfboard:
           info = {
             'loss': loss_temp,
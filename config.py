@@ -30,6 +30,8 @@ class Config:
 	test_data_dir = 'data/coco/images/val2014'
 	test_ann_file = 'data/coco/annotations/instances_minival2014.json'
 	test_dt_file = 'data/output/detections_minival2014_results.json'
+	# processes matching the test detections while the model runs
+	eval_num_workers = 2
 
 	# SGD settings
 	momentum = 0.9
@@ -40,15 +42,26 @@ class Config:
 	num_workers = 6
 	data_shuffle = True
 	data_pin_memory = True
+	# binary caches of the parsed annotation and detection json files, see
+	# pycocotools.jsoncache ('' to parse the json files every time)
+	json_cache_dir = 'data/cache/json'
+	# precomputed action labels, see datasets.RL_coco_labels.ActionLabelStore
+	label_cache_dir = 'data/cache/RL_action_labels'
+	# cached layer3 features of the frozen trunk, see model.Reinforcement.feature_cache
+	# (needs a single image scale and no flip; '' to disable)
+	feature_cache_dir = ''
+	feature_cache_fp16 = True
 
 	# action settings
 	act_delta = [.5, .25, .125, .0625, .03125, .015625, .008]
 	act_iou_thres = 0
+	# multi-step refinement stops a box once its best action scores below this
+	refine_stop_thres = 0.
 
 	@staticmethod
 	def act_wtrans(x):
-		from math import fabs, sqrt, exp
-		return exp(fabs(x))
+		# applied elementwise on np.array of delta-IoUs
+		return np.exp(np.fabs(x))
 
 	def __init__(self, phase='train'):
 		self.phase = phase
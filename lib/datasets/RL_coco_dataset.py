@@ -7,54 +7,66 @@ import time
 import json
 import random
 import numpy as np
-from collections import defaultdict
 import logging
 
 import torch
 import torchvision.transforms as transforms
 from torch.utils.data import Dataset
 from pycocotools.coco import COCO
-from pycocotools.mask import iou as IoU
+from pycocotools.boxindex import BoxIndex
+from pycocotools import jsoncache
 
+from datasets.RL_coco_labels import image_delta_ious, label_store_key, ActionLabelStore
 from datasets.tools.pnw_static import get_weights_statistics
 
 class COCODataset(Dataset):
 	# TODO
 	"""
 	"""
-	def __init__(self, root_dir, ann_file, dt_file, bbox_action, transform_fn=None, normalize_fn=None):
+	def __init__(self, root_dir, ann_file, dt_file, bbox_action, transform_fn=None, normalize_fn=None,
+				label_cache_dir=None, feature_cache=None, json_cache_dir=None):
 		# TODO
 		"""
+		label_cache_dir: if given, delta-IoUs of all dt_boxes are computed once
+			into a memory-mapped ActionLabelStore there and read back by __getitem__
+		feature_cache: if given, a FeatureCache whose trunk feature maps are
+			returned in place of the images that it holds
+		json_cache_dir: if given, ann_file and dt_file are parsed once into
+			memory-mapped binary caches there (see pycocotools.jsoncache)
 		"""
 		logger = logging.getLogger('global')
 
 		self.root_dir = root_dir
 		self.transform_fn = transform_fn
 		self.normalize_fn = normalize_fn
+		self.set_feature_cache(feature_cache)
 		logger.info('Loading annotation files...')
-		self.cocoGt = COCO(ann_file)
+		self.cocoGt = COCO(ann_file, cacheDir=json_cache_dir or None)
 		self.imgIds = sorted(self.cocoGt.getImgIds())
 		self.catIds = sorted(self.cocoGt.getCatIds())
 		self.cat2cls = dict([(c, i) for i,c in enumerate(self.catIds)])
 		self.cls2cat = dict([(i, c) for i,c in enumerate(self.catIds)])
 		
-		## get groud-truth boxes
+		## get groud-truth boxes, as arrays shared with the workers
 		logger.info('Creating ground-truth bounding boxes...')
-		self.annIds = self.cocoGt.getAnnIds(imgIds=self.imgIds, catIds=self.catIds)
-		self.gt_boxes_list = self.cocoGt.loadAnns(self.annIds)
-		self.gt_boxes = defaultdict(list)
-		for gt in self.gt_boxes_list:
-			self.gt_boxes[gt['image_id'], gt['category_id']].append(gt)
+		self.gt_boxes = self.cocoGt.boxIndex.shareMemory()
 
-		## loading initial detection boxes from json file
+		## loading initial detection boxes from json file, the dicts are
+		## only kept while building the arrays
 		logger.info('Loading Detection bounding boxes...')
-		self.dt_boxes_list = json.load(open(dt_file, 'r'))
-		self.dt_boxes = defaultdict(list)
-		for dt in self.dt_boxes_list:
-			self.dt_boxes[dt['image_id'], dt['category_id']].append(dt)
+		if json_cache_dir:
+			self.dt_boxes = jsoncache.loadResults(dt_file, json_cache_dir)
+		else:
+			self.dt_boxes = BoxIndex.fromAnns(json.load(open(dt_file, 'r'))).shareMemory()
 
 		## define bbox actions
 		self.bbox_action = bbox_action
+		self.label_store = None
+		if label_cache_dir:
+			logger.info('Preparing action label store...')
+			self.label_store = ActionLabelStore.open_or_build(
+				label_cache_dir, ann_file, dt_file,
+				self.imgIds, self.catIds, self.dt_boxes, self.gt_boxes, self.bbox_action)
 		## Prepare the statistics of Delta-IoUs
 		logger.info('Preparing statistics of Delta-IoUs (weights)...')
 
@@ -63,7 +75,9 @@ class COCODataset(Dataset):
 			get_weights_statistics(
 				self.imgIds, self.catIds,
 				self.dt_boxes, self.gt_boxes, self.bbox_action, 
-				shuffle=True, maxDets=5000, num_workers=32)
+				shuffle=True, maxDets=5000, num_workers=32,
+				label_store=self.label_store, cache_dir=label_cache_dir,
+				cache_key=label_store_key(ann_file, dt_file, self.bbox_action))
 
 		self.pos_wratio = (self.pos_tot + self.neg_tot) / self.pos_weights / 2.
 		self.neg_wratio = (self.pos_tot + self.neg_tot) / self.neg_weights / 2.
@@ -76,11 +90,20 @@ class COCODataset(Dataset):
 		return len(self.imgIds)
 
 
+	def set_feature_cache(self, feature_cache):
+		if feature_cache is not None and self.transform_fn is not None:
+			assert not self.transform_fn.flip and \
+				self.transform_fn.scale_min == self.transform_fn.scale_max, \
+				'cached features need a single scale and no flip'
+		self.feature_cache = feature_cache
+
+
 	def __getitem__(self, idx):
 		'''
 		Args: index of data
 		Return: a single data:
-			img_data:	FloatTensor, shape [3, h, w]
+			img_data:	FloatTensor, shape [3, h, w],
+						or [C, h/16, w/16] trunk features if in the feature_cache
 			bboxes:		FloatTensor, shape [Nr_dts, 6] (x1, y1, x2, y2, score, cls_id, img_id)
 			labels:		FloatTensor, shape [Nr_dts, act_nums, 3] (act_id, label, weight)
 			im_info:	np.array of
@@ -97,56 +120,32 @@ class COCODataset(Dataset):
 		filename = os.path.join(self.root_dir, meta_img['file_name'])
 		origin_img_h, origin_img_w = meta_img['height'], meta_img['width']
 		
+		## generate bboxes and labels of all dt_boxes in image
+		generate_bboxes, generate_labels = self.generate_labels(img_id)
+
+		if self.feature_cache is not None and img_id in self.feature_cache:
+			## cached trunk features, no need to read the image
+			if self.transform_fn:
+				resize_scale = self.transform_fn.get_scale(origin_img_w, origin_img_h)
+			else:
+				resize_scale = 1
+			generate_bboxes[:, :4] *= resize_scale
+			resize_img_w = math.floor(origin_img_w * resize_scale)
+			resize_img_h = math.floor(origin_img_h * resize_scale)
+			img_data = self.feature_cache.load(img_id)
+			return [img_data,
+					torch.FloatTensor(generate_bboxes),
+					torch.FloatTensor(generate_labels),
+					[resize_img_h, resize_img_w, resize_scale,
+					origin_img_h, origin_img_w,
+					filename]]
+
 		## read image data
 		img = PIL.Image.open(filename)
 		if img.mode == 'L':
 			img = img.convert('RGB')
-		## enumerate dt_boxes in image
-		generate_bboxes = []
-		generate_labels = []
-		for cat_id in self.catIds:
-			for dt_box in self.dt_boxes[img_id, cat_id]:
-				#gtboxes = self.gt_boxes[img_id, cat_id]
-				bbox = dt_box['bbox']
-				w, h = bbox[2], bbox[3]
-
-				gtboxes = [g['bbox'] for g in self.gt_boxes[img_id, cat_id]]
-				iscrowd = [int(g['iscrowd']) for g in self.gt_boxes[img_id, cat_id]]
-				if len(gtboxes) == 0:
-					gtboxes = [[0,0,0,0]]
-					iscrowd = [0]
-
-				origin_ious = IoU([bbox], gtboxes, iscrowd)
-				
-				generate_label = []
-				## enumerate actions and apply to the bbox
-				for act_id, act_delta in enumerate(self.bbox_action.actDeltas):
-					new_bbox = bbox + act_delta * np.array([w, h, w, h])
-					new_ious = IoU([new_bbox], gtboxes, iscrowd)
-					delta_iou = new_ious.max() - origin_ious.max()
-
-					if delta_iou > self.bbox_action.iou_thres:
-						label = 1
-						weight = self.bbox_action.wtrans(delta_iou)
-						weight *= self.pos_wratio
-					else:
-						label = -1
-						weight = self.bbox_action.wtrans(delta_iou)
-						weight *= self.neg_wratio
-	
-					generate_label.append([act_id, label, weight])
-
-				## attach the generated bbox and labels
-				score = dt_box['score']
-				cls_id = self.cat2cls[cat_id]
-				bbox[2] += bbox[0]
-				bbox[3] += bbox[1]
-				generate_bboxes.append(bbox+[score]+[cat_id]+[img_id])
-				generate_labels.append(generate_label)
 
 		## image data processing
-		generate_bboxes = np.array(generate_bboxes)
-		generate_labels = np.array(generate_labels)
 		if self.transform_fn:
 			resize_scale, img, bboxes = self.transform_fn(img, generate_bboxes)
 		else:
@@ -171,6 +170,29 @@ class COCODataset(Dataset):
 				generate_labels,
 				im_info]
 
+	def generate_labels(self, img_id):
+		'''
+		Apply all actions to all dt_boxes of an image at once.
+		Return:
+			bboxes:	np.array of shape [Nr_dts, 7] (x1, y1, x2, y2, score, cat_id, img_id)
+			labels:	np.array of shape [Nr_dts, act_nums, 3] (act_id, label, weight)
+		'''
+		if self.label_store is not None:
+			bboxes, delta_ious = self.label_store[img_id]
+			bboxes = np.array(bboxes)
+		else:
+			bboxes, delta_ious = image_delta_ious(
+				img_id, self.catIds, self.dt_boxes, self.gt_boxes, self.bbox_action)
+
+		num_acts = self.bbox_action.num_acts
+		positive = delta_ious > self.bbox_action.iou_thres
+		labels = np.empty((bboxes.shape[0], num_acts, 3), dtype=np.float64)
+		labels[:, :, 0] = np.arange(num_acts)
+		labels[:, :, 1] = np.where(positive, 1, -1)
+		labels[:, :, 2] = self.bbox_action.wtrans(delta_ious) * \
+			np.where(positive, self.pos_wratio, self.neg_wratio)
+		return bboxes, labels
+
 class COCOTransform(object):
 	def __init__(self, sizes, max_size, flip=False):
 		if not isinstance(sizes, list):
@@ -180,13 +202,16 @@ class COCOTransform(object):
 		self.max_size = max_size
 		self.flip = flip
 
-	def __call__(self, img, bboxes):
-		image_w, image_h = img.size
+	def get_scale(self, image_w, image_h):
 		short = min(image_w, image_h)
 		large = max(image_w, image_h)
 
 		size = np.random.randint(self.scale_min, self.scale_max + 1)
-		scale = min(size / short, self.max_size / large)
+		return min(size / short, self.max_size / large)
+
+	def __call__(self, img, bboxes):
+		image_w, image_h = img.size
+		scale = self.get_scale(image_w, image_h)
 
 		new_image_w, new_image_h = math.floor(image_w * scale), math.floor(image_h * scale)
 
@@ -0,0 +1,196 @@
+from __future__ import division
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+STORE_MAGIC = b'RLACTLBL'
+STORE_VERSION = 2
+
+
+def image_delta_ious(img_id, catIds, dt_boxes, gt_boxes, bbox_action):
+	'''
+	Apply all actions to all dt_boxes of an image at once.
+	dt_boxes, gt_boxes: pycocotools.boxindex.BoxIndex of the detections / gts
+	Return:
+		bboxes:		np.array of shape [Nr_dts, 7] (x1, y1, x2, y2, score, cat_id, img_id)
+		delta_ious:	np.array of shape [Nr_dts, act_nums]
+	'''
+	dts = dt_boxes.rows(img_id, catIds)
+	gts = gt_boxes.rows(img_id, catIds)
+
+	xywh = dt_boxes.bboxes[dts]
+	dt_cats = dt_boxes.catIds[dts]
+	gtboxes = gt_boxes.bboxes[gts]
+	gt_cats = gt_boxes.catIds[gts]
+	iscrowd = gt_boxes.iscrowd[gts].astype(np.int64)
+
+	delta_ious = bbox_action.delta_ious(xywh, gtboxes, iscrowd, dt_cats, gt_cats)
+
+	bboxes = np.empty((len(dts), 7), dtype=np.float64)
+	bboxes[:, :2] = xywh[:, :2]
+	bboxes[:, 2:4] = xywh[:, 2:4] + xywh[:, :2]
+	bboxes[:, 4] = dt_boxes.scores[dts]
+	bboxes[:, 5] = dt_cats
+	bboxes[:, 6] = img_id
+	return bboxes, delta_ious
+
+
+def label_store_key(ann_file, dt_file, bbox_action):
+	'''
+	Hash of everything the delta-IoUs depend on: both json files
+	(by path, size and mtime) and the action deltas, and of the store
+	format version.
+	'''
+	sha = hashlib.sha1()
+	sha.update(('v%d' % STORE_VERSION).encode('utf-8'))
+	for filename in [ann_file, dt_file]:
+		stat = os.stat(filename)
+		sha.update(os.path.realpath(filename).encode('utf-8'))
+		sha.update(('%d:%d' % (stat.st_size, int(stat.st_mtime))).encode('utf-8'))
+	sha.update(np.ascontiguousarray(bbox_action.actDeltas, dtype=np.float32).tobytes())
+	return sha.hexdigest()
+
+
+class ActionLabelStore(object):
+	'''
+	Read-only, memory-mapped store of per-image detection boxes and
+	delta-IoUs of every action, built once by `build`.
+
+	File layout: magic, uint64 header length, json header, then the
+	sections listed in the header (img_ids, offsets, bboxes, delta_ious),
+	each aligned to 64 bytes. Rows of image img_ids[i] are
+	offsets[i]:offsets[i+1] of bboxes and delta_ious.
+	'''
+	SECTIONS = [('img_ids', np.int64), ('offsets', np.int64),
+				('bboxes', np.float64), ('delta_ious', np.float64)]
+
+	def __init__(self, filename):
+		self.filename = filename
+		with open(filename, 'rb') as f:
+			magic = f.read(len(STORE_MAGIC))
+			assert magic == STORE_MAGIC, '{} is not an action label store.'.format(filename)
+			header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+			self.header = json.loads(f.read(header_len).decode('utf-8'))
+		assert self.header['version'] == STORE_VERSION, \
+			'{} has version {}, expected {}.'.format(filename, self.header['version'], STORE_VERSION)
+
+		self.key = self.header['key']
+		self.num_acts = self.header['num_acts']
+		for name, dtype in self.SECTIONS:
+			offset, shape = self.header['sections'][name]
+			if np.prod(shape) == 0:
+				setattr(self, name, np.zeros(shape, dtype=dtype))
+			else:
+				setattr(self, name, np.memmap(filename, dtype=dtype, mode='r',
+											offset=offset, shape=tuple(shape)))
+		self.index = dict((int(img_id), i) for i, img_id in enumerate(self.img_ids))
+
+	def __len__(self):
+		return len(self.img_ids)
+
+	def __contains__(self, img_id):
+		return img_id in self.index
+
+	def __getitem__(self, img_id):
+		'''
+		Return zero-copy views (bboxes, delta_ious) of an image.
+		'''
+		i = self.index[img_id]
+		start, end = self.offsets[i], self.offsets[i + 1]
+		return self.bboxes[start:end], self.delta_ious[start:end]
+
+	@staticmethod
+	def path(cache_dir, key):
+		return os.path.join(cache_dir, 'actlabels_{}.bin'.format(key[:16]))
+
+	@classmethod
+	def build(cls, filename, key, imgIds, catIds, dt_boxes, gt_boxes, bbox_action, log_interval=5000):
+		num_dets = [dt_boxes.count(img_id, catIds) for img_id in imgIds]
+		labels = (image_delta_ious(img_id, catIds, dt_boxes, gt_boxes, bbox_action)
+				for img_id, num in zip(imgIds, num_dets) if num > 0)
+		return cls.write(filename, key, imgIds, num_dets, bbox_action.num_acts, labels,
+						log_interval=log_interval)
+
+	@classmethod
+	def write(cls, filename, key, imgIds, num_dets, num_acts, labels, extra_header=None, log_interval=5000):
+		'''
+		Stream labels, the (bboxes, delta_ious) of the images of imgIds with
+		num_dets > 0 in order, into a new store at filename.
+		extra_header: dict of additional json header entries
+		'''
+		logger = logging.getLogger('global')
+
+		offsets = np.zeros(len(imgIds) + 1, dtype=np.int64)
+		offsets[1:] = np.cumsum(num_dets)
+		total = int(offsets[-1])
+		shapes = {
+			'img_ids': [len(imgIds)],
+			'offsets': [len(offsets)],
+			'bboxes': [total, 7],
+			'delta_ious': [total, num_acts],
+		}
+
+		# the header size depends on the section offsets, so reserve room for it
+		header = dict(extra_header or {})
+		header.update({'version': STORE_VERSION, 'key': key, 'num_acts': num_acts,
+				'num_images': len(imgIds), 'num_dets': total, 'sections': {}})
+		pos = len(STORE_MAGIC) + 8 + len(json.dumps(header)) + 64 * (len(cls.SECTIONS) + 1)
+		for name, dtype in cls.SECTIONS:
+			pos = (pos + 63) // 64 * 64
+			header['sections'][name] = [pos, shapes[name]]
+			pos += int(np.prod(shapes[name])) * np.dtype(dtype).itemsize
+		header_bytes = json.dumps(header).encode('utf-8')
+		assert len(STORE_MAGIC) + 8 + len(header_bytes) <= header['sections']['img_ids'][0]
+
+		tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+		with open(tmpname, 'wb') as f:
+			f.write(STORE_MAGIC)
+			f.write(np.array([len(header_bytes)], dtype=np.uint64).tobytes())
+			f.write(header_bytes)
+			f.truncate(max(pos, f.tell()))
+
+		arrays = {}
+		for name, dtype in cls.SECTIONS:
+			offset, shape = header['sections'][name]
+			if np.prod(shape) == 0:
+				continue
+			arrays[name] = np.memmap(tmpname, dtype=dtype, mode='r+', offset=offset, shape=tuple(shape))
+		if len(imgIds) > 0:
+			arrays['img_ids'][:] = imgIds
+		arrays['offsets'][:] = offsets
+		labels = iter(labels)
+		for i in range(len(imgIds)):
+			if offsets[i + 1] > offsets[i]:
+				bboxes, delta_ious = next(labels)
+				arrays['bboxes'][offsets[i]:offsets[i + 1]] = bboxes
+				arrays['delta_ious'][offsets[i]:offsets[i + 1]] = delta_ious
+			if log_interval and (i + 1) % log_interval == 0:
+				logger.info('Action label store: {}/{} images'.format(i + 1, len(imgIds)))
+		for array in arrays.values():
+			array.flush()
+		del arrays
+		os.rename(tmpname, filename)
+		return cls(filename)
+
+	@classmethod
+	def open_or_build(cls, cache_dir, ann_file, dt_file, imgIds, catIds, dt_boxes, gt_boxes, bbox_action):
+		logger = logging.getLogger('global')
+		key = label_store_key(ann_file, dt_file, bbox_action)
+		filename = cls.path(cache_dir, key)
+		if os.path.isfile(filename):
+			try:
+				store = cls(filename)
+			except Exception as e:
+				# an unreadable store, or one of another version, is rebuilt
+				logger.info('Ignoring action label store {}: {}'.format(filename, e))
+				store = None
+			if store is not None and store.key == key and store.num_acts == bbox_action.num_acts:
+				logger.info('Loaded action label store {}'.format(filename))
+				return store
+		logger.info('Building action label store {}...'.format(filename))
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+		return cls.build(filename, key, imgIds, catIds, dt_boxes, gt_boxes, bbox_action)
@@ -1,20 +1,72 @@
 import os
 import torch
-import torch.nn.functional as F
 from torch.autograd import Variable
 from torch.utils.data import DataLoader
 import numpy as np
 
+def _in_worker():
+    # collating in a DataLoader worker process
+    get_worker_info = getattr(torch.utils.data, 'get_worker_info', None)
+    if get_worker_info is not None:
+        return get_worker_info() is not None
+    return getattr(torch.utils.data.dataloader, '_use_shared_memory', False)
+
+
 class COCODataLoader(DataLoader):
     #TODO
     """
-
+    Collates each image, bboxes and labels of a batch straight into its
+    slice of the batch tensors. The batches are served from a ring of
+    num_buffers staging buffers, grown to the largest batch and reused,
+    pinned if pin_memory in place of the copy the DataLoader pins each
+    batch to: a batch is valid until num_buffers more are loaded. Collating
+    in this process (num_workers=0) writes into the staging buffers, the
+    workers collate into new tensors in shared memory, as they send them,
+    which this process copies into the staging buffers. No staging buffers
+    if num_buffers is 0.
     """
     def __init__(self, dataset, batch_size=1, shuffle=False, sampler=None, batch_sampler=None,
-                 num_workers=0, pin_memory=False, drop_last=False):
+                 num_workers=0, pin_memory=False, drop_last=False, num_buffers=2):
+        # the staging buffers are pinned already, not copied again
+        self._pin_buffers = pin_memory and num_buffers > 0 and torch.cuda.is_available()
         super(COCODataLoader, self).__init__(dataset, batch_size, shuffle, sampler, batch_sampler,
-                                        num_workers, self._collate_fn, pin_memory, drop_last)
-
+                                        num_workers, self._collate_fn,
+                                        pin_memory and not self._pin_buffers, drop_last)
+        self._buffers = [{} for _ in range(num_buffers)]
+        self._next_buffer = 0
+
+    def __iter__(self):
+        batches = super(COCODataLoader, self).__iter__()
+        if self.num_workers == 0 or not self._buffers:
+            return batches
+        return self._staged(batches)
+
+    def _staged(self, batches):
+        # the batches of the workers, copied into the staging buffers
+        for images, bboxes, labels, im_infos in batches:
+            buffers = self._take_buffers()
+            staged = [self._batch_tensor(buffers, name, tensor.size()).copy_(tensor)
+                      for name, tensor in (('images', images.data), ('bboxes', bboxes),
+                                           ('labels', labels))]
+            yield [Variable(staged[0]), staged[1], staged[2], im_infos]
+
+    def _take_buffers(self):
+        buffers = self._buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % len(self._buffers)
+        return buffers
+
+    def _batch_tensor(self, buffers, name, shape):
+        numel = int(np.prod(shape))
+        if buffers is None:
+            tensor = torch.FloatTensor(*shape)
+            return tensor.share_memory_() if _in_worker() else tensor
+        flat = buffers.get(name)
+        if flat is None or flat.numel() < numel:
+            flat = torch.FloatTensor(numel)
+            if self._pin_buffers:
+                flat = flat.pin_memory()
+            buffers[name] = flat
+        return flat[:numel].view(*shape)
 
     def _collate_fn(self, batch):
         '''
@@ -46,28 +98,38 @@ class COCODataLoader(DataLoader):
         num_acts = max([_.shape[1] for _ in generate_labels])
         assert(max_num_bboxes > 0)
 
-        padded_images = torch.FloatTensor(batch_size, 3, max_img_h, max_img_w)
-        padded_bboxes = torch.FloatTensor(batch_size, max_num_bboxes, 8)
-        padded_labels = torch.FloatTensor(batch_size, max_num_bboxes, num_acts, 3)
+        # the staging buffers of this batch, none in a worker
+        buffers = None
+        if self._buffers and not _in_worker():
+            buffers = self._take_buffers()
+
+        # images may also be cached trunk features of any number of channels
+        padded_images = self._batch_tensor(buffers, 'images',
+                                           (batch_size, images[0].shape[0], max_img_h, max_img_w))
+        padded_bboxes = self._batch_tensor(buffers, 'bboxes',
+                                           (batch_size, max_num_bboxes, 1 + generate_bboxes[0].shape[-1]))
+        padded_labels = self._batch_tensor(buffers, 'labels',
+                                           (batch_size, max_num_bboxes, num_acts, 3))
         for bid in range(batch_size):
             img = images[bid]
             bboxes = generate_bboxes[bid]
             labels = generate_labels[bid]
 
-            # pad zeros to right bottom of each image
-            pad_size = (0, max_img_w - img.shape[-1], 0, max_img_h - img.shape[-2])
-            padded_images[bid] = F.pad(img, pad_size).data
-
-            # pad zeros to bboxes
-            new_bboxes = torch.FloatTensor(max_num_bboxes, bboxes.shape[-1]).zero_()
-            new_bboxes[:bboxes.shape[0]] = bboxes
-            batch_id = torch.FloatTensor([bid]).expand((max_num_bboxes, 1))
-            padded_bboxes[bid] = torch.cat([batch_id, new_bboxes], dim=1)
-
-            # pad zeros to labels
-            new_labels = torch.FloatTensor(max_num_bboxes, labels.shape[-2], labels.shape[-1]).zero_()
-            new_labels[:labels.shape[0]] = labels
-            padded_labels[bid] = new_labels
+            # copy each image to its slice, zeros to its right bottom
+            img_h, img_w = img.shape[-2], img.shape[-1]
+            padded_images[bid, :, :img_h, :img_w].copy_(img)
+            padded_images[bid, :, :img_h, img_w:].zero_()
+            padded_images[bid, :, img_h:].zero_()
+
+            # batch id, then bboxes padded with zeros
+            num_bboxes = bboxes.shape[0]
+            padded_bboxes[bid, :, 0].fill_(bid)
+            padded_bboxes[bid, :num_bboxes, 1:].copy_(bboxes)
+            padded_bboxes[bid, num_bboxes:, 1:].zero_()
+
+            # labels padded with zeros
+            padded_labels[bid, :labels.shape[0]].copy_(labels)
+            padded_labels[bid, labels.shape[0]:].zero_()
         padded_images_var = Variable(padded_images)
 
         return [padded_images_var,
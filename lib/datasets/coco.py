@@ -21,7 +21,7 @@ import json
 import uuid
 # COCO API
 from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
+from pycocotools.fasteval import FastCOCOeval
 from pycocotools import mask as COCOmask
 
 class coco(imdb):
@@ -254,7 +254,7 @@ class coco(imdb):
   def _do_detection_eval(self, res_file, output_dir):
     ann_type = 'bbox'
     coco_dt = self._COCO.loadRes(res_file)
-    coco_eval = COCOeval(self._COCO, coco_dt)
+    coco_eval = FastCOCOeval(self._COCO, coco_dt)
     coco_eval.params.useSegm = (ann_type == 'segm')
     coco_eval.evaluate()
     coco_eval.accumulate()
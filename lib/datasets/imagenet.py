@@ -10,7 +10,8 @@ import datasets
 import datasets.imagenet
 import os, sys
 from datasets.imdb import imdb
-import xml.dom.minidom as minidom
+from datasets.xml_annotations import load_annotations, parse_annotation_file, \
+    annotation_cache_file
 import numpy as np
 import scipy.sparse
 import scipy.io as sio
@@ -160,8 +161,12 @@ class imagenet(imdb):
             print('{} gt roidb loaded from {}'.format(self.name, cache_file))
             return roidb
 
-        gt_roidb = [self._load_imagenet_annotation(index)
-                    for index in self.image_index]
+        records = load_annotations(
+            [self._annotation_path(index) for index in self.image_index],
+            annotation_cache_file(self.cache_path,
+                                  os.path.join(self._data_path, 'Annotations', self._image_set)))
+        gt_roidb = [self._load_imagenet_annotation(index, record)
+                    for index, record in zip(self.image_index, records)]
         with open(cache_file, 'wb') as fid:
             pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
         print('wrote gt roidb to {}'.format(cache_file))
@@ -169,20 +174,18 @@ class imagenet(imdb):
         return gt_roidb
 
 
-    def _load_imagenet_annotation(self, index):
+    def _annotation_path(self, index):
+        return os.path.join(self._data_path, 'Annotations', self._image_set, index + '.xml')
+
+    def _load_imagenet_annotation(self, index, record=None):
         """
-        Load image and bounding boxes info from txt files of imagenet.
+        Load image and bounding boxes info from txt files of imagenet,
+        or from the record of xml_annotations of the file.
         """
-        filename = os.path.join(self._data_path, 'Annotations', self._image_set, index + '.xml')
-
-        # print 'Loading: {}'.format(filename)
-        def get_data_from_tag(node, tag):
-            return node.getElementsByTagName(tag)[0].childNodes[0].data
-
-        with open(filename) as f:
-            data = minidom.parseString(f.read())
+        if record is None:
+            record = parse_annotation_file(self._annotation_path(index))
 
-        objs = data.getElementsByTagName('object')
+        objs = record['objects']
         num_objs = len(objs)
 
         boxes = np.zeros((num_objs, 4), dtype=np.uint16)
@@ -191,12 +194,9 @@ class imagenet(imdb):
 
         # Load object bounding boxes into a data frame.
         for ix, obj in enumerate(objs):
-            x1 = float(get_data_from_tag(obj, 'xmin'))
-            y1 = float(get_data_from_tag(obj, 'ymin'))
-            x2 = float(get_data_from_tag(obj, 'xmax'))
-            y2 = float(get_data_from_tag(obj, 'ymax'))
+            x1, y1, x2, y2 = [float(v) for v in obj['bbox']]
             cls = self._wnid_to_ind[
-                    str(get_data_from_tag(obj, "name")).lower().strip()]
+                    str(obj['name']).lower().strip()]
             boxes[ix, :] = [x1, y1, x2, y2]
             gt_classes[ix] = cls
             overlaps[ix, cls] = 1.0
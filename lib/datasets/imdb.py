@@ -10,15 +10,104 @@ from __future__ import print_function
 
 import os
 import os.path as osp
+import multiprocessing
 import PIL
 from model.utils.cython_bbox import bbox_overlaps
 import numpy as np
 import scipy.sparse
 from model.utils.config import cfg
+from roi_data_layer.columnar_roidb import ColumnarRoidb
 import pdb
 
 ROOT_DIR = osp.join(osp.dirname(__file__), '..', '..')
 
+# area ranges of the gt boxes in evaluate_recall
+AREA_RANGES = {'all': [0 ** 2, 1e5 ** 2],
+               'small': [0 ** 2, 32 ** 2],
+               'medium': [32 ** 2, 96 ** 2],
+               'large': [96 ** 2, 1e5 ** 2],
+               '96-128': [96 ** 2, 128 ** 2],
+               '128-256': [128 ** 2, 256 ** 2],
+               '256-512': [256 ** 2, 512 ** 2],
+               '512-inf': [512 ** 2, 1e5 ** 2]}
+
+
+def greedy_gt_overlaps(overlaps):
+  """Overlap of each gt box with the proposal assigned to it by taking the
+  (proposal, gt) pairs by decreasing overlap, then gt and proposal index,
+  skipping the pairs of a proposal or gt already taken.
+
+  The sweep is over the pairs of positive overlap sorted once: a pair
+  that comes first for both its gt and its proposal is taken, all such
+  pairs at once, then the pairs of their gts and proposals dropped, until
+  none is left. The gts left get an overlap of 0 while proposals are left,
+  the others none.
+  """
+  num_boxes, num_gts = overlaps.shape
+  candidates = overlaps > 0
+  if num_boxes > num_gts > 0:
+    # a gt is taken with one of its num_gts best proposals, the others
+    # being taken by at most num_gts - 1 gts before it
+    kth = np.partition(overlaps, num_boxes - num_gts, axis=0)[num_boxes - num_gts]
+    candidates &= overlaps >= kth[None, :]
+  box_inds, gt_inds = np.nonzero(candidates)
+  values = overlaps[box_inds, gt_inds]
+  order = np.lexsort((box_inds, gt_inds, -values))
+  box_inds, gt_inds, values = box_inds[order], gt_inds[order], values[order]
+  taken = []
+  while len(values) > 0:
+    first = np.zeros(len(values), dtype=bool)
+    first[np.unique(gt_inds, return_index=True)[1]] = True
+    first_box = np.zeros(len(values), dtype=bool)
+    first_box[np.unique(box_inds, return_index=True)[1]] = True
+    first &= first_box
+    taken.append(values[first])
+    used_gts = np.zeros(num_gts, dtype=bool)
+    used_gts[gt_inds[first]] = True
+    used_boxes = np.zeros(num_boxes, dtype=bool)
+    used_boxes[box_inds[first]] = True
+    keep = np.where(~(used_gts[gt_inds] | used_boxes[box_inds]))[0]
+    box_inds, gt_inds, values = box_inds[keep], gt_inds[keep], values[keep]
+  taken = np.concatenate(taken + [np.zeros(0)])
+  num_zeros = max(min(num_gts, num_boxes) - len(taken), 0)
+  return np.concatenate((taken, np.zeros(num_zeros)))
+
+
+# gt boxes, gt areas and proposals of the images, set in the workers of
+# evaluate_recalls by the pool initializer
+_recall_images = None
+
+
+def _init_recall_worker(images):
+  global _recall_images
+  _recall_images = images
+
+
+def _recall_shard(task):
+  # gt overlaps of every area range and limit, and number of gts of every
+  # area range, of the images start:end
+  start, end, area_ranges, limits = task
+  gt_boxes_list, gt_areas_list, boxes_list = _recall_images
+  max_limit = None if None in limits else max(limits)
+  gt_overlaps = [[[] for limit in limits] for area_range in area_ranges]
+  num_pos = [0 for area_range in area_ranges]
+  for i in range(start, end):
+    gt_boxes, gt_areas, boxes = gt_boxes_list[i], gt_areas_list[i], boxes_list[i]
+    valid = [np.where((gt_areas >= area_range[0]) & (gt_areas <= area_range[1]))[0]
+             for area_range in area_ranges]
+    for a in range(len(area_ranges)):
+      num_pos[a] += len(valid[a])
+    if boxes.shape[0] == 0:
+      continue
+    # the overlaps of the largest limit hold those of the others
+    overlaps = bbox_overlaps(boxes[:max_limit].astype(np.float),
+                             gt_boxes.astype(np.float))
+    for a in range(len(area_ranges)):
+      area_overlaps = overlaps[:, valid[a]]
+      for l, limit in enumerate(limits):
+        gt_overlaps[a][l].append(greedy_gt_overlaps(area_overlaps[:limit]))
+  return gt_overlaps, num_pos
+
 class imdb(object):
   """Image database."""
 
@@ -71,6 +160,7 @@ class imdb(object):
     #   gt_overlaps
     #   gt_classes
     #   flipped
+    # or the ColumnarRoidb of combined_roidb, which gives such dicts
     if self._roidb is not None:
       return self._roidb
     self._roidb = self.roidb_handler()
@@ -139,84 +229,107 @@ class imdb(object):
             'thresholds': vector of IoU overlap thresholds
             'gt_overlaps': vector of all ground-truth overlaps
     """
+    return self.evaluate_recalls(candidate_boxes, thresholds, areas=[area],
+                                 limits=[limit], num_workers=1)[area, limit]
+
+  def evaluate_recalls(self, candidate_boxes=None, thresholds=None,
+                       areas=('all',), limits=(None,), num_workers=None):
+    """Evaluate detection proposal recall metrics of several gt area
+    ranges and proposal limits in one pass over the images, sharded over
+    num_workers processes (the number of CPUs if None).
+
+    Returns:
+        results: dictionary of the results of evaluate_recall by
+            (area, limit)
+    """
     # Record max overlap value for each gt box
     # Return vector of overlap values
-    areas = {'all': 0, 'small': 1, 'medium': 2, 'large': 3,
-             '96-128': 4, '128-256': 5, '256-512': 6, '512-inf': 7}
-    area_ranges = [[0 ** 2, 1e5 ** 2],  # all
-                   [0 ** 2, 32 ** 2],  # small
-                   [32 ** 2, 96 ** 2],  # medium
-                   [96 ** 2, 1e5 ** 2],  # large
-                   [96 ** 2, 128 ** 2],  # 96-128
-                   [128 ** 2, 256 ** 2],  # 128-256
-                   [256 ** 2, 512 ** 2],  # 256-512
-                   [512 ** 2, 1e5 ** 2],  # 512-inf
-                   ]
-    assert area in areas, 'unknown area range: {}'.format(area)
-    area_range = area_ranges[areas[area]]
-    gt_overlaps = np.zeros(0)
-    num_pos = 0
+    for area in areas:
+      assert area in AREA_RANGES, 'unknown area range: {}'.format(area)
+    area_ranges = [AREA_RANGES[area] for area in areas]
+    limits = list(limits)
+    images = self._recall_images(candidate_boxes)
+
+    if num_workers is None:
+      num_workers = multiprocessing.cpu_count()
+    num_shards = min(max(num_workers, 1) * 4, max(self.num_images, 1))
+    bounds = np.linspace(0, self.num_images, num_shards + 1).astype(int)
+    tasks = [(bounds[k], bounds[k + 1], area_ranges, limits) for k in range(num_shards)]
+    if num_workers > 1 and num_shards > 1:
+      # the images are given to the workers once, by fork where it is used
+      pool = multiprocessing.Pool(min(num_workers, num_shards), _init_recall_worker, (images,))
+      try:
+        shards = pool.map(_recall_shard, tasks)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      _init_recall_worker(images)
+      shards = [_recall_shard(task) for task in tasks]
+
+    if thresholds is None:
+      step = 0.05
+      thresholds = np.arange(0.5, 0.95 + 1e-5, step)
+    results = {}
+    for a, area in enumerate(areas):
+      num_pos = sum(num_pos[a] for _, num_pos in shards)
+      for l, limit in enumerate(limits):
+        gt_overlaps = np.sort(np.concatenate(
+          [np.zeros(0)] + [o for gt_overlaps, _ in shards for o in gt_overlaps[a][l]]))
+        recalls = np.zeros_like(thresholds)
+        # compute recall for each iou threshold
+        for i, t in enumerate(thresholds):
+          recalls[i] = (gt_overlaps >= t).sum() / float(num_pos)
+        # ar = 2 * np.trapz(recalls, thresholds)
+        ar = recalls.mean()
+        results[area, limit] = {'ar': ar, 'recalls': recalls, 'thresholds': thresholds,
+                                'gt_overlaps': gt_overlaps}
+    return results
+
+  def _recall_images(self, candidate_boxes):
+    """gt boxes, gt areas and proposals of every image for evaluate_recalls,
+    sliced from the columns of the roidb if it is a ColumnarRoidb"""
+    roidb = self.roidb
+    gt_boxes_list = []
+    gt_areas_list = []
+    boxes_list = []
+    if isinstance(roidb, ColumnarRoidb):
+      # Checking for max_overlaps == 1 avoids including crowd annotations
+      overlaps = scipy.sparse.csr_matrix(
+        (roidb.overlap_data, roidb.overlap_indices, roidb.overlap_indptr),
+        shape=(len(roidb.boxes), roidb.num_classes))
+      max_gt_overlaps = overlaps.max(axis=1).toarray().ravel()
+      is_gt = (roidb.gt_classes > 0) & (max_gt_overlaps == 1)
+      for i in range(self.num_images):
+        start, end = roidb.box_range(i)
+        gt_inds = np.where(is_gt[start:end])[0]
+        gt_boxes_list.append(roidb.boxes[start:end][gt_inds, :])
+        gt_areas_list.append(roidb.seg_areas[start:end][gt_inds])
+        if candidate_boxes is None:
+          non_gt_inds = np.where(roidb.gt_classes[start:end] == 0)[0]
+          boxes_list.append(roidb.boxes[start:end][non_gt_inds, :])
+        else:
+          boxes_list.append(candidate_boxes[i])
+      return gt_boxes_list, gt_areas_list, boxes_list
+
     for i in range(self.num_images):
       # Checking for max_overlaps == 1 avoids including crowd annotations
       # (...pretty hacking :/)
-      max_gt_overlaps = self.roidb[i]['gt_overlaps'].toarray().max(axis=1)
-      gt_inds = np.where((self.roidb[i]['gt_classes'] > 0) &
+      entry = roidb[i]
+      max_gt_overlaps = entry['gt_overlaps'].toarray().max(axis=1)
+      gt_inds = np.where((entry['gt_classes'] > 0) &
                          (max_gt_overlaps == 1))[0]
-      gt_boxes = self.roidb[i]['boxes'][gt_inds, :]
-      gt_areas = self.roidb[i]['seg_areas'][gt_inds]
-      valid_gt_inds = np.where((gt_areas >= area_range[0]) &
-                               (gt_areas <= area_range[1]))[0]
-      gt_boxes = gt_boxes[valid_gt_inds, :]
-      num_pos += len(valid_gt_inds)
+      gt_boxes_list.append(entry['boxes'][gt_inds, :])
+      gt_areas_list.append(entry['seg_areas'][gt_inds])
 
       if candidate_boxes is None:
         # If candidate_boxes is not supplied, the default is to use the
         # non-ground-truth boxes from this roidb
-        non_gt_inds = np.where(self.roidb[i]['gt_classes'] == 0)[0]
-        boxes = self.roidb[i]['boxes'][non_gt_inds, :]
+        non_gt_inds = np.where(entry['gt_classes'] == 0)[0]
+        boxes_list.append(entry['boxes'][non_gt_inds, :])
       else:
-        boxes = candidate_boxes[i]
-      if boxes.shape[0] == 0:
-        continue
-      if limit is not None and boxes.shape[0] > limit:
-        boxes = boxes[:limit, :]
-
-      overlaps = bbox_overlaps(boxes.astype(np.float),
-                               gt_boxes.astype(np.float))
-
-      _gt_overlaps = np.zeros((gt_boxes.shape[0]))
-      for j in range(gt_boxes.shape[0]):
-        # find which proposal box maximally covers each gt box
-        argmax_overlaps = overlaps.argmax(axis=0)
-        # and get the iou amount of coverage for each gt box
-        max_overlaps = overlaps.max(axis=0)
-        # find which gt box is 'best' covered (i.e. 'best' = most iou)
-        gt_ind = max_overlaps.argmax()
-        gt_ovr = max_overlaps.max()
-        assert (gt_ovr >= 0)
-        # find the proposal box that covers the best covered gt box
-        box_ind = argmax_overlaps[gt_ind]
-        # record the iou coverage of this gt box
-        _gt_overlaps[j] = overlaps[box_ind, gt_ind]
-        assert (_gt_overlaps[j] == gt_ovr)
-        # mark the proposal box and the gt box as used
-        overlaps[box_ind, :] = -1
-        overlaps[:, gt_ind] = -1
-      # append recorded iou coverage level
-      gt_overlaps = np.hstack((gt_overlaps, _gt_overlaps))
-
-    gt_overlaps = np.sort(gt_overlaps)
-    if thresholds is None:
-      step = 0.05
-      thresholds = np.arange(0.5, 0.95 + 1e-5, step)
-    recalls = np.zeros_like(thresholds)
-    # compute recall for each iou threshold
-    for i, t in enumerate(thresholds):
-      recalls[i] = (gt_overlaps >= t).sum() / float(num_pos)
-    # ar = 2 * np.trapz(recalls, thresholds)
-    ar = recalls.mean()
-    return {'ar': ar, 'recalls': recalls, 'thresholds': thresholds,
-            'gt_overlaps': gt_overlaps}
+        boxes_list.append(candidate_boxes[i])
+    return gt_boxes_list, gt_areas_list, boxes_list
 
   def create_roidb_from_box_list(self, box_list, gt_roidb):
     assert len(box_list) == self.num_images, \
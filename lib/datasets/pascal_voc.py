@@ -18,12 +18,13 @@ import math
 import glob
 import uuid
 import scipy.io as sio
-import xml.etree.ElementTree as ET
 import pickle
 from .imdb import imdb
 from .imdb import ROOT_DIR
 from . import ds_utils
-from .voc_eval import voc_eval
+from .voc_eval import voc_eval, voc_eval_boxes, load_recs, class_gts, map_classes
+from .xml_annotations import load_annotations, parse_annotation_file, \
+    annotation_cache_file
 
 # TODO: make fast_rcnn irrelevant
 # >>>> obsolete, because it depends on sth outside of this project
@@ -128,8 +129,12 @@ class pascal_voc(imdb):
             print('{} gt roidb loaded from {}'.format(self.name, cache_file))
             return roidb
 
-        gt_roidb = [self._load_pascal_annotation(index)
-                    for index in self.image_index]
+        records = load_annotations(
+            [self._annotation_path(index) for index in self.image_index],
+            annotation_cache_file(self.cache_path,
+                                  os.path.join(self._data_path, 'Annotations')))
+        gt_roidb = [self._load_pascal_annotation(index, record)
+                    for index, record in zip(self.image_index, records)]
         with open(cache_file, 'wb') as fid:
             pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
         print('wrote gt roidb to {}'.format(cache_file))
@@ -202,18 +207,21 @@ class pascal_voc(imdb):
 
         return self.create_roidb_from_box_list(box_list, gt_roidb)
 
-    def _load_pascal_annotation(self, index):
+    def _annotation_path(self, index):
+        return os.path.join(self._data_path, 'Annotations', index + '.xml')
+
+    def _load_pascal_annotation(self, index, record=None):
         """
         Load image and bounding boxes info from XML file in the PASCAL VOC
-        format.
+        format, or from its record of xml_annotations.
         """
-        filename = os.path.join(self._data_path, 'Annotations', index + '.xml')
-        tree = ET.parse(filename)
-        objs = tree.findall('object')
+        if record is None:
+            record = parse_annotation_file(self._annotation_path(index))
+        objs = record['objects']
         # if not self.config['use_diff']:
         #     # Exclude the samples labeled as difficult
         #     non_diff_objs = [
-        #         obj for obj in objs if int(obj.find('difficult').text) == 0]
+        #         obj for obj in objs if int(obj['difficult']) == 0]
         #     # if len(non_diff_objs) != len(objs):
         #     #     print 'Removed {} difficult objects'.format(
         #     #         len(objs) - len(non_diff_objs))
@@ -229,18 +237,14 @@ class pascal_voc(imdb):
 
         # Load object bounding boxes into a data frame.
         for ix, obj in enumerate(objs):
-            bbox = obj.find('bndbox')
             # Make pixel indexes 0-based
-            x1 = float(bbox.find('xmin').text) - 1
-            y1 = float(bbox.find('ymin').text) - 1
-            x2 = float(bbox.find('xmax').text) - 1
-            y2 = float(bbox.find('ymax').text) - 1
+            x1, y1, x2, y2 = [float(v) - 1 for v in obj['bbox']]
 
-            diffc = obj.find('difficult')
-            difficult = 0 if diffc == None else int(diffc.text)
+            diffc = obj['difficult']
+            difficult = 0 if diffc == None else int(diffc)
             ishards[ix] = difficult
 
-            cls = self._class_to_ind[obj.find('name').text.lower().strip()]
+            cls = self._class_to_ind[obj['name'].lower().strip()]
             boxes[ix, :] = [x1, y1, x2, y2]
             gt_classes[ix] = cls
             overlaps[ix, cls] = 1.0
@@ -287,7 +291,11 @@ class pascal_voc(imdb):
                                        dets[k, 0] + 1, dets[k, 1] + 1,
                                        dets[k, 2] + 1, dets[k, 3] + 1))
 
-    def _do_python_eval(self, output_dir='output'):
+    def _do_python_eval(self, output_dir='output', all_boxes=None):
+        """
+        AP of every class, of the detections of all_boxes in memory, or of
+        the results files if None, the classes evaluated in parallel.
+        """
         annopath = os.path.join(
             self._devkit_path,
             'VOC' + self._year,
@@ -306,13 +314,20 @@ class pascal_voc(imdb):
         print('VOC07 metric? ' + ('Yes' if use_07_metric else 'No'))
         if not os.path.isdir(output_dir):
             os.mkdir(output_dir)
-        for i, cls in enumerate(self._classes):
-            if cls == '__background__':
-                continue
-            filename = self._get_voc_results_file_template().format(cls)
-            rec, prec, ap = voc_eval(
-                filename, annopath, imagesetfile, cls, cachedir, ovthresh=0.5,
-                use_07_metric=use_07_metric)
+        classes = [(i, cls) for i, cls in enumerate(self._classes)
+                   if cls != '__background__']
+        # cache the annotations once, for all the classes
+        imagenames, recs = load_recs(annopath, imagesetfile, cachedir)
+        if all_boxes is None:
+            results = map_classes(voc_eval, [
+                (self._get_voc_results_file_template().format(cls), annopath,
+                 imagesetfile, cls, cachedir, 0.5, use_07_metric)
+                for i, cls in classes])
+        else:
+            results = map_classes(voc_eval_boxes, [
+                (all_boxes[i],) + class_gts(recs, imagenames, cls) + (0.5, use_07_metric)
+                for i, cls in classes])
+        for (i, cls), (rec, prec, ap) in zip(classes, results):
             aps += [ap]
             print('AP for {} = {:.4f}'.format(cls, ap))
             with open(os.path.join(output_dir, cls + '_pr.pkl'), 'wb') as f:
@@ -348,11 +363,15 @@ class pascal_voc(imdb):
         status = subprocess.call(cmd, shell=True)
 
     def evaluate_detections(self, all_boxes, output_dir):
-        self._write_voc_results_file(all_boxes)
-        self._do_python_eval(output_dir)
+        # the python eval reads all_boxes, the results files are for the
+        # matlab eval and the submissions only
+        write_results = self.config['matlab_eval'] or not self.config['cleanup']
+        if write_results:
+            self._write_voc_results_file(all_boxes)
+        self._do_python_eval(output_dir, all_boxes)
         if self.config['matlab_eval']:
             self._do_matlab_eval(output_dir)
-        if self.config['cleanup']:
+        if self.config['cleanup'] and write_results:
             for cls in self._classes:
                 if cls == '__background__':
                     continue
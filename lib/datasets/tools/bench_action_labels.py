@@ -0,0 +1,126 @@
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pycocotools.mask import iou as IoU
+from pycocotools.boxindex import BoxIndex
+from datasets.RL_coco_dataset import COCODataset
+from model.Reinforcement.action import Action
+
+"""Benchmark of COCODataset.generate_labels against the original per
+(box, action) loop over pycocotools.mask.iou, on synthetic detections.
+
+	python lib/datasets/tools/bench_action_labels.py --dets 100 300
+"""
+
+def loop_generate_labels(dataset, img_id, gt_boxes, dt_boxes):
+	# the original loop of COCODataset.__getitem__, kept as the reference,
+	# on dicts of boxes keyed by (image_id, category_id)
+	generate_bboxes = []
+	generate_labels = []
+	for cat_id in dataset.catIds:
+		for dt_box in dt_boxes[img_id, cat_id]:
+			bbox = list(dt_box['bbox'])
+			w, h = bbox[2], bbox[3]
+
+			gtboxes = [g['bbox'] for g in gt_boxes[img_id, cat_id]]
+			iscrowd = [int(g['iscrowd']) for g in gt_boxes[img_id, cat_id]]
+			if len(gtboxes) == 0:
+				gtboxes = [[0,0,0,0]]
+				iscrowd = [0]
+
+			origin_ious = IoU([bbox], gtboxes, iscrowd)
+
+			generate_label = []
+			for act_id, act_delta in enumerate(dataset.bbox_action.actDeltas):
+				new_bbox = bbox + act_delta * np.array([w, h, w, h])
+				new_ious = IoU([new_bbox], gtboxes, iscrowd)
+				delta_iou = new_ious.max() - origin_ious.max()
+
+				if delta_iou > dataset.bbox_action.iou_thres:
+					label = 1
+					weight = dataset.bbox_action.wtrans(delta_iou)
+					weight *= dataset.pos_wratio
+				else:
+					label = -1
+					weight = dataset.bbox_action.wtrans(delta_iou)
+					weight *= dataset.neg_wratio
+
+				generate_label.append([act_id, label, weight])
+
+			score = dt_box['score']
+			bbox[2] += bbox[0]
+			bbox[3] += bbox[1]
+			generate_bboxes.append(bbox+[score]+[cat_id]+[img_id])
+			generate_labels.append(generate_label)
+	return np.array(generate_bboxes), np.array(generate_labels)
+
+
+def synthetic_dataset(num_images, num_dets, num_gts, num_cats=80, seed=0):
+	rng = np.random.RandomState(seed)
+	dataset = COCODataset.__new__(COCODataset)
+	dataset.imgIds = list(range(num_images))
+	dataset.catIds = list(range(1, num_cats + 1))
+	gt_boxes = defaultdict(list)
+	dt_boxes = defaultdict(list)
+	for img_id in dataset.imgIds:
+		for _ in range(num_gts):
+			x, y = rng.uniform(0, 500, 2)
+			w, h = rng.uniform(10, 300, 2)
+			gt = {'bbox': [x, y, w, h], 'category_id': int(rng.randint(1, 11)),
+				'iscrowd': int(rng.rand() < 0.05), 'image_id': img_id}
+			gt_boxes[img_id, gt['category_id']].append(gt)
+		gts = [g for c in dataset.catIds for g in gt_boxes[img_id, c]]
+		for _ in range(num_dets):
+			gt = gts[rng.randint(len(gts))]
+			x, y, w, h = gt['bbox']
+			x, y = x + rng.normal(0, .1) * w, y + rng.normal(0, .1) * h
+			w, h = w * rng.uniform(.7, 1.3), h * rng.uniform(.7, 1.3)
+			cat_id = gt['category_id'] if rng.rand() < .9 else int(rng.randint(1, num_cats + 1))
+			dt = {'bbox': [x, y, w, h], 'category_id': cat_id, 'score': float(rng.rand()),
+				'image_id': img_id}
+			dt_boxes[img_id, cat_id].append(dt)
+	dataset.gt_boxes = BoxIndex.fromAnns([b for boxes in gt_boxes.values() for b in boxes])
+	dataset.dt_boxes = BoxIndex.fromAnns([b for boxes in dt_boxes.values() for b in boxes])
+	dataset.label_store = None
+	dataset.bbox_action = Action(delta=[.5, .25, .125, .0625, .03125, .015625, .008],
+							wtrans=lambda x: np.exp(np.fabs(x)))
+	dataset.pos_wratio, dataset.neg_wratio = 3.5, .6
+	return dataset, gt_boxes, dt_boxes
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark RL action-label generation')
+	parser.add_argument('--images', default=20, type=int)
+	parser.add_argument('--dets', default=[10, 100, 300], type=int, nargs='+')
+	parser.add_argument('--gts', default=8, type=int)
+	args = parser.parse_args()
+
+	for num_dets in args.dets:
+		dataset, gt_boxes, dt_boxes = synthetic_dataset(args.images, num_dets, args.gts)
+
+		tic = time.time()
+		loop_outs = [loop_generate_labels(dataset, img_id, gt_boxes, dt_boxes) for img_id in dataset.imgIds]
+		loop_time = (time.time() - tic) / args.images
+
+		tic = time.time()
+		batch_outs = [dataset.generate_labels(img_id) for img_id in dataset.imgIds]
+		batch_time = (time.time() - tic) / args.images
+
+		for (lb, ll), (bb, bl) in zip(loop_outs, batch_outs):
+			assert np.array_equal(lb, bb)
+			assert np.array_equal(ll, bl)
+
+		print('dets/img {:5d}: loop {:8.2f} ms/img, batched {:7.2f} ms/img, speedup {:7.1f}x'.format(
+			num_dets, loop_time * 1000, batch_time * 1000, loop_time / batch_time))
+
+if __name__ == '__main__':
+	main()
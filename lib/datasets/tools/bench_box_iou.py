@@ -0,0 +1,82 @@
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pycocotools import mask
+from pycocotools import boxiou
+
+"""Timing harness of pycocotools.boxiou.iou against mask.iou on boxes, per
+call for (detections x gts) sizes of COCO images, and for a batch of
+images in one call against one mask.iou call per image. Checks that the
+ious are identical to mask.iou, crowd gts included.
+
+	python lib/datasets/tools/bench_box_iou.py --sizes 100x7 1000x20 --batch 64
+"""
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Benchmark box IoU')
+	parser.add_argument('--sizes', default=['20x7', '100x7', '100x20', '1000x20'], type=str, nargs='+',
+			help='detections x gts per call')
+	parser.add_argument('--batch', default=64, type=int, help='images per batched call')
+	parser.add_argument('--repeat', default=200, type=int)
+	parser.add_argument('--torch', action='store_true', help='also time the torch backend')
+	parser.add_argument('--seed', default=3, type=int)
+	return parser.parse_args()
+
+
+def random_boxes(rng, shape):
+	wh = np.exp(rng.uniform(np.log(8), np.log(400), shape + (2,)))
+	xy = rng.uniform(0, 1, shape + (2,)) * ([640, 480] - wh).clip(min=0)
+	return np.concatenate([xy, wh], axis=-1)
+
+
+def timeit(fn, repeat):
+	fn()
+	tic = time.time()
+	for _ in range(repeat):
+		fn()
+	return (time.time() - tic) / repeat
+
+
+if __name__ == '__main__':
+	args = parse_args()
+	rng = np.random.RandomState(args.seed)
+	for size in args.sizes:
+		n, g = [int(v) for v in size.split('x')]
+		dts = random_boxes(rng, (args.batch, n))
+		gts = random_boxes(rng, (args.batch, g))
+		# detections around the gts, so that most pairs overlap
+		dts[:, :g] = gts[:, :min(n, g)] * rng.uniform(0.9, 1.1, (args.batch, min(n, g), 4))
+		iscrowd = (rng.rand(args.batch, g) < 0.05).astype(np.uint8)
+
+		dt_lists = [dts[i].tolist() for i in range(args.batch)]
+		gt_lists = [gts[i].tolist() for i in range(args.batch)]
+		crowd_lists = [iscrowd[i].tolist() for i in range(args.batch)]
+		ref = [np.asarray(mask.iou(dt_lists[i], gt_lists[i], crowd_lists[i])) for i in range(args.batch)]
+		same = all(np.array_equal(boxiou.iou(dt_lists[i], gt_lists[i], crowd_lists[i]), ref[i])
+			for i in range(args.batch))
+		batched = boxiou.iou(dts, gts, iscrowd)
+		same = same and np.array_equal(batched, np.stack(ref))
+
+		mask_time = timeit(lambda: mask.iou(dt_lists[0], gt_lists[0], crowd_lists[0]), args.repeat)
+		box_time = timeit(lambda: boxiou.iou(dt_lists[0], gt_lists[0], crowd_lists[0]), args.repeat)
+		loop_time = timeit(lambda: [mask.iou(dt_lists[i], gt_lists[i], crowd_lists[i])
+			for i in range(args.batch)], max(args.repeat // 10, 1)) / args.batch
+		batch_time = timeit(lambda: boxiou.iou(dts, gts, iscrowd), max(args.repeat // 10, 1)) / args.batch
+		line = '{:>8}: mask.iou {:8.1f} us, boxiou {:8.1f} us, per image in a batch of {}: ' \
+			'mask.iou {:8.1f} us, boxiou {:8.1f} us'.format(size, mask_time * 1e6, box_time * 1e6,
+			args.batch, loop_time * 1e6, batch_time * 1e6)
+		if args.torch:
+			import torch
+			tdts, tgts, tcrowd = torch.from_numpy(dts), torch.from_numpy(gts), torch.from_numpy(iscrowd)
+			same = same and np.array_equal(boxiou.iou(tdts, tgts, tcrowd).numpy(), batched)
+			torch_time = timeit(lambda: boxiou.iou(tdts, tgts, tcrowd), max(args.repeat // 10, 1)) / args.batch
+			line += ', torch {:8.1f} us'.format(torch_time * 1e6)
+		print(line + ', ious {}'.format('identical' if same else 'DIFFER'))
@@ -0,0 +1,117 @@
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval
+from pycocotools.fasteval import FastCOCOeval
+
+"""Timing harness of FastCOCOeval.evaluate / accumulate against COCOeval on
+a synthetic COCO-sized workload (minival: 5000 images, 80 categories, about
+7 gt and 100 detections per image). Checks that precision / recall after
+accumulate() are bit-identical.
+
+	python lib/datasets/tools/bench_cocoeval.py --images 5000 --workers 0 4 8
+"""
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Benchmark COCO evaluation')
+	parser.add_argument('--images', default=5000, type=int)
+	parser.add_argument('--cats', default=80, type=int)
+	parser.add_argument('--gts', default=7, type=int, help='mean gt boxes per image')
+	parser.add_argument('--dets', default=100, type=int, help='detections per image')
+	parser.add_argument('--workers', default=[0, 4], type=int, nargs='+')
+	parser.add_argument('--skip_reference', action='store_true',
+			help='do not run COCOeval, only time FastCOCOeval')
+	parser.add_argument('--seed', default=3, type=int)
+	return parser.parse_args()
+
+
+def synthetic_coco(num_images, num_cats, num_gts, num_dets, seed):
+	"""gt dataset dict and detection results, detections jittered around the
+	gts, with some crowd gts, repeated scores and false positives."""
+	rng = np.random.RandomState(seed)
+	images = [{'id': i + 1, 'width': 640, 'height': 480} for i in range(num_images)]
+	categories = [{'id': k + 1, 'name': str(k + 1)} for k in range(num_cats)]
+	annotations, results = [], []
+	for img in images:
+		n = rng.poisson(num_gts)
+		wh = np.exp(rng.uniform(np.log(8), np.log(400), (n, 2)))
+		xy = rng.uniform(0, 1, (n, 2)) * ([640, 480] - wh).clip(min=0)
+		cats = rng.randint(1, num_cats + 1, n)
+		for j in range(n):
+			annotations.append({'id': len(annotations) + 1, 'image_id': img['id'],
+				'category_id': int(cats[j]), 'bbox': [float(v) for v in np.r_[xy[j], wh[j]]],
+				'area': float(wh[j, 0] * wh[j, 1]), 'iscrowd': int(rng.rand() < 0.01)})
+
+		# like a detector: most detections around the gts, the false
+		# positives in the gt categories and a few confusable ones
+		src = rng.randint(0, max(n, 1), num_dets)
+		jitter = rng.normal(0, 0.15, (num_dets, 4))
+		fpCats = np.r_[cats, rng.randint(1, num_cats + 1, 8)]
+		for d in range(num_dets):
+			if n == 0 or rng.rand() < 0.4:
+				w, h = np.exp(rng.uniform(np.log(8), np.log(400), 2))
+				box = [rng.uniform(0, 640 - w), rng.uniform(0, 480 - h), w, h]
+				cat = fpCats[rng.randint(len(fpCats))]
+			else:
+				x, y, w, h = xy[src[d], 0], xy[src[d], 1], wh[src[d], 0], wh[src[d], 1]
+				box = [x + jitter[d, 0] * w, y + jitter[d, 1] * h,
+					w * np.exp(jitter[d, 2]), h * np.exp(jitter[d, 3])]
+				cat = cats[src[d]]
+			results.append({'image_id': img['id'], 'category_id': int(cat),
+				'bbox': [float(v) for v in box], 'score': float(rng.randint(1, 1000) / 1000.)})
+	dataset = {'images': images, 'categories': categories, 'annotations': annotations}
+	return dataset, results
+
+
+def run(cocoEvalClass, cocoGt, resFile, **kwargs):
+	cocoDt = cocoGt.loadRes(resFile)
+	E = cocoEvalClass(cocoGt, cocoDt, **kwargs)
+	tic = time.time()
+	E.evaluate()
+	evaluate_time = time.time() - tic
+	tic = time.time()
+	E.accumulate()
+	accumulate_time = time.time() - tic
+	return E, evaluate_time, accumulate_time
+
+
+if __name__ == '__main__':
+	args = parse_args()
+	dataset, results = synthetic_coco(args.images, args.cats, args.gts, args.dets, args.seed)
+	cocoGt = COCO()
+	cocoGt.dataset = dataset
+	cocoGt.createIndex()
+	fd, resFile = tempfile.mkstemp(suffix='.json')
+	with os.fdopen(fd, 'w') as f:
+		json.dump(results, f)
+
+	try:
+		print('{} images, {} gts, {} detections'.format(
+			args.images, len(dataset['annotations']), len(results)))
+		ref = None
+		if not args.skip_reference:
+			ref, ref_time, ref_acc_time = run(COCOeval, cocoGt, resFile)
+			print('COCOeval: evaluate {:.2f}s, accumulate {:.2f}s'.format(ref_time, ref_acc_time))
+		for workers in args.workers:
+			E, fast_time, acc_time = run(FastCOCOeval, cocoGt, resFile, num_workers=workers)
+			line = 'FastCOCOeval, {} workers: evaluate {:.2f}s, accumulate {:.2f}s'.format(
+				workers, fast_time, acc_time)
+			if ref is not None:
+				same = np.array_equal(E.eval['precision'], ref.eval['precision']) and \
+					np.array_equal(E.eval['recall'], ref.eval['recall'])
+				line += ', speedup {:.1f}x / {:.1f}x, precision / recall {}'.format(
+					ref_time / fast_time, ref_acc_time / acc_time, 'identical' if same else 'DIFFER')
+			print(line)
+	finally:
+		os.remove(resFile)
@@ -0,0 +1,138 @@
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from datasets.RL_coco_loader import COCODataLoader
+
+"""Timing harness of COCODataLoader._collate_fn, per batch of random images
+of COCOTransform sizes (short side 800, long side up to 1200) with their
+bboxes and labels: the original collate (F.pad copy of every image, cat of
+the batch id column, new label tensors), the collate into new tensors (as
+in the workers) and into the reused staging buffers, pinned with --pin.
+Then per batch of a COCODataLoader with --num_workers workers over random
+images: the batches of the workers pinned by the DataLoader (--pin) and
+copied into the staging buffers. Checks that the batches are identical.
+
+	python lib/datasets/tools/bench_collate.py --batch_sizes 8 24
+	python lib/datasets/tools/bench_collate.py --pin --repeat 20 --num_workers 6
+"""
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Benchmark the collate of COCODataLoader')
+	parser.add_argument('--batch_sizes', default=[2, 8, 24], type=int, nargs='+')
+	parser.add_argument('--short', default=800, type=int)
+	parser.add_argument('--long', default=1200, type=int)
+	parser.add_argument('--max_bboxes', default=100, type=int)
+	parser.add_argument('--num_acts', default=16, type=int)
+	parser.add_argument('--repeat', default=10, type=int)
+	parser.add_argument('--pin', action='store_true', help='pin the staging buffers (needs CUDA)')
+	parser.add_argument('--num_workers', default=2, type=int, help='workers of the loader, none if 0')
+	parser.add_argument('--seed', default=3, type=int)
+	return parser.parse_args()
+
+
+def random_batch(rng, batch_size, args):
+	batch = []
+	for i in range(batch_size):
+		long_side = rng.randint(args.short, args.long + 1)
+		h, w = (args.short, long_side) if rng.rand() < 0.5 else (long_side, args.short)
+		n = rng.randint(1, args.max_bboxes + 1)
+		img = torch.from_numpy(rng.randn(3, h, w).astype(np.float32))
+		bboxes = torch.from_numpy(rng.rand(n, 7).astype(np.float32))
+		labels = torch.from_numpy(rng.rand(n, args.num_acts, 3).astype(np.float32))
+		batch.append([img, bboxes, labels, (h, w, 1., h, w, '{}.jpg'.format(i))])
+	return batch
+
+
+def original_collate(batch):
+	# _collate_fn before the staging buffers
+	batch_size = len(batch)
+	images, generate_bboxes, generate_labels, im_infos = list(zip(*batch))
+	max_img_h = max([_.shape[-2] for _ in images])
+	max_img_w = max([_.shape[-1] for _ in images])
+	max_num_bboxes = max([_.shape[0] for _ in generate_bboxes])
+	num_acts = max([_.shape[1] for _ in generate_labels])
+	padded_images = torch.FloatTensor(batch_size, images[0].shape[0], max_img_h, max_img_w)
+	padded_bboxes = torch.FloatTensor(batch_size, max_num_bboxes, 8)
+	padded_labels = torch.FloatTensor(batch_size, max_num_bboxes, num_acts, 3)
+	for bid in range(batch_size):
+		img, bboxes, labels = images[bid], generate_bboxes[bid], generate_labels[bid]
+		pad_size = (0, max_img_w - img.shape[-1], 0, max_img_h - img.shape[-2])
+		padded_images[bid] = F.pad(img, pad_size).data
+		new_bboxes = torch.FloatTensor(max_num_bboxes, bboxes.shape[-1]).zero_()
+		new_bboxes[:bboxes.shape[0]] = bboxes
+		batch_id = torch.FloatTensor([bid]).expand((max_num_bboxes, 1))
+		padded_bboxes[bid] = torch.cat([batch_id, new_bboxes], dim=1)
+		new_labels = torch.FloatTensor(max_num_bboxes, labels.shape[-2], labels.shape[-1]).zero_()
+		new_labels[:labels.shape[0]] = labels
+		padded_labels[bid] = new_labels
+	return [padded_images, padded_bboxes, padded_labels, im_infos]
+
+
+def time_loader(loader, dataset, batch_size, repeat):
+	# ms per batch over repeat epochs after the first, then the batches
+	# checked against the original collate
+	for inp in loader:
+		pass
+	num_batches = 0
+	tic = time.time()
+	for _ in range(repeat):
+		for inp in loader:
+			num_batches += 1
+	loader_time = (time.time() - tic) / num_batches * 1000
+	same = True
+	for i, inp in enumerate(loader):
+		ref = original_collate(dataset[i * batch_size:(i + 1) * batch_size])
+		same = same and all(torch.equal(a, b.data if hasattr(b, 'data') else b)
+			for a, b in zip(ref[:3], inp[:3]))
+	return loader_time, same
+
+
+def timeit(fn, batches, repeat):
+	fn(batches[0])
+	tic = time.time()
+	for i in range(repeat):
+		out = fn(batches[i % len(batches)])
+	return out, (time.time() - tic) / repeat * 1000
+
+
+if __name__ == '__main__':
+	args = parse_args()
+	rng = np.random.RandomState(args.seed)
+	if args.pin and not torch.cuda.is_available():
+		print('no CUDA, the staging buffers are not pinned')
+	reused = COCODataLoader([], pin_memory=args.pin)
+	fresh = COCODataLoader([], num_buffers=0)
+	for batch_size in args.batch_sizes:
+		batches = [random_batch(rng, batch_size, args) for _ in range(2)]
+		ref, ref_time = timeit(original_collate, batches, args.repeat)
+		new, new_time = timeit(fresh._collate_fn, batches, args.repeat)
+		staged, staged_time = timeit(reused._collate_fn, batches, args.repeat)
+		same = all(torch.equal(a, b.data if hasattr(b, 'data') else b)
+			for out in (new, staged) for a, b in zip(ref[:3], out[:3]))
+		mb = sum(t.numel() for t in ref[:3]) * 4 / 2. ** 20
+		print('batch {:3d} ({:7.1f} MB): original {:8.1f} ms, new tensors {:8.1f} ms, '
+			'staging buffers {:8.1f} ms, batches {}'.format(batch_size, mb, ref_time, new_time,
+			staged_time, 'identical' if same else 'DIFFER'))
+
+	if args.num_workers > 0:
+		for batch_size in args.batch_sizes:
+			# a few batches of each size per epoch
+			dataset = random_batch(rng, batch_size * 4, args)
+			times = []
+			for num_buffers in (0, 2):
+				loader = COCODataLoader(dataset, batch_size=batch_size, num_workers=args.num_workers,
+					pin_memory=args.pin, num_buffers=num_buffers)
+				times.append(time_loader(loader, dataset, batch_size, max(1, args.repeat // 4)))
+			print('batch {:3d}, {:d} workers: new tensors{} {:8.1f} ms, staging buffers {:8.1f} ms, '
+				'batches {}'.format(batch_size, args.num_workers, ' pinned' if args.pin else '',
+				times[0][0], times[1][0], 'identical' if times[0][1] and times[1][1] else 'DIFFER'))
@@ -0,0 +1,57 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(this_dir, '..', '..', '..'))
+sys.path.insert(0, os.path.join(this_dir, '..', '..'))
+
+from config import Config
+from pycocotools.coco import COCO
+from pycocotools.boxindex import BoxIndex
+from pycocotools import jsoncache
+from datasets.RL_coco_labels import ActionLabelStore
+from model.Reinforcement.action import Action
+from model.Reinforcement.utils import init_log
+
+"""Offline build of the memory-mapped action label store that
+COCODataset reads when Config.label_cache_dir is set.
+
+	python lib/datasets/tools/build_action_labels.py --phase train
+"""
+
+def main():
+	parser = argparse.ArgumentParser(description='Build the RL action label store')
+	parser.add_argument('--phase', default='train', type=str, help='train or minival')
+	parser.add_argument('--cache-dir', default='', type=str,
+						help='store directory (default: Config.label_cache_dir)')
+	args = parser.parse_args()
+
+	init_log('global', logging.INFO)
+	config = Config(phase=args.phase)
+	cache_dir = args.cache_dir if args.cache_dir else config.label_cache_dir
+	bbox_action = Action(delta=config.act_delta,
+						iou_thres=config.act_iou_thres,
+						wtrans=config.act_wtrans)
+
+	json_cache_dir = config.json_cache_dir if config.json_cache_dir else None
+	cocoGt = COCO(config.ann_file, cacheDir=json_cache_dir)
+	imgIds = sorted(cocoGt.getImgIds())
+	catIds = sorted(cocoGt.getCatIds())
+	gt_boxes = cocoGt.boxIndex
+	if json_cache_dir:
+		dt_boxes = jsoncache.loadResults(config.dt_file, json_cache_dir)
+	else:
+		dt_boxes = BoxIndex.fromAnns(json.load(open(config.dt_file, 'r')))
+
+	store = ActionLabelStore.open_or_build(cache_dir, config.ann_file, config.dt_file,
+										imgIds, catIds, dt_boxes, gt_boxes, bbox_action)
+	print('{}: {} images, {} detections'.format(
+		store.filename, len(store), store.header['num_dets']))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,157 @@
+from __future__ import division
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from multiprocessing import Pool
+
+from datasets.RL_coco_labels import image_delta_ious
+
+"""Positive / negative statistics of the delta-IoUs of all actions,
+used by COCODataset to balance the weights of positive and negative
+labels:
+
+	pos_tot, neg_tot:			number of positive / negative (box, action) labels
+	pos_weights, neg_weights:	sum of wtrans(delta_iou) over those labels
+
+The scan is a map-reduce over shards of images on a process pool, and
+its result is cached as a small json file keyed by the dataset and the
+action config.
+"""
+
+class WeightStatistics(object):
+	def __init__(self, pos_tot=0, neg_tot=0, pos_weights=0., neg_weights=0.):
+		self.pos_tot = pos_tot
+		self.neg_tot = neg_tot
+		self.pos_weights = pos_weights
+		self.neg_weights = neg_weights
+
+	def add(self, delta_ious, bbox_action):
+		positive = delta_ious > bbox_action.iou_thres
+		weights = bbox_action.wtrans(delta_ious)
+		num_pos = int(positive.sum())
+		self.pos_tot += num_pos
+		self.neg_tot += positive.size - num_pos
+		self.pos_weights += float(weights[positive].sum())
+		self.neg_weights += float(weights[~positive].sum())
+
+	def merge(self, other):
+		self.pos_tot += other.pos_tot
+		self.neg_tot += other.neg_tot
+		self.pos_weights += other.pos_weights
+		self.neg_weights += other.neg_weights
+
+	def result(self):
+		return self.pos_tot, self.neg_tot, self.pos_weights, self.neg_weights
+
+
+# per-process state of the pool workers, set once by _init_worker
+_worker = {}
+
+def _init_worker(catIds, dt_boxes, gt_boxes, bbox_action, label_store):
+	_worker.update(catIds=catIds, dt_boxes=dt_boxes, gt_boxes=gt_boxes,
+				bbox_action=bbox_action, label_store=label_store)
+
+def _scan_shard(shard):
+	stats = WeightStatistics()
+	bbox_action = _worker['bbox_action']
+	label_store = _worker['label_store']
+	for img_id, num_dets in shard:
+		if label_store is not None:
+			delta_ious = label_store[img_id][1]
+		else:
+			delta_ious = image_delta_ious(img_id, _worker['catIds'],
+				_worker['dt_boxes'], _worker['gt_boxes'], bbox_action)[1]
+		stats.add(delta_ious[:num_dets], bbox_action)
+	return stats
+
+
+def _statistics_key(cache_key, bbox_action, shuffle, maxDets, seed):
+	sha = hashlib.sha1()
+	sha.update(str(cache_key).encode('utf-8'))
+	sha.update(np.ascontiguousarray(bbox_action.actDeltas, dtype=np.float32).tobytes())
+	# wtrans is an arbitrary function, so identify it by its values
+	probe = np.linspace(-1., 1., 41)
+	sha.update(np.asarray(bbox_action.wtrans(probe), dtype=np.float64).tobytes())
+	sha.update(repr((bbox_action.iou_thres, bool(shuffle), maxDets, seed)).encode('utf-8'))
+	return sha.hexdigest()
+
+
+def get_weights_statistics(imgIds, catIds, dt_boxes, gt_boxes, bbox_action,
+						shuffle=True, maxDets=None, num_workers=1, shard_size=256,
+						seed=0, label_store=None, cache_dir=None, cache_key=None):
+	'''
+	Args:
+		imgIds, catIds:		images and categories to scan
+		dt_boxes, gt_boxes:	pycocotools.boxindex.BoxIndex of the detections / gts
+		bbox_action:		Action
+		shuffle, maxDets:	scan only the first maxDets detections of the
+							images in a (seeded) random order; all if None
+		num_workers:		size of the process pool, inline if <= 1
+		label_store:		optional ActionLabelStore to read delta-IoUs from
+		cache_dir, cache_key: cache the result in cache_dir, keyed by cache_key
+							(identifying the dataset) and the action config
+	Return:
+		pos_tot, neg_tot, pos_weights, neg_weights
+	'''
+	logger = logging.getLogger('global')
+
+	cache_file = None
+	if cache_dir and cache_key is not None:
+		key = _statistics_key(cache_key, bbox_action, shuffle, maxDets, seed)
+		cache_file = os.path.join(cache_dir, 'pnw_{}.json'.format(key[:16]))
+		if os.path.isfile(cache_file):
+			with open(cache_file, 'r') as f:
+				cached = json.load(f)
+			if cached['key'] == key:
+				logger.info('Loaded delta-IoU statistics from {}'.format(cache_file))
+				return tuple(cached['statistics'])
+
+	order = list(imgIds)
+	if shuffle:
+		np.random.RandomState(seed).shuffle(order)
+
+	# (img_id, number of its detections to scan) up to maxDets in total
+	tasks = []
+	remain = maxDets if maxDets else np.inf
+	for img_id in order:
+		if remain <= 0:
+			break
+		num_dets = dt_boxes.count(img_id, catIds)
+		if num_dets == 0:
+			continue
+		num_dets = int(min(num_dets, remain))
+		tasks.append((img_id, num_dets))
+		remain -= num_dets
+	shards = [tasks[i:i + shard_size] for i in range(0, len(tasks), shard_size)]
+	logger.info('Scanning {} detections of {} images in {} shards...'.format(
+		sum(n for _, n in tasks), len(tasks), len(shards)))
+
+	stats = WeightStatistics()
+	initargs = (catIds, dt_boxes, gt_boxes, bbox_action, label_store)
+	if num_workers <= 1 or len(shards) <= 1:
+		_init_worker(*initargs)
+		for shard in shards:
+			stats.merge(_scan_shard(shard))
+		_worker.clear()
+	else:
+		pool = Pool(min(num_workers, len(shards)), initializer=_init_worker, initargs=initargs)
+		try:
+			# ordered, so that the float sums do not depend on scheduling
+			for shard_stats in pool.imap(_scan_shard, shards):
+				stats.merge(shard_stats)
+		finally:
+			pool.close()
+			pool.join()
+	statistics = stats.result()
+
+	if cache_file is not None:
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+		tmpname = '{}.{}.tmp'.format(cache_file, os.getpid())
+		with open(tmpname, 'w') as f:
+			json.dump({'key': key, 'statistics': list(statistics)}, f)
+		os.rename(tmpname, cache_file)
+	return statistics
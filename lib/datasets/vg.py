@@ -10,13 +10,15 @@ from __future__ import absolute_import
 import os
 from datasets.imdb import imdb
 import datasets.ds_utils as ds_utils
-import xml.etree.ElementTree as ET
 import numpy as np
 import scipy.sparse
 import gzip
 import PIL
 import json
-from .vg_eval import vg_eval
+from .vg_eval import vg_eval_boxes, vg_eval_dets, vg_gts, vg_class_gts
+from .voc_eval import map_classes, read_results_file
+from .xml_annotations import load_annotations, parse_annotation_file, \
+    annotation_cache_file
 from model.utils.config import cfg
 import pickle
 import pdb
@@ -153,23 +155,27 @@ class vg(imdb):
           elif self._image_set == "smallval":
             metadata = metadata[:2000]
 
-        image_index = []
-        id_to_dir = {}
+        image_ids = []
+        im_dirs = []
         for line in metadata:
           im_file,ann_file = line.split()
-          image_id = int(ann_file.split('/')[-1].split('.')[0])
-          filename = self._annotation_path(image_id)
-          if os.path.exists(filename):
-              # Some images have no bboxes after object filtering, so there
-              # is no xml annotation for these.
-              tree = ET.parse(filename)
-              for obj in tree.findall('object'):
-                  obj_name = obj.find('name').text.lower().strip()
+          image_ids.append(int(ann_file.split('/')[-1].split('.')[0]))
+          im_dirs.append(im_file.split('/')[0])
+        # Some images have no bboxes after object filtering, so there
+        # is no xml annotation for these, and their record is None.
+        records = self._load_annotations(image_ids)
+
+        image_index = []
+        id_to_dir = {}
+        for image_id, im_dir, record in zip(image_ids, im_dirs, records):
+          if record is not None:
+              for obj in record['objects']:
+                  obj_name = obj['name'].lower().strip()
                   if obj_name in self._class_to_ind:
                       # We have to actually load and check these to make sure they have
                       # at least one object actually in vocab
                       image_index.append(image_id)
-                      id_to_dir[image_id] = im_file.split('/')[0]
+                      id_to_dir[image_id] = im_dir
                       break
         return image_index, id_to_dir
 
@@ -187,8 +193,10 @@ class vg(imdb):
             print('{} gt roidb loaded from {}'.format(self.name, cache_file))
             return roidb
 
-        gt_roidb = [self._load_vg_annotation(index)
-                    for index in self.image_index]
+        # the records parsed by _load_image_set_index come from the cache
+        records = self._load_annotations(self.image_index)
+        gt_roidb = [self._load_vg_annotation(index, record)
+                    for index, record in zip(self.image_index, records)]
         fid = gzip.open(cache_file,'wb')
         pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
         fid.close()
@@ -201,15 +209,25 @@ class vg(imdb):
     def _annotation_path(self, index):
         return os.path.join(self._data_path, 'xml', str(index) + '.xml')
 
-    def _load_vg_annotation(self, index):
+    def _load_annotations(self, image_ids):
+        """
+        Records of the XML annotations of the images, parsed in parallel
+        and cached by xml_annotations.
+        """
+        return load_annotations(
+            [self._annotation_path(image_id) for image_id in image_ids],
+            annotation_cache_file(self.cache_path, os.path.join(self._data_path, 'xml')))
+
+    def _load_vg_annotation(self, index, record=None):
         """
         Load image and bounding boxes info from XML file in the PASCAL VOC
-        format.
+        format, or from its record of xml_annotations.
         """
         width, height = self._get_size(index)
         filename = self._annotation_path(index)
-        tree = ET.parse(filename)
-        objs = tree.findall('object')
+        if record is None:
+            record = parse_annotation_file(filename)
+        objs = record['objects']
         num_objs = len(objs)
 
         boxes = np.zeros((num_objs, 4), dtype=np.uint16)
@@ -224,13 +242,13 @@ class vg(imdb):
         obj_dict = {}
         ix = 0
         for obj in objs:
-            obj_name = obj.find('name').text.lower().strip()
+            obj_name = obj['name'].lower().strip()
             if obj_name in self._class_to_ind:
-                bbox = obj.find('bndbox')
-                x1 = max(0,float(bbox.find('xmin').text))
-                y1 = max(0,float(bbox.find('ymin').text))
-                x2 = min(width-1,float(bbox.find('xmax').text))
-                y2 = min(height-1,float(bbox.find('ymax').text))
+                xmin, ymin, xmax, ymax = obj['bbox']
+                x1 = max(0,float(xmin))
+                y1 = max(0,float(ymin))
+                x2 = min(width-1,float(xmax))
+                y2 = min(height-1,float(ymax))
                 # If bboxes are not positive, just give whole image coords (there are a few examples)
                 if x2 < x1 or y2 < y1:
                     print('Failed bbox in %s, object %s' % (filename, obj_name))
@@ -239,11 +257,11 @@ class vg(imdb):
                     x2 = width-1
                     y2 = width-1
                 cls = self._class_to_ind[obj_name]
-                obj_dict[obj.find('object_id').text] = ix
-                atts = obj.findall('attribute')
+                obj_dict[obj['object_id']] = ix
+                atts = obj['attributes']
                 n = 0
                 for att in atts:
-                    att = att.text.lower().strip()
+                    att = att.lower().strip()
                     if att in self._attribute_to_ind:
                         gt_attributes[ix, n] = self._attribute_to_ind[att]
                         n += 1
@@ -261,19 +279,18 @@ class vg(imdb):
         overlaps = scipy.sparse.csr_matrix(overlaps)
         gt_attributes = scipy.sparse.csr_matrix(gt_attributes)
 
-        rels = tree.findall('relation')
+        rels = record['relations']
         num_rels = len(rels)
         gt_relations = set() # Avoid duplicates
-        for rel in rels:
-            pred = rel.find('predicate').text
+        for pred, subject_id, object_id in rels:
             if pred: # One is empty
                 pred = pred.lower().strip()
                 if pred in self._relation_to_ind:
                     try:
                         triple = []
-                        triple.append(obj_dict[rel.find('subject_id').text])
+                        triple.append(obj_dict[subject_id])
                         triple.append(self._relation_to_ind[pred])
-                        triple.append(obj_dict[rel.find('object_id').text])
+                        triple.append(obj_dict[object_id])
                         gt_relations.add(tuple(triple))
                     except:
                         pass # Object not in dictionary
@@ -290,24 +307,16 @@ class vg(imdb):
                 'seg_areas' : seg_areas}
 
     def evaluate_detections(self, all_boxes, output_dir):
-        self._write_voc_results_file(self.classes, all_boxes, output_dir)
-        self._do_python_eval(output_dir)
-        if self.config['cleanup']:
-            for cls in self._classes:
-                if cls == '__background__':
-                    continue
-                filename = self._get_vg_results_file_template(output_dir).format(cls)
-                os.remove(filename)
+        # the python eval reads all_boxes, the results files are only
+        # written to be kept
+        if not self.config['cleanup']:
+            self._write_voc_results_file(self.classes, all_boxes, output_dir)
+        self._do_python_eval(output_dir, all_boxes=all_boxes)
 
     def evaluate_attributes(self, all_boxes, output_dir):
-        self._write_voc_results_file(self.attributes, all_boxes, output_dir)
-        self._do_python_eval(output_dir, eval_attributes = True)
-        if self.config['cleanup']:
-            for cls in self._attributes:
-                if cls == '__no_attribute__':
-                    continue
-                filename = self._get_vg_results_file_template(output_dir).format(cls)
-                os.remove(filename)
+        if not self.config['cleanup']:
+            self._write_voc_results_file(self.attributes, all_boxes, output_dir)
+        self._do_python_eval(output_dir, eval_attributes = True, all_boxes=all_boxes)
 
     def _get_vg_results_file_template(self, output_dir):
         filename = 'detections_' + self._image_set + '_{:s}.txt'
@@ -333,7 +342,7 @@ class vg(imdb):
                                        dets[k, 2] + 1, dets[k, 3] + 1))
 
 
-    def _do_python_eval(self, output_dir, pickle=True, eval_attributes = False):
+    def _do_python_eval(self, output_dir, pickle=True, eval_attributes = False, all_boxes=None):
         # We re-use parts of the pascal voc python code for visual genome
         aps = []
         nposs = []
@@ -349,13 +358,22 @@ class vg(imdb):
             classes = self._attributes
         else:
             classes = self._classes
-        for i, cls in enumerate(classes):
-            if cls == '__background__' or cls == '__no_attribute__':
-                continue
-            filename = self._get_vg_results_file_template(output_dir).format(cls)
-            rec, prec, ap, scores, npos = vg_eval(
-                filename, gt_roidb, self.image_index, i, ovthresh=0.5,
-                use_07_metric=use_07_metric, eval_attributes=eval_attributes)
+        # the detections of all_boxes in memory, or of the results files
+        # if None, the classes evaluated in parallel
+        indices = [i for i, cls in enumerate(classes)
+                   if cls != '__background__' and cls != '__no_attribute__']
+        gts = vg_gts(gt_roidb, eval_attributes)
+        if all_boxes is None:
+            results = map_classes(vg_eval_dets, [
+                read_results_file(self._get_vg_results_file_template(output_dir).format(classes[i]),
+                                  self.image_index) + vg_class_gts(gts, i) + (0.5, use_07_metric)
+                for i in indices])
+        else:
+            results = map_classes(vg_eval_boxes, [
+                (all_boxes[i],) + vg_class_gts(gts, i) + (0.5, use_07_metric)
+                for i in indices])
+        for i, (rec, prec, ap, scores, npos) in zip(indices, results):
+            cls = classes[i]
 
             # Determine per class detection thresholds that maximise f score
             if npos > 1:
@@ -5,10 +5,86 @@ from __future__ import absolute_import
 # Written by Bharath Hariharan
 # --------------------------------------------------------
 
-import xml.etree.ElementTree as ET
 import os
 import numpy as np
-from .voc_eval import voc_ap
+from .voc_eval import results_detections, read_results_file, match_detections, pr_ap
+
+def vg_gts(gt_roidb, eval_attributes=False):
+    """gt_image_ids, gt_labels, gt_boxes = vg_gts(gt_roidb, [eval_attributes])
+
+    The objects of all the images in one pass: the index of their image,
+    their class (or one of their attributes, an object being repeated for
+    each) and their boxes.
+    """
+    gt_image_ids = []
+    gt_labels = []
+    gt_boxes = []
+    for i, item in enumerate(gt_roidb):
+        if eval_attributes:
+            # the attributes of an object, once each
+            atts = item['gt_attributes'].tocoo()
+            pairs = np.unique(np.vstack((atts.row, atts.data)).T.reshape(-1, 2), axis=0)
+            obj, labels = pairs[:, 0], pairs[:, 1]
+        else:
+            labels = item['gt_classes']
+            obj = np.arange(len(labels))
+        gt_image_ids.append(np.full(len(obj), i, dtype=np.int64))
+        gt_labels.append(np.asarray(labels, dtype=np.int64))
+        gt_boxes.append(item['boxes'][obj, :].reshape(-1, 4))
+    return (np.concatenate(gt_image_ids + [np.zeros(0, dtype=np.int64)]),
+            np.concatenate(gt_labels + [np.zeros(0, dtype=np.int64)]),
+            np.concatenate(gt_boxes + [np.zeros((0, 4))]).astype(np.float64))
+
+
+def vg_class_gts(gts, classindex):
+    """gt_image_ids, gt_boxes, gt_difficult of a class in the gts of vg_gts,
+    none of them difficult"""
+    gt_image_ids, gt_labels, gt_boxes = gts
+    keep = np.where(gt_labels == classindex)[0]
+    return gt_image_ids[keep], gt_boxes[keep], np.zeros(len(keep), dtype=bool)
+
+
+def vg_eval_boxes(class_boxes,
+                  gt_image_ids,
+                  gt_boxes,
+                  gt_difficult,
+                  ovthresh=0.5,
+                  use_07_metric=False):
+    """rec, prec, ap, sorted_scores, npos = vg_eval_boxes(
+                                class_boxes,
+                                gt_image_ids,
+                                gt_boxes,
+                                gt_difficult,
+                                [ovthresh],
+                                [use_07_metric])
+
+    vg_eval of the detections of all_boxes[classindex] in memory, with the
+    same results as vg_eval of the results file written from them.
+
+    class_boxes: Per image, N x 5 array of detections [x1 y1 x2 y2 score]
+    gt_image_ids, gt_boxes, gt_difficult: The gts of the class, see vg_class_gts
+    """
+    image_ids, confidence, BB = results_detections(class_boxes)
+    return vg_eval_dets(image_ids, confidence, BB, gt_image_ids, gt_boxes, gt_difficult,
+                        ovthresh, use_07_metric)
+
+
+def vg_eval_dets(image_ids, confidence, BB, gt_image_ids, gt_boxes, gt_difficult,
+                 ovthresh=0.5, use_07_metric=False):
+    """rec, prec, ap, sorted_scores, npos of detections and gts as in
+    match_detections, zeros if there are no gts or no detections"""
+    npos = len(gt_image_ids)
+    if npos == 0:
+        # No ground truth examples
+        return 0,0,0,0,npos
+    if len(image_ids) == 0:
+        # No detection examples
+        return 0,0,0,0,npos
+    tp, fp, sorted_scores, npos = match_detections(image_ids, confidence, BB, gt_image_ids,
+                                                   gt_boxes, gt_difficult, ovthresh)
+    rec, prec, ap = pr_ap(tp, fp, npos, use_07_metric)
+    return rec, prec, ap, sorted_scores, npos
+
 
 def vg_eval( detpath,
              gt_roidb,
@@ -36,88 +112,13 @@ def vg_eval( detpath,
         (default False)
     """
     # extract gt objects for this class
-    class_recs = {}
-    npos = 0
-    for item,imagename in zip(gt_roidb,image_index):
-        if eval_attributes:
-            bbox = item['boxes'][np.where(np.any(item['gt_attributes'].toarray() == classindex, axis=1))[0], :]
-        else:
-            bbox = item['boxes'][np.where(item['gt_classes'] == classindex)[0], :]
-        difficult = np.zeros((bbox.shape[0],)).astype(np.bool)
-        det = [False] * bbox.shape[0]
-        npos = npos + sum(~difficult)        
-        class_recs[str(imagename)] = {'bbox': bbox,
-                                 'difficult': difficult,
-                                 'det': det}
-    if npos == 0:
+    gt_image_ids, gt_boxes, gt_difficult = vg_class_gts(
+        vg_gts(gt_roidb, eval_attributes), classindex)
+    if len(gt_image_ids) == 0:
         # No ground truth examples
-        return 0,0,0,0,npos
+        return 0,0,0,0,0
 
     # read dets
-    with open(detpath, 'r') as f:
-        lines = f.readlines()
-    if len(lines) == 0:
-        # No detection examples
-        return 0,0,0,0,npos
-
-    splitlines = [x.strip().split(' ') for x in lines]
-    image_ids = [x[0] for x in splitlines]
-    confidence = np.array([float(x[1]) for x in splitlines])
-    BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
-
-    # sort by confidence
-    sorted_ind = np.argsort(-confidence)
-    sorted_scores = -np.sort(-confidence)
-    BB = BB[sorted_ind, :]
-    image_ids = [image_ids[x] for x in sorted_ind]
-
-    # go down dets and mark TPs and FPs
-    nd = len(image_ids)
-    tp = np.zeros(nd)
-    fp = np.zeros(nd)
-    for d in range(nd):
-        R = class_recs[image_ids[d]]
-        bb = BB[d, :].astype(float)
-        ovmax = -np.inf
-        BBGT = R['bbox'].astype(float)
-
-        if BBGT.size > 0:
-            # compute overlaps
-            # intersection
-            ixmin = np.maximum(BBGT[:, 0], bb[0])
-            iymin = np.maximum(BBGT[:, 1], bb[1])
-            ixmax = np.minimum(BBGT[:, 2], bb[2])
-            iymax = np.minimum(BBGT[:, 3], bb[3])
-            iw = np.maximum(ixmax - ixmin + 1., 0.)
-            ih = np.maximum(iymax - iymin + 1., 0.)
-            inters = iw * ih
-
-            # union
-            uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-                   (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-                   (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-            overlaps = inters / uni
-            ovmax = np.max(overlaps)
-            jmax = np.argmax(overlaps)
-
-        if ovmax > ovthresh:
-            if not R['difficult'][jmax]:
-                if not R['det'][jmax]:
-                    tp[d] = 1.
-                    R['det'][jmax] = 1
-                else:
-                    fp[d] = 1.
-        else:
-            fp[d] = 1.
-
-    # compute precision recall
-    fp = np.cumsum(fp)
-    tp = np.cumsum(tp)
-    rec = tp / float(npos)
-    # avoid divide by zero in case the first detection matches a difficult
-    # ground truth
-    prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
-    ap = voc_ap(rec, prec, use_07_metric)
-    
-    return rec, prec, ap, sorted_scores, npos
+    image_ids, confidence, BB = read_results_file(detpath, image_index)
+    return vg_eval_dets(image_ids, confidence, BB, gt_image_ids, gt_boxes, gt_difficult,
+                        ovthresh, use_07_metric)
@@ -7,26 +7,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import xml.etree.ElementTree as ET
 import os
 import pickle
+import multiprocessing
 import numpy as np
+from .xml_annotations import load_annotations, parse_annotation_file
 
-def parse_rec(filename):
-  """ Parse a PASCAL VOC xml file """
-  tree = ET.parse(filename)
+def parse_rec(filename, record=None):
+  """ Parse a PASCAL VOC xml file, or convert its record of xml_annotations """
+  if record is None:
+    record = parse_annotation_file(filename)
   objects = []
-  for obj in tree.findall('object'):
+  for obj in record['objects']:
     obj_struct = {}
-    obj_struct['name'] = obj.find('name').text
-    obj_struct['pose'] = obj.find('pose').text
-    obj_struct['truncated'] = int(obj.find('truncated').text)
-    obj_struct['difficult'] = int(obj.find('difficult').text)
-    bbox = obj.find('bndbox')
-    obj_struct['bbox'] = [int(bbox.find('xmin').text),
-                          int(bbox.find('ymin').text),
-                          int(bbox.find('xmax').text),
-                          int(bbox.find('ymax').text)]
+    obj_struct['name'] = obj['name']
+    obj_struct['pose'] = obj['pose']
+    obj_struct['truncated'] = int(obj['truncated'])
+    obj_struct['difficult'] = int(obj['difficult'])
+    obj_struct['bbox'] = [int(v) for v in obj['bbox']]
     objects.append(obj_struct)
 
   return objects
@@ -66,39 +64,12 @@ def voc_ap(rec, prec, use_07_metric=False):
   return ap
 
 
-def voc_eval(detpath,
-             annopath,
-             imagesetfile,
-             classname,
-             cachedir,
-             ovthresh=0.5,
-             use_07_metric=False):
-  """rec, prec, ap = voc_eval(detpath,
-                              annopath,
-                              imagesetfile,
-                              classname,
-                              [ovthresh],
-                              [use_07_metric])
+def load_recs(annopath, imagesetfile, cachedir):
+  """imagenames, recs = load_recs(annopath, imagesetfile, cachedir)
 
-  Top level function that does the PASCAL VOC evaluation.
-
-  detpath: Path to detections
-      detpath.format(classname) should produce the detection results file.
-  annopath: Path to annotations
-      annopath.format(imagename) should be the xml annotations file.
-  imagesetfile: Text file containing the list of images, one image per line.
-  classname: Category name (duh)
-  cachedir: Directory for caching the annotations
-  [ovthresh]: Overlap threshold (default = 0.5)
-  [use_07_metric]: Whether to use VOC07's 11 point AP computation
-      (default False)
+  The image names of imagesetfile and the parse_rec objects of each,
+  cached in a pickle file of cachedir.
   """
-  # assumes detections are in detpath.format(classname)
-  # assumes annotations are in annopath.format(imagename)
-  # assumes imagesetfile is a text file with each line an image name
-  # cachedir caches the annotations in a pickle file
-
-  # first load gt
   if not os.path.isdir(cachedir):
     os.mkdir(cachedir)
   cachefile = os.path.join(cachedir, '%s_annots.pkl' % imagesetfile)
@@ -108,13 +79,15 @@ def voc_eval(detpath,
   imagenames = [x.strip() for x in lines]
 
   if not os.path.isfile(cachefile):
-    # load annotations
+    # load annotations, parsed in parallel and cached by content
+    print('Reading annotations of {:d} images'.format(len(imagenames)))
+    filenames = [annopath.format(imagename) for imagename in imagenames]
+    records = load_annotations(filenames, os.path.join(cachedir, 'xml_annotations.pkl'))
     recs = {}
-    for i, imagename in enumerate(imagenames):
-      recs[imagename] = parse_rec(annopath.format(imagename))
-      if i % 100 == 0:
-        print('Reading annotation for {:d}/{:d}'.format(
-          i + 1, len(imagenames)))
+    for imagename, filename, record in zip(imagenames, filenames, records):
+      if record is None:
+        raise IOError('Annotation file not found: {}'.format(filename))
+      recs[imagename] = parse_rec(filename, record)
     # save
     print('Saving cached annotations to {:s}'.format(cachefile))
     with open(cachefile, 'wb') as f:
@@ -126,78 +99,157 @@ def voc_eval(detpath,
         recs = pickle.load(f)
       except:
         recs = pickle.load(f, encoding='bytes')
+  return imagenames, recs
 
-  # extract gt objects for this class
-  class_recs = {}
-  npos = 0
-  for imagename in imagenames:
+
+def class_gts(recs, imagenames, classname):
+  """gt_image_ids, gt_boxes, gt_difficult = class_gts(recs, imagenames, classname)
+
+  The objects of classname in the images: the index of their image in
+  imagenames, their boxes and their difficult flags.
+  """
+  gt_image_ids = []
+  bbox = []
+  difficult = []
+  for i, imagename in enumerate(imagenames):
     R = [obj for obj in recs[imagename] if obj['name'] == classname]
-    bbox = np.array([x['bbox'] for x in R])
-    difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-    det = [False] * len(R)
-    npos = npos + sum(~difficult)
-    class_recs[imagename] = {'bbox': bbox,
-                             'difficult': difficult,
-                             'det': det}
+    gt_image_ids += [i] * len(R)
+    bbox += [x['bbox'] for x in R]
+    difficult += [x['difficult'] for x in R]
+  return (np.array(gt_image_ids, dtype=np.int64),
+          np.array(bbox, dtype=np.float64).reshape(-1, 4),
+          np.array(difficult).astype(bool))
 
-  # read dets
-  detfile = detpath.format(classname)
+
+def _results_round(values, decimals):
+  # values as read back from the '{:.<decimals>f}' of a results file:
+  # rint(values * 10**decimals) / 10**decimals is the same, but for the
+  # products that may be off by an ulp near a half, formatted instead
+  values = np.asarray(values, dtype=np.float64)
+  scale = 10. ** decimals
+  scaled = values * scale
+  rounded = np.rint(scaled) / scale
+  near = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+  if near.any():
+    fmt = '{:.%df}' % decimals
+    rounded[near] = [float(fmt.format(v)) for v in values[near]]
+  return rounded
+
+
+def results_detections(class_boxes):
+  """image_ids, confidence, BB = results_detections(class_boxes)
+
+  The detections of a class in all_boxes[class] (a list of N x 5 arrays
+  [x1 y1 x2 y2 score] per image) as voc_eval reads them from the results
+  file of pascal_voc._write_voc_results_file: 1-based boxes with one
+  decimal, scores with three, and the index of their image.
+  """
+  dets = [np.asarray(d) for d in class_boxes]
+  image_ids = np.concatenate([np.full(len(d), i, dtype=np.int64) for i, d in enumerate(dets)] +
+                             [np.zeros(0, dtype=np.int64)])
+  dets = [d.reshape(-1, 5) for d in dets if len(d) > 0]
+  dets = np.concatenate(dets).astype(np.float64) if dets else np.zeros((0, 5))
+  confidence = _results_round(dets[:, -1], 3)
+  BB = _results_round(dets[:, :4] + 1, 1)
+  return image_ids, confidence, BB
+
+
+def read_results_file(detfile, imagenames):
+  """image_ids, confidence, BB = read_results_file(detfile, imagenames)
+
+  The detections of a results file, their image indexed in imagenames.
+  """
   with open(detfile, 'r') as f:
     lines = f.readlines()
 
   splitlines = [x.strip().split(' ') for x in lines]
-  image_ids = [x[0] for x in splitlines]
+  image_ind = dict((str(imagename), i) for i, imagename in enumerate(imagenames))
+  image_ids = np.array([image_ind[x[0]] for x in splitlines], dtype=np.int64)
   confidence = np.array([float(x[1]) for x in splitlines])
   BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
+  return image_ids, confidence, BB
+
+
+def match_detections(image_ids, confidence, BB, gt_image_ids, gt_boxes, gt_difficult,
+                     ovthresh=0.5, max_pairs=1 << 22):
+  """tp, fp, sorted_scores, npos = match_detections(image_ids, confidence, BB,
+                                                    gt_image_ids, gt_boxes,
+                                                    gt_difficult, [ovthresh])
 
+  The greedy matching of voc_eval, of all the detections at once.
+
+  image_ids, confidence, BB: Image index, score and [x1 y1 x2 y2] box of
+      each detection
+  gt_image_ids, gt_boxes, gt_difficult: Image index, box and difficult
+      flag of each gt, see class_gts
+  tp, fp: True / false positive flags of the detections sorted by score
+  sorted_scores: The sorted scores, decreasing
+  npos: Number of gts not difficult
+  """
+  # sort by confidence
+  sorted_ind = np.argsort(-confidence)
+  sorted_scores = -np.sort(-confidence)
+  BB = np.asarray(BB, dtype=np.float64).reshape(-1, 4)[sorted_ind, :]
+  image_ids = np.asarray(image_ids, dtype=np.int64)[sorted_ind]
   nd = len(image_ids)
+  npos = int(np.sum(~gt_difficult))
+
+  # the gts of every image, in their order, padded to G
+  num_images = max(image_ids.max() + 1 if nd else 0,
+                   gt_image_ids.max() + 1 if len(gt_image_ids) else 0)
+  gt_order = np.argsort(gt_image_ids, kind='mergesort')
+  gt_image_ids = gt_image_ids[gt_order]
+  num_gts = np.bincount(gt_image_ids, minlength=num_images)
+  G = max(int(num_gts.max()) if num_images else 0, 1)
+  slot = np.arange(len(gt_image_ids)) - (np.cumsum(num_gts) - num_gts)[gt_image_ids]
+  BBGT = np.zeros((num_images, G, 4))
+  BBGT[gt_image_ids, slot] = gt_boxes[gt_order]
+  difficult = np.zeros((num_images, G), dtype=bool)
+  difficult[gt_image_ids, slot] = gt_difficult[gt_order]
+  padding = np.arange(G)[None, :] >= num_gts[:, None]
+
+  # overlaps of every detection with the gts of its image, in chunks
+  ovmax = np.empty(nd)
+  jmax = np.empty(nd, dtype=np.int64)
+  step = max(max_pairs // G, 1)
+  for start in range(0, nd, step):
+    ids = image_ids[start:start + step]
+    bb = BB[start:start + step, None, :]
+    gt = BBGT[ids]
+    # intersection
+    ixmin = np.maximum(gt[:, :, 0], bb[:, :, 0])
+    iymin = np.maximum(gt[:, :, 1], bb[:, :, 1])
+    ixmax = np.minimum(gt[:, :, 2], bb[:, :, 2])
+    iymax = np.minimum(gt[:, :, 3], bb[:, :, 3])
+    iw = np.maximum(ixmax - ixmin + 1., 0.)
+    ih = np.maximum(iymax - iymin + 1., 0.)
+    inters = iw * ih
+
+    # union
+    uni = ((bb[:, :, 2] - bb[:, :, 0] + 1.) * (bb[:, :, 3] - bb[:, :, 1] + 1.) +
+           (gt[:, :, 2] - gt[:, :, 0] + 1.) *
+           (gt[:, :, 3] - gt[:, :, 1] + 1.) - inters)
+
+    overlaps = inters / uni
+    overlaps[padding[ids]] = -np.inf
+    ovmax[start:start + step] = np.max(overlaps, axis=1)
+    jmax[start:start + step] = np.argmax(overlaps, axis=1)
+
+  # a detection above the threshold is ignored on a difficult gt, else
+  # true positive if it is the first to reach its gt, in score order
+  hit = ovmax > ovthresh
+  cand = hit & ~difficult[image_ids, jmax]
+  cand_ind = np.where(cand)[0]
+  _, first = np.unique(image_ids[cand_ind] * G + jmax[cand_ind], return_index=True)
   tp = np.zeros(nd)
+  tp[cand_ind[first]] = 1.
   fp = np.zeros(nd)
+  fp[~hit | (cand & (tp == 0))] = 1.
+  return tp, fp, sorted_scores, npos
 
-  if BB.shape[0] > 0:
-    # sort by confidence
-    sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
-    BB = BB[sorted_ind, :]
-    image_ids = [image_ids[x] for x in sorted_ind]
-
-    # go down dets and mark TPs and FPs
-    for d in range(nd):
-      R = class_recs[image_ids[d]]
-      bb = BB[d, :].astype(float)
-      ovmax = -np.inf
-      BBGT = R['bbox'].astype(float)
-
-      if BBGT.size > 0:
-        # compute overlaps
-        # intersection
-        ixmin = np.maximum(BBGT[:, 0], bb[0])
-        iymin = np.maximum(BBGT[:, 1], bb[1])
-        ixmax = np.minimum(BBGT[:, 2], bb[2])
-        iymax = np.minimum(BBGT[:, 3], bb[3])
-        iw = np.maximum(ixmax - ixmin + 1., 0.)
-        ih = np.maximum(iymax - iymin + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
-        ovmax = np.max(overlaps)
-        jmax = np.argmax(overlaps)
-
-      if ovmax > ovthresh:
-        if not R['difficult'][jmax]:
-          if not R['det'][jmax]:
-            tp[d] = 1.
-            R['det'][jmax] = 1
-          else:
-            fp[d] = 1.
-      else:
-        fp[d] = 1.
 
+def pr_ap(tp, fp, npos, use_07_metric=False):
+  """rec, prec, ap of the tp and fp flags of match_detections"""
   # compute precision recall
   fp = np.cumsum(fp)
   tp = np.cumsum(tp)
@@ -206,5 +258,95 @@ def voc_eval(detpath,
   # ground truth
   prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
   ap = voc_ap(rec, prec, use_07_metric)
-
   return rec, prec, ap
+
+
+def voc_eval_boxes(class_boxes,
+                   gt_image_ids,
+                   gt_boxes,
+                   gt_difficult,
+                   ovthresh=0.5,
+                   use_07_metric=False):
+  """rec, prec, ap = voc_eval_boxes(class_boxes,
+                                    gt_image_ids,
+                                    gt_boxes,
+                                    gt_difficult,
+                                    [ovthresh],
+                                    [use_07_metric])
+
+  voc_eval of the detections of all_boxes[class] in memory, with the same
+  results as voc_eval of the results file written from them.
+
+  class_boxes: Per image, N x 5 array of detections [x1 y1 x2 y2 score]
+  gt_image_ids, gt_boxes, gt_difficult: The gts of the class, see class_gts
+  """
+  image_ids, confidence, BB = results_detections(class_boxes)
+  tp, fp, _, npos = match_detections(image_ids, confidence, BB, gt_image_ids,
+                                     gt_boxes, gt_difficult, ovthresh)
+  return pr_ap(tp, fp, npos, use_07_metric)
+
+
+def _eval_class(task):
+  func, args = task
+  return func(*args)
+
+
+def map_classes(func, tasks, num_workers=None):
+  """[func(*args) for args in tasks], the classes evaluated in a process
+  pool of num_workers (the number of CPUs if None, none if 1)"""
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  if num_workers <= 1:
+    return [func(*args) for args in tasks]
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    return pool.map(_eval_class, ((func, args) for args in tasks), chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def voc_eval(detpath,
+             annopath,
+             imagesetfile,
+             classname,
+             cachedir,
+             ovthresh=0.5,
+             use_07_metric=False):
+  """rec, prec, ap = voc_eval(detpath,
+                              annopath,
+                              imagesetfile,
+                              classname,
+                              [ovthresh],
+                              [use_07_metric])
+
+  Top level function that does the PASCAL VOC evaluation.
+
+  detpath: Path to detections
+      detpath.format(classname) should produce the detection results file.
+  annopath: Path to annotations
+      annopath.format(imagename) should be the xml annotations file.
+  imagesetfile: Text file containing the list of images, one image per line.
+  classname: Category name (duh)
+  cachedir: Directory for caching the annotations
+  [ovthresh]: Overlap threshold (default = 0.5)
+  [use_07_metric]: Whether to use VOC07's 11 point AP computation
+      (default False)
+  """
+  # assumes detections are in detpath.format(classname)
+  # assumes annotations are in annopath.format(imagename)
+  # assumes imagesetfile is a text file with each line an image name
+  # cachedir caches the annotations in a pickle file
+
+  # first load gt
+  imagenames, recs = load_recs(annopath, imagesetfile, cachedir)
+
+  # extract gt objects for this class
+  gt_image_ids, gt_boxes, gt_difficult = class_gts(recs, imagenames, classname)
+
+  # read dets
+  image_ids, confidence, BB = read_results_file(detpath.format(classname), imagenames)
+
+  tp, fp, _, npos = match_detections(image_ids, confidence, BB, gt_image_ids,
+                                     gt_boxes, gt_difficult, ovthresh)
+  return pr_ap(tp, fp, npos, use_07_metric)
@@ -0,0 +1,146 @@
+from __future__ import print_function
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Parallel parsing of the PASCAL VOC style XML annotations of the
+# pascal_voc, vg and imagenet imdbs and of voc_eval, with a persistent
+# content-addressed cache.
+#
+# An annotation file is parsed once into a record of plain Python
+# objects, the text of its elements as found in the file:
+#   {'objects': [{'name', 'pose', 'truncated', 'difficult', 'object_id',
+#                 'bbox': [xmin, ymin, xmax, ymax] or None,
+#                 'attributes': [...]}, ...],
+#    'relations': [(predicate, subject_id, object_id), ...]}
+# an element missing being None. Each dataset converts the records as it
+# did the ElementTree of the file.
+#
+# The records are cached under the sha1 of the file content, so renamed
+# or copied files are not parsed again and edited ones are. Hashing and
+# parsing run in a process pool, in chunks of files.
+# --------------------------------------------------------
+
+import os
+import hashlib
+import pickle
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+BBOX_TAGS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+
+def _text(node, tag):
+    child = node.find(tag)
+    return None if child is None else child.text
+
+
+def parse_annotation(data):
+    """
+    Record of the content of an XML annotation file, see above.
+    """
+    root = ET.fromstring(data)
+    objects = []
+    for obj in root.findall('object'):
+        bbox = obj.find('bndbox')
+        objects.append({
+            'name': _text(obj, 'name'),
+            'pose': _text(obj, 'pose'),
+            'truncated': _text(obj, 'truncated'),
+            'difficult': _text(obj, 'difficult'),
+            'object_id': _text(obj, 'object_id'),
+            'bbox': None if bbox is None else [_text(bbox, tag) for tag in BBOX_TAGS],
+            'attributes': [att.text for att in obj.findall('attribute')],
+        })
+    relations = [(_text(rel, 'predicate'), _text(rel, 'subject_id'), _text(rel, 'object_id'))
+                 for rel in root.findall('relation')]
+    return {'objects': objects, 'relations': relations}
+
+
+def parse_annotation_file(filename):
+    with open(filename, 'rb') as f:
+        return parse_annotation(f.read())
+
+
+def annotation_cache_file(cache_dir, annotation_dir):
+    """
+    Cache file of the annotations of a directory, shared by its image sets.
+    """
+    key = hashlib.sha1(os.path.abspath(annotation_dir).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'xml_annotations_{}.pkl'.format(key))
+
+
+# digests already in the cache, set in the workers by the pool initializer
+_known = frozenset()
+
+
+def _init_worker(known):
+    global _known
+    _known = known
+
+
+def _parse_chunk(filenames):
+    # (digest, record) of every file, the record None if its digest is
+    # known, both None if the file does not exist
+    results = []
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            results.append((None, None))
+            continue
+        digest = hashlib.sha1(data).hexdigest()
+        results.append((digest, None if digest in _known else parse_annotation(data)))
+    return results
+
+
+def load_annotations(filenames, cache_file=None, num_workers=None, chunksize=256):
+    """
+    Records of the annotation files, None for the files that do not exist.
+
+    cache_file: pickle of the records by digest, read and extended, no
+                cache if None
+    num_workers: processes of the pool, the number of CPUs if None, all
+                 in this process if 1
+    """
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            # an unreadable cache is rebuilt
+            print('Ignoring annotation cache {:s}: {}'.format(cache_file, e))
+            cache = {}
+
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    chunks = [filenames[i:i + chunksize] for i in range(0, len(filenames), chunksize)]
+    known = frozenset(cache)
+    if num_workers > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(min(num_workers, len(chunks)), _init_worker, (known,))
+        try:
+            results = [r for chunk in pool.imap(_parse_chunk, chunks) for r in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(known)
+        results = [r for chunk in chunks for r in _parse_chunk(chunk)]
+
+    num_parsed = 0
+    records = []
+    for digest, record in results:
+        if record is not None:
+            cache[digest] = record
+            num_parsed += 1
+        records.append(None if digest is None else cache[digest])
+
+    if cache_file is not None and num_parsed > 0:
+        print('Parsed {:d} of {:d} annotation files, caching them to {:s}'.format(
+            num_parsed, len(filenames), cache_file))
+        # written aside then renamed, so that it is never read half written
+        tmpname = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmpname, 'wb') as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, cache_file)
+    return records
@@ -1,193 +1,198 @@
-import time
-import sys
-from collections import defaultdict
-
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from pycocotools import mask as COCOmask
+from __future__ import print_function
+from __future__ import division
 
+import os
+import sys
 import json
+import time
+import hashlib
+import logging
+import argparse
 import numpy as np
+from multiprocessing import Pool
 
-# Percentage movement on (x,y,w,h).
-# Each movement will generate a json file, consisting of 'dious', 'act', 'image_id', 'bbox', 'score', 'category_id'.
-acts = [[-0.02, 0, 0, 0], [0, -0.02, 0, 0], [0, 0, -0.02, 0], [0, 0, 0, -0.02]]
-
-# gtpah is groudtruth path. pdpath is the result path.
-# gtpath = '/S2/MI/data/human_pose/mscoco/annotations/instances_minival2014.json'
-# pdpath = '/S2/MI/jbr/RLObjectDetection/output/res101/coco_2014_minival/faster_rcnn_10_validation/detections_minival2014_results.json'
-gtpath = '/S2/MI/data/human_pose/mscoco/annotations/instances_train2014.json'
-pdpath = '/S2/MI/jbr/RLObjectDetection/output/res101/coco_2014_train/faster_rcnn_10/detections_train2014_results.json'
-jsonname = 'train2014'
-
-
-f = open(pdpath, 'r')
-dts = json.load(f)
-f.close()
-
-imageidlist = [x['image_id'] for x in dts]
-imageidlist = sorted(np.unique(imageidlist))
-print('---------------------------')
-print('len imageidlist:', len(imageidlist))
-print('imageidlist[0]:', imageidlist[0])
-print('---------------------------')
-
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(this_dir, '..', '..'))
+sys.path.insert(0, os.path.join(this_dir, '..'))
 
-_dts = defaultdict(list)
-for dt in dts:
-    _dts[dt['image_id'], dt['category_id']].append(dt)
-
-
-print('------------------------')
-cocoGt = COCO(gtpath)
-imgIDs = sorted(cocoGt.getImgIds())
-catIDs = sorted(cocoGt.getCatIds())
-
-print('len imgIDs:', len(imgIDs))
-
-gts = cocoGt.loadAnns(cocoGt.getAnnIds(imgIds=imgIDs, catIds=catIDs))
-print('len gts:', len(gts))
-
-_gts = defaultdict(list)
-for gt in gts:
-    _gts[gt['image_id'], gt['category_id']].append(gt)
-
-print('-------------------------')
+from config import Config
+from pycocotools.coco import COCO
+from pycocotools.boxindex import BoxIndex
+from pycocotools import jsoncache
+from datasets.RL_coco_labels import ActionLabelStore
+from model.Reinforcement.action import bbox_iou
+from model.Reinforcement.utils import init_log
+
+"""Delta-IoUs of every detection of a results json for a list of actions.
+
+An action [dx, dy, dw, dh] moves a detection [x, y, w, h] to
+[x + dx*w, y + dy*h, w + dw*w, h + dh*h]; its delta-IoU is the best IoU
+with the gts of the image after the move minus the best IoU before it,
+with the gts of all categories unless --use-cats. Detections are taken by
+decreasing score, at most --max-dets per image, and images without gts
+are skipped.
+
+The images are sharded over --workers processes and the results streamed
+into an ActionLabelStore file: per detection (x1, y1, x2, y2, score,
+cat_id, img_id) and the delta-IoUs of all actions, which are listed in
+its header.
+
+    python lib/generate_labels/generate_labels.py --phase train \\
+        --acts -0.02,0,0,0 0,-0.02,0,0 0,0,-0.02,0 0,0,0,-0.02
+"""
+
+DEFAULT_ACTS = [[-0.02, 0, 0, 0], [0, -0.02, 0, 0], [0, 0, -0.02, 0], [0, 0, 0, -0.02]]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compute the delta-IoUs of detections for a list of actions')
+    parser.add_argument('--phase', default='train', type=str, help='train or minival, for the default files')
+    parser.add_argument('--ann-file', default='', type=str, help='gt json (default: of Config)')
+    parser.add_argument('--dt-file', default='', type=str, help='results json (default: of Config)')
+    parser.add_argument('--output', default='', type=str,
+                        help='output store (default: data/output/delta_ious_<dt file>.bin)')
+    parser.add_argument('--acts', default=None, type=str, nargs='+',
+                        help='actions as dx,dy,dw,dh fractions of the box size')
+    parser.add_argument('--use-cats', action='store_true', help='IoU with the gts of the same category only')
+    parser.add_argument('--max-dets', default=100000, type=int, help='detections per image')
+    parser.add_argument('--workers', default=8, type=int)
+    parser.add_argument('--shard-size', default=256, type=int, help='images per task')
+    parser.add_argument('--json-cache-dir', default=None, type=str,
+                        help='binary json cache directory (default: of Config)')
+    return parser.parse_args()
+
+
+# per-process state of the pool workers, set once by _init_worker
+_worker = {}
+
+def _init_worker(catIds, dt_boxes, gt_boxes, acts, use_cats, max_dets):
+    _worker.update(catIds=catIds, dt_boxes=dt_boxes, gt_boxes=gt_boxes,
+                   acts=acts, use_cats=use_cats, max_dets=max_dets)
+
+
+def detection_rows(img_id, catIds, dt_boxes, gt_boxes, max_dets):
+    '''
+    Rows of dt_boxes of the detections of an image, by decreasing score
+    '''
+    if gt_boxes.count(img_id, catIds) == 0:
+        return np.zeros(0, dtype=np.int64)
+    rows = dt_boxes.rows(img_id, catIds)
+    return rows[np.argsort(-dt_boxes.scores[rows], kind='mergesort')][:max_dets]
+
+
+def image_delta_ious(img_id, catIds, dt_boxes, gt_boxes, acts, use_cats=False, max_dets=100000):
+    '''
+    Return:
+        bboxes:     np.array of shape [Nr_dts, 7] (x1, y1, x2, y2, score, cat_id, img_id)
+        delta_ious: np.array of shape [Nr_dts, num_acts]
+    '''
+    dts = detection_rows(img_id, catIds, dt_boxes, gt_boxes, max_dets)
+    gts = gt_boxes.rows(img_id, catIds)
+    xywh = dt_boxes.bboxes[dts]
+    gtboxes = gt_boxes.bboxes[gts]
+    iscrowd = gt_boxes.iscrowd[gts]
+
+    # all actions of all detections as one batch of boxes
+    moved = xywh[:, None, :] + acts[None, :, :] * xywh[:, None, [2, 3, 2, 3]]
+    ious = bbox_iou(xywh, gtboxes, iscrowd)
+    new_ious = bbox_iou(moved.reshape(-1, 4), gtboxes, iscrowd).reshape(len(dts), len(acts), -1)
+    if use_cats:
+        same = dt_boxes.catIds[dts][:, None] == gt_boxes.catIds[gts][None, :]
+        ious *= same
+        new_ious *= same[:, None, :]
+    delta_ious = new_ious.max(2) - ious.max(1)[:, None]
+
+    bboxes = np.empty((len(dts), 7), dtype=np.float64)
+    bboxes[:, :2] = xywh[:, :2]
+    bboxes[:, 2:4] = xywh[:, 2:4] + xywh[:, :2]
+    bboxes[:, 4] = dt_boxes.scores[dts]
+    bboxes[:, 5] = dt_boxes.catIds[dts]
+    bboxes[:, 6] = img_id
+    return bboxes, delta_ious
+
+
+def _label_shard(shard):
+    return [image_delta_ious(img_id, _worker['catIds'], _worker['dt_boxes'], _worker['gt_boxes'],
+                             _worker['acts'], _worker['use_cats'], _worker['max_dets'])
+            for img_id in shard]
+
+
+def generate_labels(filename, imgIds, catIds, dt_boxes, gt_boxes, acts, use_cats=False,
+                    max_dets=100000, num_workers=8, shard_size=256, key=''):
+    '''
+    Write the delta-IoUs of the detections of imgIds for the actions acts
+    (np.array of shape [num_acts, 4]) to the ActionLabelStore filename.
+    '''
+    logger = logging.getLogger('global')
+    acts = np.asarray(acts, dtype=np.float64).reshape(-1, 4)
+    num_dets = [len(detection_rows(img_id, catIds, dt_boxes, gt_boxes, max_dets)) for img_id in imgIds]
+    labeled = [img_id for img_id, num in zip(imgIds, num_dets) if num > 0]
+    shards = [labeled[i:i + shard_size] for i in range(0, len(labeled), shard_size)]
+    logger.info('Labeling {} detections of {} images in {} shards...'.format(
+        sum(num_dets), len(labeled), len(shards)))
+
+    initargs = (catIds, dt_boxes, gt_boxes, acts, use_cats, max_dets)
+    pool = None
+    if num_workers > 1 and len(shards) > 1:
+        pool = Pool(min(num_workers, len(shards)), initializer=_init_worker, initargs=initargs)
+        results = pool.imap(_label_shard, shards)
+    else:
+        _init_worker(*initargs)
+        results = (_label_shard(shard) for shard in shards)
+    try:
+        # in order, written as soon as each shard is done
+        labels = (label for shard_labels in results for label in shard_labels)
+        extra_header = {'acts': acts.tolist(), 'use_cats': bool(use_cats), 'max_dets': max_dets}
+        return ActionLabelStore.write(filename, key, imgIds, num_dets, len(acts), labels,
+                                      extra_header=extra_header)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _worker.clear()
+
+
+def main():
+    args = parse_args()
+    init_log('global', logging.INFO)
+    logger = logging.getLogger('global')
+    config = Config(phase=args.phase)
+    ann_file = args.ann_file if args.ann_file else config.ann_file
+    dt_file = args.dt_file if args.dt_file else config.dt_file
+    json_cache_dir = args.json_cache_dir if args.json_cache_dir is not None else config.json_cache_dir
+    json_cache_dir = json_cache_dir if json_cache_dir else None
+    output = args.output
+    if not output:
+        output = os.path.join('data', 'output', 'delta_ious_{}.bin'.format(
+            os.path.splitext(os.path.basename(dt_file))[0]))
+    if args.acts is None:
+        acts = DEFAULT_ACTS
+    else:
+        acts = [[float(v) for v in act.split(',')] for act in args.acts]
+        assert all(len(act) == 4 for act in acts), 'an action is dx,dy,dw,dh'
 
-def computeIoU(imgId, catId, useCats=False, maxDets=100000):
-    if useCats:
-        gt = _gts[imgId, catId]
-        dt = _gts[imgId, catId]
+    tic = time.time()
+    cocoGt = COCO(ann_file, cacheDir=json_cache_dir)
+    imgIds = sorted(cocoGt.getImgIds())
+    catIds = sorted(cocoGt.getCatIds())
+    gt_boxes = cocoGt.boxIndex
+    if json_cache_dir:
+        dt_boxes = jsoncache.loadResults(dt_file, json_cache_dir)
     else:
-        gt = [_ for cId in catIDs for _ in _gts[imgId, cId]]
-        dt = [_ for cId in catIDs for _ in _dts[imgId, cId]]
-
-    if len(gt) == 0 or len(dt) == 0:
-        return [], 1, 1, 1
-
-    dt = sorted(dt, key=lambda x: -x['score'])
-    if len(dt) > maxDets:
-        dt = dt[0:maxDets]
-
-    g = [g['bbox'] for g in gt]
-    d = [d['bbox'] for d in dt]
-
-    # print('d len:', len(d))
-    # print('g len:', len(g))
-
-    iscrowd = [int(o['iscrowd']) for o in gt]
-    ious = COCOmask.iou(d, g, iscrowd)
-    ious = np.array(ious)
-
-    if ious.ndim == 0:
-        ious = np.array([ious])
-
-    if ious.ndim == 1:
-        if len(g) > 1:
-            ious = np.array([ max(ious) ])
-
-    if ious.ndim == 2:
-        ious = np.amax(ious, axis=1)
-
-    if ious.ndim > 2:
-        print('Wrong in ious dim!')
-        sys.exit(-1)
-
-    return ious, g, dt, iscrowd
-
-# action is 4-tuple floats, [0.02, 0, 0, 0]
-def computeNewIoU(g, d, iscrowd, action):
-    if g == 1:
-        return []
-
-    for i in range(len(d)):
-        x, y, w, h = d[i]
-        dx = w * action[0]
-        dy = h * action[1]
-        dw = w * action[2]
-        dh = h * action[3]
-        
-        x += dx
-        y += dy
-        w += dw
-        h += dh
-        d[i] = [x, y, w, h]
-
-    ious = COCOmask.iou(d, g, iscrowd)
-    ious = np.array(ious)
-
-    if ious.ndim == 0:
-        ious = np.array([ious])
-        return ious
-    if ious.ndim == 1:
-        if len(d) > 1:
-            return ious
-        else:
-            ious = np.array([ max(ious) ])
-            return ious
-    if ious.ndim == 2:
-        ious = np.amax(ious, axis=1)
-        return ious
-
-    if ious.ndim > 2:
-        print('Wrong in newious dim!')
-        sys.exit(-1)
-
-# ious, g, dt, iscrowd = computeIoU(139, 86)
-# # print('iou sample:', ious)
-# 
-# d = [d['bbox'] for d in dt]
-# act = [0.02, 0, 0, 0]
-# newious = computeNewIoU(g, d, iscrowd, act)
-# # print('newious:', newious)
-# 
-# for i in range(len(dt)):
-#     dious = newious[i] - ious[i]
-#     dt[i]['dious'] = dious
-#     dt[i]['act'] = act
-
-
-# f = open('1.json', 'w')
-# json.dump(dt, f)
-# f.close() 
-
-   
-for act in acts:
+        dt_boxes = BoxIndex.fromAnns(json.load(open(dt_file, 'r')))
+    logger.info('Loaded {} gts and {} detections in {:.1f}s'.format(
+        len(gt_boxes), len(dt_boxes), time.time() - tic))
+
+    key = hashlib.sha1(json.dumps([os.path.realpath(ann_file), os.path.realpath(dt_file),
+                                   acts, args.use_cats, args.max_dets]).encode('utf-8')).hexdigest()
+    if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
     tic = time.time()
-    dtlist = []
-    cnt = -1 
-    for image_id in imgIDs:
-        print('image_id :', image_id)
-        sys.exit("exit suddenly.")
-        cnt += 1
-        if cnt % 10000 == 0:
-            print('num: {:8d} | image_id:{:10d}'.format(cnt, image_id))
-        # for category_id in catIDs:
-        ious, g, dt, iscrowd = computeIoU(image_id, 0)
-        if g == 1:
-            continue
-
-        d = [d['bbox'] for d in dt] 
-        newious = computeNewIoU(g, d, iscrowd, act)
-
-        if len(dt) == 0:
-            print('ious:', ious)    
-
-        if len(ious) == 0:
-            print('ious::', ious, 'g::', g)
-            print('len(ious):', len(ious))
-
-        for i in range(len(dt)):
-            dious = newious[i] - ious[i]
-            dt[i]['dious'] = dious
-            dt[i]['act'] = act 
-    
-        dtlist += dt
-
-        # break
-
-    f = open('{}{}.json'.format(jsonname, act), 'w')
-    json.dump(dtlist, f)
-    f.close()
-    toc = time.time()
-    print('--- time: {:.4f} seconds ---'.format(toc - tic))
+    store = generate_labels(output, imgIds, catIds, dt_boxes, gt_boxes, acts,
+                            use_cats=args.use_cats, max_dets=args.max_dets,
+                            num_workers=args.workers, shard_size=args.shard_size, key=key)
+    logger.info('{}: {} images, {} detections, {} actions in {:.1f}s'.format(
+        store.filename, len(store), store.header['num_dets'], store.num_acts, time.time() - tic))
+
+if __name__ == '__main__':
+    main()
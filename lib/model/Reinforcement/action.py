@@ -1,8 +1,22 @@
+import torch
 import numpy as np
+from pycocotools import boxiou
 
 def Identify(x):
 	return x
 
+def bbox_iou(dts, gts, iscrowd):
+	"""
+		Same as pycocotools.mask.iou on boxes, for all pairs at once.
+		input:
+			dts:	 np.array of shape n * 4 (x, y, w, h)
+			gts:	 np.array of shape g * 4 (x, y, w, h)
+			iscrowd: np.array of shape g
+		output:
+			np.array of shape n * g
+	"""
+	return boxiou.iou(dts, gts, iscrowd)
+
 class Action:
 	def __init__(self, delta, alpha=1., iou_thres=0, wtrans=None):
 		self.delta = delta
@@ -22,43 +36,114 @@ class Action:
 				idx += 1
 
 
-	def move_from_act(self, bboxes, preds, targets, maxk):
+	def delta_ious(self, bboxes, gtboxes, iscrowd, bbox_cats=None, gt_cats=None):
 		"""
 			input:
-				bboxes: np.array of shape b * n * 4
-				preds:	np.array of shape b * n * num_acts
-				targest:np.array of shape b * n * num_acts
-				maxk:	int, max number of boxes to be moved
+				bboxes:	  np.array of shape n * 4 (x, y, w, h)
+				gtboxes:  np.array of shape g * 4 (x, y, w, h)
+				iscrowd:  np.array of shape g
+				bbox_cats:np.array of shape n, optional category of each bbox
+				gt_cats:  np.array of shape g, optional category of each gtbox
+			output:
+				np.array of shape n * num_acts, gain of the best IoU with
+				gtboxes (of the same category) after applying each action
 		"""
-		batch_size, num_boxes, _ = bboxes.shape
+		bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+		num_boxes = bboxes.shape[0]
+		if num_boxes == 0 or len(gtboxes) == 0:
+			return np.zeros((num_boxes, self.num_acts), dtype=np.float64)
+
+		wh = bboxes[:, [2, 3, 2, 3]]
+		new_bboxes = bboxes[:, None, :] + self.actDeltas[None, :, :] * wh[:, None, :]
+
+		origin_ious = bbox_iou(bboxes, gtboxes, iscrowd)
+		new_ious = bbox_iou(new_bboxes.reshape(-1, 4), gtboxes, iscrowd)
+		new_ious = new_ious.reshape(num_boxes, self.num_acts, -1)
+		if bbox_cats is not None and gt_cats is not None:
+			same = np.asarray(bbox_cats)[:, None] == np.asarray(gt_cats)[None, :]
+			origin_ious *= same
+			new_ious *= same[:, None, :]
+
+		return new_ious.max(2) - origin_ious.max(1)[:, None]
+
+	def move(self, bboxes, act_ids):
+		"""
+			input:
+				bboxes:	np.array or tensor of shape k * 4 (x, y, w, h)
+				act_ids:np.array or tensor of shape k
+			output:
+				new bboxes after applying act_ids[i] to bboxes[i]
+		"""
+		if torch.is_tensor(bboxes):
+			act_deltas = self._act_deltas_as(bboxes).index_select(0, act_ids)
+		else:
+			act_deltas = self.actDeltas[act_ids]
+		return bboxes + act_deltas * bboxes[:, [2, 3, 2, 3]]
+
+	def move_from_act(self, bboxes, preds, targets, maxk=None):
+		"""
+			Move the maxk boxes of highest predicted score of each image
+			by their best action, where that action is correct.
+			input:
+				bboxes: np.array or tensor of shape b * n * 4 (x, y, w, h), moved in place
+				preds:	np.array or tensor of shape b * n * num_acts
+				targest:np.array or tensor of shape b * n * num_acts
+				maxk:	int, max number of boxes to be moved per image,
+						None to apply one action to every box
+			output:
+				bboxes, percentage of the selected boxes with a correct action
+		"""
+		batch_size, num_boxes = bboxes.shape[0], bboxes.shape[1]
 		assert(preds.shape == targets.shape)
 		assert(bboxes.ndim == 3 and preds.ndim == 3)
 		assert(preds.shape[0] == batch_size)
 		assert(preds.shape[1] == num_boxes)
+		if maxk is None or maxk > num_boxes:
+			maxk = num_boxes
 
-		correct = 0
-		for bid in range(batch_size):
-			cnt = 0
-			vis = [None] * num_boxes
-			pred, target = preds[bid], targets[bid]
-			inds = np.flip(np.argsort(pred.reshape(-1)), axis=0)
-			for num in inds:
-				idx = num // self.num_acts
-				act_id = num % self.num_acts
-				assert(pred.reshape(-1)[num] == pred[idx][act_id])
-				x, y, w, h =  bboxes[bid][idx]
-				delta = self.actDeltas[act_id]
-				if vis[idx] is None:
-					cnt += 1
-					vis[idx] = 1
-					if target[idx][act_id] == 1:
-						correct += 1
-						bboxes[bid][idx] += delta * np.array([w,h,w,h])
-				if cnt >= maxk:
-					break
+		if torch.is_tensor(bboxes):
+			correct = self._move_from_act_torch(bboxes, preds, targets, maxk)
+		else:
+			correct = self._move_from_act_numpy(bboxes, preds, targets, maxk)
 		return bboxes, correct * 100. / (batch_size * maxk)
 
+	def _move_from_act_numpy(self, bboxes, preds, targets, maxk):
+		batch_size, num_boxes, _ = bboxes.shape
+		bids = np.arange(batch_size)[:, None]
+		best_act = preds.argmax(2)
+		moved = targets[bids, np.arange(num_boxes)[None, :], best_act] == 1
+		if maxk < num_boxes:
+			best_score = preds.max(2)
+			top = np.argpartition(-best_score, maxk - 1, axis=1)[:, :maxk]
+			selected = np.zeros(moved.shape, dtype=bool)
+			selected[bids, top] = True
+			moved &= selected
+
+		wh = bboxes[moved][:, [2, 3, 2, 3]]
+		bboxes[moved] += self.actDeltas[best_act[moved]] * wh
+		return int(moved.sum())
 
+	def _move_from_act_torch(self, bboxes, preds, targets, maxk):
+		batch_size, num_boxes, _ = bboxes.size()
+		best_score, best_act = preds.max(2)
+		moved = targets.gather(2, best_act.unsqueeze(2)).squeeze(2) == 1
+		if maxk < num_boxes:
+			_, top = best_score.topk(maxk, 1)
+			selected = torch.zeros_like(moved)
+			selected.scatter_(1, top, 1)
+			moved = moved & selected
 
+		act_deltas = self._act_deltas_as(bboxes)
+		wh = bboxes[:, :, [2, 3, 2, 3]]
+		moves = act_deltas.index_select(0, best_act.view(-1)).view(batch_size, num_boxes, 4) * wh
+		bboxes += moves * moved.unsqueeze(2).type_as(bboxes)
+		return moved.sum().item()
 
-		
+	def _act_deltas_as(self, tensor):
+		# actDeltas copied once to the device and type of tensor
+		key = (tensor.type(), tensor.get_device() if tensor.is_cuda else -1)
+		if getattr(self, '_act_deltas_cache', None) is None:
+			self._act_deltas_cache = {}
+		if key not in self._act_deltas_cache:
+			self._act_deltas_cache[key] = torch.from_numpy(self.actDeltas).type_as(tensor)
+		return self._act_deltas_cache[key]
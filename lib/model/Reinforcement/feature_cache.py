@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+import torch
+import numpy as np
+
+
+TRUNK_MODULES = ('conv1.', 'bn1.', 'layer1.', 'layer2.', 'layer3.')
+
+def trunk_digest(model):
+	"""sha1 of the weights and buffers of the trunk of a ResNet"""
+	model = model.module if hasattr(model, 'module') else model
+	sha = hashlib.sha1()
+	for name, value in sorted(model.state_dict().items()):
+		if name.startswith(TRUNK_MODULES):
+			sha.update(name.encode('utf-8'))
+			sha.update(value.cpu().numpy().tobytes())
+	return sha.hexdigest()
+
+
+class FeatureCache(object):
+	"""
+		On-disk cache of the trunk (layer3) feature map of every image,
+		one compressed .npz per image id, optionally stored at fp16.
+
+		The frozen trunk output of an image only depends on the trunk
+		weights and on the resized image, so the cache is valid as long as
+		those do not change: single scale and no flip. Use `key` to name a
+		sub directory after everything the features depend on.
+	"""
+	def __init__(self, cache_dir, fp16=True):
+		self.cache_dir = cache_dir
+		self.fp16 = fp16
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+
+	@staticmethod
+	def key(*items):
+		sha = hashlib.sha1()
+		for item in items:
+			if isinstance(item, str) and os.path.isfile(item):
+				stat = os.stat(item)
+				item = (os.path.realpath(item), stat.st_size, int(stat.st_mtime))
+			sha.update(repr(item).encode('utf-8'))
+		return sha.hexdigest()[:16]
+
+	def _path(self, img_id):
+		return os.path.join(self.cache_dir, '{:012d}.npz'.format(img_id))
+
+	def __contains__(self, img_id):
+		return os.path.isfile(self._path(img_id))
+
+	def save(self, img_id, feat):
+		"""feat: tensor of shape [C, h, w]"""
+		feat = feat.cpu().numpy()
+		feat = feat.astype(np.float16 if self.fp16 else np.float32)
+		filename = self._path(img_id)
+		tmpname = '{}.{}.tmp.npz'.format(filename[:-len('.npz')], os.getpid())
+		np.savez_compressed(tmpname, feat=feat)
+		os.rename(tmpname, filename)
+
+	def load(self, img_id):
+		"""FloatTensor of shape [C, h, w]"""
+		with np.load(self._path(img_id)) as data:
+			feat = data['feat']
+		return torch.from_numpy(feat.astype(np.float32))
@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import torch
+
+
+class RefineEngine(object):
+	"""
+		Multi-step refinement of boxes with a model.Reinforcement.resnet.ResNet.
+
+		The layer3 feature map of a batch is computed once by model.trunk,
+		then each step runs only model.head (RoIAlign + layer4 + fc8/fc) on
+		the boxes that are still active and moves them by their best action.
+		A box stops once the score of its best action is not above
+		stop_thres, and is not fed to the head again.
+	"""
+	def __init__(self, model, bbox_action, num_steps=1, stop_thres=0.):
+		self.model = model.module if hasattr(model, 'module') else model
+		self.bbox_action = bbox_action
+		self.num_steps = num_steps
+		self.stop_thres = stop_thres
+
+	def _sync(self, tensor):
+		if tensor.is_cuda:
+			torch.cuda.synchronize()
+
+	def __call__(self, img, bboxes, trunk_feat=False):
+		"""
+			input:
+				img:	tensor of shape b * 3 * h * w, or the trunk
+						feature map already if trunk_feat
+				bboxes:	tensor of shape b * n * 8 (bid, x1, y1, x2, y2, score, cat_id, img_id)
+			output:
+				steps:	list of num_steps + 1 np.array of shape b * n * 8, with
+						boxes as (bid, x, y, w, h, ...) before each step and at the end
+				times:	list of num_steps + 1 seconds, of the trunk and of each step
+				active:	list of num_steps ints, number of boxes fed to each step
+		"""
+		batch_size, num_boxes = bboxes.size(0), bboxes.size(1)
+		times, active_nums = [], []
+
+		with torch.no_grad():
+			tic = time.time()
+			feat = img if trunk_feat else self.model.trunk(img)
+			self._sync(feat)
+			times.append(time.time() - tic)
+
+			boxes = bboxes.clone()
+			boxes[:, :, 3:5] -= boxes[:, :, 1:3]
+			xywh = boxes[:, :, 1:5].contiguous().view(-1, 4)
+			bids = boxes[:, :, 0].contiguous().view(-1)
+			# padded boxes are never active
+			active = (xywh[:, 2] > 0) & (xywh[:, 3] > 0)
+			steps = [xywh.cpu().numpy().copy()]
+
+			for step in range(self.num_steps):
+				tic = time.time()
+				inds = torch.nonzero(active).view(-1)
+				active_nums.append(inds.numel())
+				if inds.numel() > 0:
+					cur = xywh.index_select(0, inds)
+					rois = cur.new(inds.numel(), 5)
+					rois[:, 0] = bids.index_select(0, inds)
+					rois[:, 1:3] = cur[:, 0:2]
+					rois[:, 3:5] = cur[:, 0:2] + cur[:, 2:4]
+
+					pred = self.model.head(feat, rois)
+					best_score, best_act = pred.max(1)
+					keep = best_score > self.stop_thres
+					active.index_fill_(0, inds[keep == 0], 0)
+
+					keep_inds = torch.nonzero(keep).view(-1)
+					if keep_inds.numel() > 0:
+						moved = self.bbox_action.move(cur.index_select(0, keep_inds),
+													best_act.index_select(0, keep_inds))
+						xywh.index_copy_(0, inds.index_select(0, keep_inds), moved)
+				self._sync(xywh)
+				times.append(time.time() - tic)
+				steps.append(xywh.cpu().numpy().copy())
+
+		outs = []
+		boxes = boxes.cpu().numpy()
+		for step_xywh in steps:
+			out = boxes.copy()
+			out[:, :, 1:5] = step_xywh.reshape(batch_size, num_boxes, 4)
+			outs.append(out)
+		return outs, times, active_nums
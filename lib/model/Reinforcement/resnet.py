@@ -107,6 +107,7 @@ class ResNet(nn.Module):
 		self.inplanes = 64
 		self.num_acts = num_acts
 		super(ResNet, self).__init__()
+		self.frozen = False
 		self.conv1 = nn.Conv2d(3, 64, kernel_size=7, stride=2, padding=3,
 					 bias=False)
 		self.bn1 = nn.BatchNorm2d(64)
@@ -141,11 +142,27 @@ class ResNet(nn.Module):
 		self._freeze_module(self.bn1)
 		for layer in [self.layer1, self.layer2, self.layer3]:
 			self._freeze_module(layer)
+		self.frozen = True
+		self.train(self.training)
 
 	def _freeze_module(self, module):
 		for p in module.parameters():
 			p.requires_grad = False
 
+	def train(self, mode=True):
+		"""
+		The batch norms of the frozen trunk stay in eval mode, normalizing
+		with their running stats, which are not updated: the trunk output
+		does not change in training, as the cached trunk features.
+		"""
+		super(ResNet, self).train(mode)
+		if self.frozen:
+			for module in [self.bn1, self.layer1, self.layer2, self.layer3]:
+				for m in module.modules():
+					if isinstance(m, nn.BatchNorm2d):
+						m.eval()
+		return self
+
 	def _make_layer(self, block, planes, blocks, stride=1):
 		downsample = None
 		if stride != 1 or self.inplanes != planes * block.expansion:
@@ -163,11 +180,20 @@ class ResNet(nn.Module):
 
 		return nn.Sequential(*layers)
 
-	def forward(self, img, bboxes, targets, weights):
+	def forward(self, img, bboxes, targets, weights, trunk_feat=False):
 		bboxes = bboxes.view(-1, 5)
 		targets = targets.view(-1, self.num_acts)
 		weights = weights.view(-1, self.num_acts)
 
+		# img may already be the (cached) trunk feature map
+		x = img if trunk_feat else self.trunk(img)
+		pred = self.head(x, bboxes)
+
+		loss, noweight_loss = self._weighted_mse_loss(pred, targets, weights)
+		return pred, loss, noweight_loss
+
+	def trunk(self, img):
+		"""layer3 feature map of the images, shared by all their boxes"""
 		x = self.conv1(img)
 		x = self.bn1(x)
 		x = self.relu(x)
@@ -176,7 +202,10 @@ class ResNet(nn.Module):
 		x = self.layer1(x)
 		x = self.layer2(x)
 		x = self.layer3(x)
+		return x
 
+	def head(self, x, bboxes):
+		"""action scores of bboxes (bid, x1, y1, x2, y2) on the trunk feature map x"""
 		roi_feat = self.RCNN_roi_align(x, bboxes)
 
 		# head to tail
@@ -188,9 +217,7 @@ class ResNet(nn.Module):
 		x = self.fc8(pooled_feat)
 		x = self.relu(x)
 		pred = self.fc(x)
-
-		loss, noweight_loss = self._weighted_mse_loss(pred, targets, weights)
-		return pred, loss, noweight_loss
+		return pred
 
 	def _weighted_mse_loss(self, inp, targets, weights):
 		# TODO move this function
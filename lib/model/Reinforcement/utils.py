@@ -74,13 +74,14 @@ def ensure_dir(dirpath):
         os.makedirs(dirpath)
 
 
-def cocoval(ann_file, res_file, ann_type='bbox'):
+def cocoval(ann_file, res_file, ann_type='bbox', num_workers=4):
     from pycocotools.coco import COCO
-    from pycocotools.cocoeval import COCOeval
+    from pycocotools.fasteval import FastCOCOeval
     coco_gt = COCO(ann_file)
     coco_dt = coco_gt.loadRes(res_file)
     imgIds = sorted(coco_gt.getImgIds())
-    coco_eval = COCOeval(coco_gt, coco_dt)
+    coco_eval = FastCOCOeval(coco_gt, coco_dt, num_workers=num_workers)
     coco_eval.evaluate()
     coco_eval.accumulate()
     coco_eval.summarize()
+    return coco_eval.stats
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+import torch
+
+
+def _first_true(mask):
+    """Index of the first nonzero entry of each row of a (B, N) mask."""
+    n = mask.size(1)
+    rank = torch.arange(n, 0, -1, dtype=torch.long, device=mask.device)
+    return n - (mask.long() * rank).max(1)[0]
+
+
+def nms_cpu_batch(boxes, thresh, max_keep=0, valid=None):
+    """Greedy NMS of B images at once, in pure torch.
+
+    boxes: (B, N, 4) x1, y1, x2, y2 of every image, sorted by decreasing
+        score. Same overlap as the CUDA kernel: +1 pixel widths, and a box
+        is suppressed when its IoU with a kept box is > thresh.
+    max_keep: stop after that many boxes are kept per image (all if 0).
+    valid: optional (B, N) mask, boxes where it is 0 are never kept.
+
+    Returns keep (B, K) LongTensor of indices into N, in score order and
+    padded with -1, and num_keep (B,) LongTensor.
+    """
+    batch_size, n = boxes.size(0), boxes.size(1)
+    max_keep = n if max_keep <= 0 else min(max_keep, n)
+    keep = torch.full((batch_size, max_keep), -1, dtype=torch.long, device=boxes.device)
+    num_keep = torch.zeros(batch_size, dtype=torch.long, device=boxes.device)
+    if n == 0 or batch_size == 0:
+        return keep, num_keep
+
+    x1, y1, x2, y2 = boxes[:, :, 0], boxes[:, :, 1], boxes[:, :, 2], boxes[:, :, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    batch_idx = torch.arange(batch_size, dtype=torch.long, device=boxes.device)
+    if valid is None:
+        candidates = torch.ones(batch_size, n, dtype=torch.uint8, device=boxes.device)
+    else:
+        candidates = valid.clone().to(torch.uint8)
+
+    # one iteration keeps the next box of every image that still has one
+    for k in range(max_keep):
+        active = candidates.max(1)[0] > 0
+        if active.sum() == 0:
+            break
+        i = _first_true(candidates).clamp(max=n - 1)
+
+        xx1 = torch.max(x1, x1[batch_idx, i].view(-1, 1))
+        yy1 = torch.max(y1, y1[batch_idx, i].view(-1, 1))
+        xx2 = torch.min(x2, x2[batch_idx, i].view(-1, 1))
+        yy2 = torch.min(y2, y2[batch_idx, i].view(-1, 1))
+        w = (xx2 - xx1 + 1).clamp(min=0)
+        h = (yy2 - yy1 + 1).clamp(min=0)
+        inter = w * h
+        ovr = inter / (areas[batch_idx, i].view(-1, 1) + areas - inter)
+
+        suppressed = (ovr > thresh) & active.view(-1, 1)
+        candidates[suppressed] = 0
+        candidates[batch_idx, i] = 0
+        keep[:, k] = torch.where(active, i, keep[:, k])
+        num_keep += active.long()
+    return keep, num_keep
+
+
+def nms_cpu(dets, thresh, max_keep=0):
+    """Drop-in for nms_gpu: dets (N, 5) sorted by score, returns keep (K, 1) int."""
+    keep, num_keep = nms_cpu_batch(dets[:, :4].contiguous().unsqueeze(0), thresh, max_keep)
+    return keep[0, :int(num_keep[0])].int().view(-1, 1)
@@ -5,8 +5,14 @@
 # Written by Ross Girshick
 # --------------------------------------------------------
 import torch
+import numpy as np
 from model.utils.config import cfg
-from model.nms.nms_gpu import nms_gpu
+from model.nms.nms_cpu import nms_cpu, nms_cpu_batch
+try:
+    from model.nms.nms_gpu import nms_gpu
+except ImportError:
+    # extension not built: only the CPU implementation is available
+    nms_gpu = None
 
 def nms(dets, thresh, force_cpu=False):
     """Dispatch to either CPU or GPU NMS implementations."""
@@ -15,4 +21,123 @@ def nms(dets, thresh, force_cpu=False):
     # ---numpy version---
     # original: return gpu_nms(dets, thresh, device_id=cfg.GPU_ID)
     # ---pytorch version---
+    if force_cpu or not dets.is_cuda or nms_gpu is None:
+        return nms_cpu(dets, thresh)
     return nms_gpu(dets, thresh)
+
+def batched_nms(boxes, thresh, max_keep=0, force_cpu=False, max_boxes=32768):
+    """NMS of all images of a batch at once.
+
+    boxes: (B, N, 4) tensor, the boxes of every image sorted by decreasing
+        score. max_keep: keep at most that many boxes per image (all if 0).
+
+    Returns keep (B, K) LongTensor of indices into N in score order, padded
+    with -1, and num_keep (B,) LongTensor.
+
+    On the GPU the boxes of every image are shifted by a per-image offset so
+    that boxes of different images never overlap, and NMS of up to max_boxes
+    boxes runs in a single kernel launch. The kernel's mask grows with the
+    square of the number of boxes, so larger batches are split in chunks of
+    whole images.
+    """
+    if force_cpu or not boxes.is_cuda or nms_gpu is None:
+        return nms_cpu_batch(boxes, thresh, max_keep)
+    return _offset_nms(boxes, thresh, max_keep, max_boxes, nms_gpu)
+
+def _offset_nms(boxes, thresh, max_keep, max_boxes, nms_fn):
+    batch_size, n = boxes.size(0), boxes.size(1)
+    max_keep = n if max_keep <= 0 else min(max_keep, n)
+    keep = boxes.new(batch_size, max_keep).long().fill_(-1)
+    num_keep = boxes.new(batch_size).long().zero_()
+    if n == 0:
+        return keep, num_keep
+
+    chunk = max(1, max_boxes // n)
+    # wide enough that shifted boxes do not touch, given the +1 widths
+    offset = boxes.max() - boxes.min() + 2
+    for start in range(0, batch_size, chunk):
+        end = min(start + chunk, batch_size)
+        img_idx = torch.arange(0, end - start).type_as(boxes).view(-1, 1, 1)
+        dets = boxes.new(end - start, n, 5).zero_()
+        dets[:, :, :4] = boxes[start:end] + img_idx * offset
+        keep_all = nms_fn(dets.view(-1, 5), thresh).long().view(-1)
+
+        # kept indices are increasing, so grouped by image and in score order
+        img = keep_all // n
+        img_range = torch.arange(0, end - start).type_as(img).view(-1, 1)
+        first = (img.view(1, -1) < img_range).long().sum(1)
+        rank = torch.arange(0, keep_all.numel()).type_as(img) - first[img]
+        mask = rank < max_keep
+        keep[start + img[mask], rank[mask]] = keep_all[mask] - img[mask] * n
+        num_keep[start:end] = (img.view(1, -1) == img_range).long().sum(1).clamp(max=max_keep)
+    return keep, num_keep
+
+def multiclass_nms(scores, boxes, score_thresh, nms_thresh, max_per_image=0, force_cpu=False):
+    """Class-wise NMS of the detections of one image, with a single NMS call.
+
+    scores: (R, K) class probabilities, column 0 being the background.
+    boxes: (R, 4 * K) per-class boxes, or (R, 4) class agnostic boxes.
+    Keeps the boxes scoring > score_thresh and not suppressed by a box of
+    the same class, then at most max_per_image of them over all classes
+    (all if 0, ties at the cut are kept).
+
+    Returns a list of K np.arrays of shape (D_j, 5) [x1, y1, x2, y2, score]
+    sorted by decreasing score, the first one (background) empty. The
+    results are copied to the host once.
+    """
+    num_classes = scores.size(1)
+    if boxes.size(1) == 4:
+        boxes = boxes.repeat(1, num_classes)
+    boxes = boxes.contiguous().view(-1, num_classes, 4)[:, 1:]
+    scores = scores[:, 1:]
+
+    if force_cpu or not scores.is_cuda or nms_gpu is None:
+        dets, labels = _multiclass_nms_batch(scores, boxes, score_thresh, nms_thresh)
+    else:
+        dets, labels = _multiclass_nms_offset(scores, boxes, score_thresh, nms_thresh)
+
+    # Limit to max_per_image detections *over all classes*
+    if max_per_image > 0 and dets.size(0) > max_per_image:
+        image_thresh = dets[:, 4].topk(max_per_image)[0][-1]
+        keep = torch.nonzero(dets[:, 4] >= image_thresh).view(-1)
+        dets, labels = dets[keep], labels[keep]
+
+    dets = torch.cat((dets, labels.type_as(dets).view(-1, 1)), 1).cpu().numpy()
+    labels = dets[:, 5].astype(np.int64) + 1
+    order = np.argsort(labels, kind='mergesort')
+    counts = np.bincount(labels, minlength=num_classes)
+    return np.split(dets[order, :5], np.cumsum(counts)[:-1])
+
+def _multiclass_nms_batch(scores, boxes, score_thresh, nms_thresh):
+    # classes as the batch of nms_cpu_batch, boxes below score_thresh never kept
+    sorted_scores, order = scores.t().sort(1, True)
+    cls_boxes = boxes.permute(1, 0, 2).gather(1, order.unsqueeze(2).expand(
+        order.size(0), order.size(1), 4))
+    keep, _ = nms_cpu_batch(cls_boxes, nms_thresh, valid=sorted_scores > score_thresh)
+    kept = torch.nonzero(keep >= 0)
+    if kept.numel() == 0:
+        return scores.new(0, 5), keep.new(0)
+    labels = kept[:, 0]
+    idx = keep[labels, kept[:, 1]]
+    dets = torch.cat((cls_boxes[labels, idx], sorted_scores[labels, idx].unsqueeze(1)), 1)
+    return dets, labels
+
+def _multiclass_nms_offset(scores, boxes, score_thresh, nms_thresh):
+    # shift the boxes of every class to their own cell of a grid, so that
+    # boxes of different classes never overlap, and suppress them all at once
+    cand = torch.nonzero(scores > score_thresh)
+    if cand.numel() == 0:
+        return scores.new(0, 5), cand.new(0)
+    rows, labels = cand[:, 0], cand[:, 1]
+    cand_scores = scores[rows, labels]
+    cand_boxes = boxes[rows, labels]
+    cand_scores, order = cand_scores.sort(0, True)
+    cand_boxes, labels = cand_boxes[order], labels[order]
+
+    # a grid rather than a line of cells keeps coordinates small for float32
+    cells = int(np.ceil(np.sqrt(scores.size(1))))
+    span = cand_boxes.max() - cand_boxes.min() + 2
+    shift = torch.stack((labels % cells, labels // cells), 1).repeat(1, 2).type_as(cand_boxes) * span
+    keep = nms_gpu(torch.cat((cand_boxes + shift, cand_scores.unsqueeze(1)), 1), nms_thresh)
+    keep = keep.long().view(-1)
+    return torch.cat((cand_boxes[keep], cand_scores[keep].unsqueeze(1)), 1), labels[keep]
@@ -1,6 +1,10 @@
 import torch
 from torch.autograd import Function
-from .._ext import roi_align
+try:
+    from .._ext import roi_align
+except ImportError:
+    # extension not built: only the CPU implementation is available
+    roi_align = None
 
 
 # TODO use save_for_backward instead
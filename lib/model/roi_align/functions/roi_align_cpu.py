@@ -0,0 +1,61 @@
+import torch
+
+
+def roi_align_cpu(features, rois, aligned_height, aligned_width, spatial_scale, max_elems=1 << 22):
+    """Pure-torch RoIAlign, same sampling as ROIAlignForward in roi_align_kernel.cu.
+
+    features: (B, C, H, W), rois: (R, 5) (batch_ind, x1, y1, x2, y2).
+    Returns (R, C, aligned_height, aligned_width). Differentiable through
+    autograd; rois are processed in chunks of at most max_elems outputs.
+    """
+    batch_size, num_channels, height, width = features.size()
+    num_rois = rois.size(0)
+    if num_rois == 0:
+        return features.new(0, num_channels, aligned_height, aligned_width).zero_()
+
+    # feature rows indexed by (b * height + h) * width + w
+    rows = features.permute(0, 2, 3, 1).contiguous().view(-1, num_channels)
+    rois = rois.detach()
+    ph = torch.arange(0, aligned_height).type_as(rois).view(1, -1)
+    pw = torch.arange(0, aligned_width).type_as(rois).view(1, -1)
+
+    chunk = max(1, max_elems // (num_channels * aligned_height * aligned_width))
+    outputs = []
+    for start in range(0, num_rois, chunk):
+        roi = rois[start:start + chunk]
+        batch_ind = roi[:, 0].long().view(-1, 1, 1)
+        roi_start_w = roi[:, 1:2] * spatial_scale
+        roi_start_h = roi[:, 2:3] * spatial_scale
+        roi_end_w = roi[:, 3:4] * spatial_scale
+        roi_end_h = roi[:, 4:5] * spatial_scale
+
+        # Force malformed ROIs to be 1x1
+        roi_width = (roi_end_w - roi_start_w + 1).clamp(min=0)
+        roi_height = (roi_end_h - roi_start_h + 1).clamp(min=0)
+        bin_size_h = roi_height / (aligned_height - 1.)
+        bin_size_w = roi_width / (aligned_width - 1.)
+
+        h = ph * bin_size_h + roi_start_h
+        w = pw * bin_size_w + roi_start_w
+        hstart = h.floor().clamp(max=height - 2)
+        wstart = w.floor().clamp(max=width - 2)
+        h_ratio = (h - hstart).view(-1, aligned_height, 1, 1)
+        w_ratio = (w - wstart).view(-1, 1, aligned_width, 1)
+        inside = ((h >= 0) & (h < height)).view(-1, aligned_height, 1) & \
+                 ((w >= 0) & (w < width)).view(-1, 1, aligned_width)
+
+        upleft = (batch_ind * height + hstart.long().clamp(min=0).view(-1, aligned_height, 1)) * width + \
+                 wstart.long().clamp(min=0).view(-1, 1, aligned_width)
+        upleft = upleft.view(-1)
+
+        def corner(offset):
+            return rows.index_select(0, upleft + offset).view(
+                -1, aligned_height, aligned_width, num_channels)
+
+        top = corner(0) * (1 - h_ratio) * (1 - w_ratio) \
+            + corner(1) * (1 - h_ratio) * w_ratio \
+            + corner(width) * h_ratio * (1 - w_ratio) \
+            + corner(width + 1) * h_ratio * w_ratio
+        top = top * inside.unsqueeze(3).type_as(top)
+        outputs.append(top.permute(0, 3, 1, 2))
+    return torch.cat(outputs, 0).contiguous()
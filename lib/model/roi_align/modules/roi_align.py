@@ -1,6 +1,14 @@
 from torch.nn.modules.module import Module
 from torch.nn.functional import avg_pool2d, max_pool2d
 from ..functions.roi_align import RoIAlignFunction
+from ..functions.roi_align_cpu import roi_align_cpu
+
+
+def _roi_align(features, rois, aligned_height, aligned_width, spatial_scale):
+    # the CUDA extension on GPU tensors, the pure-torch version on CPU
+    if features.is_cuda:
+        return RoIAlignFunction(aligned_height, aligned_width, spatial_scale)(features, rois)
+    return roi_align_cpu(features, rois, aligned_height, aligned_width, spatial_scale)
 
 
 class RoIAlign(Module):
@@ -12,8 +20,8 @@ class RoIAlign(Module):
         self.spatial_scale = float(spatial_scale)
 
     def forward(self, features, rois):
-        return RoIAlignFunction(self.aligned_height, self.aligned_width,
-                                self.spatial_scale)(features, rois)
+        return _roi_align(features, rois, self.aligned_height, self.aligned_width,
+                          self.spatial_scale)
 
 class RoIAlignAvg(Module):
     def __init__(self, aligned_height, aligned_width, spatial_scale):
@@ -24,8 +32,8 @@ class RoIAlignAvg(Module):
         self.spatial_scale = float(spatial_scale)
 
     def forward(self, features, rois):
-        x =  RoIAlignFunction(self.aligned_height+1, self.aligned_width+1,
-                                self.spatial_scale)(features, rois)
+        x =  _roi_align(features, rois, self.aligned_height+1, self.aligned_width+1,
+                        self.spatial_scale)
         return avg_pool2d(x, kernel_size=2, stride=1)
 
 class RoIAlignMax(Module):
@@ -37,6 +45,6 @@ class RoIAlignMax(Module):
         self.spatial_scale = float(spatial_scale)
 
     def forward(self, features, rois):
-        x =  RoIAlignFunction(self.aligned_height+1, self.aligned_width+1,
-                                self.spatial_scale)(features, rois)
+        x =  _roi_align(features, rois, self.aligned_height+1, self.aligned_width+1,
+                        self.spatial_scale)
         return max_pool2d(x, kernel_size=2, stride=1)
@@ -1,7 +1,11 @@
 # functions/add.py
 import torch
 from torch.autograd import Function
-from .._ext import roi_crop
+try:
+    from .._ext import roi_crop
+except ImportError:
+    # extension not built: only the CPU implementation is available
+    roi_crop = None
 import pdb
 
 class RoICropFunction(Function):
@@ -0,0 +1,43 @@
+import torch
+
+
+def roi_crop_cpu(input1, input2):
+    """Pure-torch bilinear sampler, same as bilinearSamplingFromGrid in roi_crop_cuda_kernel.cu.
+
+    input1: (B, C, H, W) features, input2: (N, gh, gw, 2) grid of (y, x) in
+    [-1, 1], with N a multiple of B and the grids of image b at
+    [b * N / B, (b + 1) * N / B). Neighbours outside the image count as 0.
+    Returns (N, C, gh, gw).
+    """
+    batch_size, num_channels, height, width = input1.size()
+    num_grids, grid_height, grid_width = input2.size(0), input2.size(1), input2.size(2)
+    if num_grids == 0:
+        return input1.new(0, num_channels, grid_height, grid_width).zero_()
+    roi_per_image = num_grids // batch_size
+
+    rows = input1.permute(0, 2, 3, 1).contiguous().view(-1, num_channels)
+    grid = input2.detach()
+    batch_ind = (torch.arange(0, num_grids).long() // roi_per_image).view(-1, 1, 1)
+
+    ycoord = (grid[:, :, :, 0] + 1) * (height - 1) / 2
+    xcoord = (grid[:, :, :, 1] + 1) * (width - 1) / 2
+    y_top_left = ycoord.floor()
+    x_top_left = xcoord.floor()
+    y_weight = (1 - (ycoord - y_top_left)).unsqueeze(3)
+    x_weight = (1 - (xcoord - x_top_left)).unsqueeze(3)
+    y_top_left = y_top_left.long()
+    x_top_left = x_top_left.long()
+
+    def corner(dy, dx):
+        y = y_top_left + dy
+        x = x_top_left + dx
+        inside = (y >= 0) & (y <= height - 1) & (x >= 0) & (x <= width - 1)
+        index = (batch_ind * height + y.clamp(0, height - 1)) * width + x.clamp(0, width - 1)
+        value = rows.index_select(0, index.view(-1)).view(num_grids, grid_height, grid_width, num_channels)
+        return value * inside.unsqueeze(3).type_as(value)
+
+    output = x_weight * y_weight * corner(0, 0) \
+        + (1 - x_weight) * y_weight * corner(0, 1) \
+        + x_weight * (1 - y_weight) * corner(1, 0) \
+        + (1 - x_weight) * (1 - y_weight) * corner(1, 1)
+    return output.permute(0, 3, 1, 2).contiguous()
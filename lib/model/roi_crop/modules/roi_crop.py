@@ -1,8 +1,11 @@
 from torch.nn.modules.module import Module
 from ..functions.roi_crop import RoICropFunction
+from ..functions.roi_crop_cpu import roi_crop_cpu
 
 class _RoICrop(Module):
     def __init__(self, layout = 'BHWD'):
         super(_RoICrop, self).__init__()
     def forward(self, input1, input2):
+        if not input1.is_cuda:
+            return roi_crop_cpu(input1, input2)
         return RoICropFunction()(input1, input2)
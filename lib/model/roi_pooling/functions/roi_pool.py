@@ -1,6 +1,10 @@
 import torch
 from torch.autograd import Function
-from .._ext import roi_pooling
+try:
+    from .._ext import roi_pooling
+except ImportError:
+    # extension not built: only the CPU implementation is available
+    roi_pooling = None
 import pdb
 
 class RoIPoolFunction(Function):
@@ -0,0 +1,78 @@
+import torch
+
+
+def _round(x):
+    # C round(): halfway cases away from zero, unlike torch.round
+    t = x.trunc()
+    return t + ((x - t).abs() >= 0.5).type_as(x) * x.sign()
+
+
+def _bins(start, roi_size, pooled_size, size):
+    # [start, end) of every bin, clipped to [0, size), as in ROIPoolForward
+    bin_size = roi_size.float() / float(pooled_size)
+    p = torch.arange(0, pooled_size).type_as(bin_size).view(1, -1)
+    bstart = (p * bin_size).floor().long() + start
+    bend = ((p + 1) * bin_size).ceil().long() + start
+    return bstart.clamp(0, size), bend.clamp(0, size)
+
+
+def roi_pool_cpu(features, rois, pooled_height, pooled_width, spatial_scale, max_elems=1 << 24):
+    """Pure-torch RoIPool, same bins as ROIPoolForward in roi_pooling_kernel.cu.
+
+    features: (B, C, H, W), rois: (R, 5) (batch_ind, x1, y1, x2, y2).
+    Returns (R, C, pooled_height, pooled_width), 0 for empty bins. The max
+    over a bin is taken over its columns then over its rows, gathering only
+    the rows each roi spans; rois are processed in chunks of at most
+    max_elems gathered values.
+    """
+    batch_size, num_channels, height, width = features.size()
+    num_rois = rois.size(0)
+    if num_rois == 0:
+        return features.new(0, num_channels, pooled_height, pooled_width).zero_()
+
+    feat = features.permute(0, 2, 3, 1).contiguous()
+    rois = rois.detach()
+    batch_ind = rois[:, 0].long()
+    roi_start_w = _round(rois[:, 1:2] * spatial_scale).long()
+    roi_start_h = _round(rois[:, 2:3] * spatial_scale).long()
+    roi_end_w = _round(rois[:, 3:4] * spatial_scale).long()
+    roi_end_h = _round(rois[:, 4:5] * spatial_scale).long()
+
+    # Force malformed ROIs to be 1x1
+    roi_width = (roi_end_w - roi_start_w + 1).clamp(min=1)
+    roi_height = (roi_end_h - roi_start_h + 1).clamp(min=1)
+    hstart, hend = _bins(roi_start_h, roi_height, pooled_height, height)
+    wstart, wend = _bins(roi_start_w, roi_width, pooled_width, width)
+    max_h = max(int((hend - hstart).max()), 1)
+    max_w = max(int((wend - wstart).max()), 1)
+    span_h = max(int((hend[:, -1] - hstart[:, 0]).max()), 1)
+    empty = (hend <= hstart).view(-1, pooled_height, 1) | (wend <= wstart).view(-1, 1, pooled_width)
+
+    chunk = max(1, max_elems // (span_h * pooled_width * max_w * num_channels))
+    outputs = []
+    for start in range(0, num_rois, chunk):
+        end = min(start + chunk, num_rois)
+        n = end - start
+        roi_idx = torch.arange(0, n).type_as(hstart).view(n, 1)
+
+        # max over the columns of every bin, for all rows the roi spans: (n, span, PW, C).
+        # Indices past the end of a bin repeat its last one, which leaves the max unchanged
+        first_h = hstart[start:end, 0:1]
+        span = max(int((hend[start:end, -1:] - first_h).max()), 1)
+        h = (first_h + torch.arange(0, span).type_as(hstart).view(1, -1)).clamp(max=height - 1)
+        w = wstart[start:end].view(n, pooled_width, 1) + torch.arange(0, max_w).type_as(wstart).view(1, 1, -1)
+        w = torch.min(w, wend[start:end].view(n, pooled_width, 1) - 1).clamp(0, width - 1)
+        x = feat[batch_ind[start:end].view(n, 1, 1), h.view(n, span, 1), w.view(n, 1, -1)]
+        x = x.view(n, span, pooled_width, max_w, num_channels).max(3)[0]
+
+        # then over the rows of every bin: (n, PH, PW, C)
+        h = (hstart[start:end] - first_h).view(n, pooled_height, 1) + \
+            torch.arange(0, max_h).type_as(hstart).view(1, 1, -1)
+        h = torch.min(h, (hend[start:end] - first_h).view(n, pooled_height, 1) - 1).clamp(0, span - 1)
+        x = x[roi_idx, h.view(n, -1)]
+        x = x.view(n, pooled_height, max_h, pooled_width, num_channels).max(2)[0]
+
+        # Define an empty pooling region to be zero
+        x = x.masked_fill(empty[start:end].unsqueeze(3), 0)
+        outputs.append(x.permute(0, 3, 1, 2))
+    return torch.cat(outputs, 0).contiguous()
@@ -1,5 +1,6 @@
 from torch.nn.modules.module import Module
 from ..functions.roi_pool import RoIPoolFunction
+from ..functions.roi_pool_cpu import roi_pool_cpu
 
 
 class _RoIPooling(Module):
@@ -11,4 +12,6 @@ class _RoIPooling(Module):
         self.spatial_scale = float(spatial_scale)
 
     def forward(self, features, rois):
+        if not features.is_cuda:
+            return roi_pool_cpu(features, rois, self.pooled_height, self.pooled_width, self.spatial_scale)
         return RoIPoolFunction(self.pooled_height, self.pooled_width, self.spatial_scale)(features, rois)
@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict
+
+import torch
+import numpy as np
+
+
+class AnchorGridCache(object):
+    """
+    LRU cache of the shifted anchor grids of the RPN layers, keyed by
+    feature map size, stride, base anchors, device and dtype.
+
+    Images are batched by aspect ratio, so only a few feature map sizes
+    occur and the grid of each is built, and copied to the device, once.
+    The grids returned are shared: read them, do not modify them in place.
+    Thread safe, for the replicas of DataParallel.
+    """
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._grids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, anchors, feat_height, feat_width, feat_stride, like):
+        """
+        anchors: (A, 4) tensor of the base anchors
+        like: tensor whose device and type the grid takes
+
+        all_anchors: (K * A, 4) anchors of the K = feat_height * feat_width
+                     cells, the A anchors of each cell in a row
+        """
+        key = (feat_height, feat_width, feat_stride, tuple(anchors.view(-1).tolist()),
+               str(like.device), str(like.dtype))
+        with self._lock:
+            grid = self._grids.pop(key, None)
+            if grid is not None:
+                self.hits += 1
+                # most recently used last
+                self._grids[key] = grid
+                return grid
+            self.misses += 1
+
+        shift_x = np.arange(0, feat_width) * feat_stride
+        shift_y = np.arange(0, feat_height) * feat_stride
+        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
+        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
+                                  shift_x.ravel(), shift_y.ravel())).transpose())
+        shifts = shifts.contiguous().float()
+
+        A = anchors.size(0)
+        K = shifts.size(0)
+        grid = anchors.cpu().float().view(1, A, 4) + shifts.view(K, 1, 4)
+        grid = grid.view(K * A, 4).to(device=like.device, dtype=like.dtype)
+
+        with self._lock:
+            self._grids[key] = grid
+            while len(self._grids) > self.max_size:
+                self._grids.popitem(last=False)
+        return grid
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """hits, misses and number of grids cached"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._grids)}
+
+
+# shared by _ProposalLayer and _AnchorTargetLayer
+anchor_grids = AnchorGridCache()
@@ -16,6 +16,7 @@ import numpy.random as npr
 
 from model.utils.config import cfg
 from .generate_anchors import generate_anchors
+from .anchor_grid import anchor_grids
 from .bbox_transform import clip_boxes, bbox_overlaps_batch, bbox_transform_batch
 
 import pdb
@@ -64,19 +65,12 @@ class _AnchorTargetLayer(nn.Module):
         batch_size = gt_boxes.size(0)
 
         feat_height, feat_width = rpn_cls_score.size(2), rpn_cls_score.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(rpn_cls_score).float()
-
         A = self._num_anchors
-        K = shifts.size(0)
+        K = feat_height * feat_width
 
-        self._anchors = self._anchors.type_as(gt_boxes) # move to specific gpu.
-        all_anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
-        all_anchors = all_anchors.view(K * A, 4)
+        # shifted anchors of every cell, built once per feature map size
+        # and device, shared with _ProposalLayer
+        all_anchors = anchor_grids.get(self._anchors, feat_height, feat_width, self._feat_stride, gt_boxes)
 
         total_anchors = int(K * A)
 
@@ -34,73 +34,67 @@ def bbox_transform(ex_rois, gt_rois):
     return targets
 
 def bbox_transform_batch(ex_rois, gt_rois):
+    """
+    ex_rois: (N, 4) or (b, N, 4) tensor of float, shared by the batch if 2-D
+    gt_rois: (b, N, >=4) tensor of float
 
+    targets: (b, N, 4) tensor of (dx, dy, dw, dh) from ex_rois to gt_rois
+    """
     if ex_rois.dim() == 2:
-        ex_widths = ex_rois[:, 2] - ex_rois[:, 0] + 1.0
-        ex_heights = ex_rois[:, 3] - ex_rois[:, 1] + 1.0
-        ex_ctr_x = ex_rois[:, 0] + 0.5 * ex_widths
-        ex_ctr_y = ex_rois[:, 1] + 0.5 * ex_heights
-
-        gt_widths = gt_rois[:, :, 2] - gt_rois[:, :, 0] + 1.0
-        gt_heights = gt_rois[:, :, 3] - gt_rois[:, :, 1] + 1.0
-        gt_ctr_x = gt_rois[:, :, 0] + 0.5 * gt_widths
-        gt_ctr_y = gt_rois[:, :, 1] + 0.5 * gt_heights
-
-        targets_dx = (gt_ctr_x - ex_ctr_x.view(1,-1).expand_as(gt_ctr_x)) / ex_widths
-        targets_dy = (gt_ctr_y - ex_ctr_y.view(1,-1).expand_as(gt_ctr_y)) / ex_heights
-        targets_dw = torch.log(gt_widths / ex_widths.view(1,-1).expand_as(gt_widths))
-        targets_dh = torch.log(gt_heights / ex_heights.view(1,-1).expand_as(gt_heights))
-
-    elif ex_rois.dim() == 3:
-        ex_widths = ex_rois[:, :, 2] - ex_rois[:, :, 0] + 1.0
-        ex_heights = ex_rois[:,:, 3] - ex_rois[:,:, 1] + 1.0
-        ex_ctr_x = ex_rois[:, :, 0] + 0.5 * ex_widths
-        ex_ctr_y = ex_rois[:, :, 1] + 0.5 * ex_heights
-
-        gt_widths = gt_rois[:, :, 2] - gt_rois[:, :, 0] + 1.0
-        gt_heights = gt_rois[:, :, 3] - gt_rois[:, :, 1] + 1.0
-        gt_ctr_x = gt_rois[:, :, 0] + 0.5 * gt_widths
-        gt_ctr_y = gt_rois[:, :, 1] + 0.5 * gt_heights
-
-        targets_dx = (gt_ctr_x - ex_ctr_x) / ex_widths
-        targets_dy = (gt_ctr_y - ex_ctr_y) / ex_heights
-        targets_dw = torch.log(gt_widths / ex_widths)
-        targets_dh = torch.log(gt_heights / ex_heights)
-    else:
+        ex_rois = ex_rois.unsqueeze(0)
+    elif ex_rois.dim() != 3:
         raise ValueError('ex_roi input dimension is not correct.')
 
-    targets = torch.stack(
-        (targets_dx, targets_dy, targets_dw, targets_dh),2)
+    ex_widths = ex_rois[:, :, 2] - ex_rois[:, :, 0] + 1.0
+    ex_heights = ex_rois[:, :, 3] - ex_rois[:, :, 1] + 1.0
+    ex_ctr_x = ex_rois[:, :, 0] + 0.5 * ex_widths
+    ex_ctr_y = ex_rois[:, :, 1] + 0.5 * ex_heights
+
+    gt_widths = gt_rois[:, :, 2] - gt_rois[:, :, 0] + 1.0
+    gt_heights = gt_rois[:, :, 3] - gt_rois[:, :, 1] + 1.0
+    gt_ctr_x = gt_rois[:, :, 0] + 0.5 * gt_widths
+    gt_ctr_y = gt_rois[:, :, 1] + 0.5 * gt_heights
+
+    # written in place into the columns of the result, the batch of
+    # ex_rois broadcast if shared
+    targets = gt_rois.new(gt_rois.size(0), gt_rois.size(1), 4)
+    torch.div(gt_ctr_x.sub_(ex_ctr_x), ex_widths, out=targets[:, :, 0])
+    torch.div(gt_ctr_y.sub_(ex_ctr_y), ex_heights, out=targets[:, :, 1])
+    torch.log(gt_widths.div_(ex_widths), out=targets[:, :, 2])
+    torch.log(gt_heights.div_(ex_heights), out=targets[:, :, 3])
 
     return targets
 
-def bbox_transform_inv(boxes, deltas, batch_size):
-    widths = boxes[:, :, 2] - boxes[:, :, 0] + 1.0
-    heights = boxes[:, :, 3] - boxes[:, :, 1] + 1.0
-    ctr_x = boxes[:, :, 0] + 0.5 * widths
-    ctr_y = boxes[:, :, 1] + 0.5 * heights
-
-    dx = deltas[:, :, 0::4]
-    dy = deltas[:, :, 1::4]
-    dw = deltas[:, :, 2::4]
-    dh = deltas[:, :, 3::4]
-
-    pred_ctr_x = dx * widths.unsqueeze(2) + ctr_x.unsqueeze(2)
-    pred_ctr_y = dy * heights.unsqueeze(2) + ctr_y.unsqueeze(2)
-    pred_w = torch.exp(dw) * widths.unsqueeze(2)
-    pred_h = torch.exp(dh) * heights.unsqueeze(2)
-
-    pred_boxes = deltas.clone()
-    # x1
-    pred_boxes[:, :, 0::4] = pred_ctr_x - 0.5 * pred_w
-    # y1
-    pred_boxes[:, :, 1::4] = pred_ctr_y - 0.5 * pred_h
-    # x2
-    pred_boxes[:, :, 2::4] = pred_ctr_x + 0.5 * pred_w
-    # y2
-    pred_boxes[:, :, 3::4] = pred_ctr_y + 0.5 * pred_h
-
-    return pred_boxes
+def bbox_transform_inv(boxes, deltas, batch_size, out=None):
+    """
+    boxes: (b, N, 4) tensor of float
+    deltas: (b, N, 4 * k) tensor of float, k (dx, dy, dw, dh) per box
+    out: (b, N, 4 * k) tensor to write the result to, deltas itself included,
+         a new one if None
+
+    pred_boxes: (b, N, 4 * k) tensor of the k boxes predicted from each box
+    """
+    d = deltas.contiguous().view(deltas.size(0), deltas.size(1), -1, 4)
+    widths = (boxes[:, :, 2] - boxes[:, :, 0] + 1.0).unsqueeze(2)
+    heights = (boxes[:, :, 3] - boxes[:, :, 1] + 1.0).unsqueeze(2)
+    ctr_x = boxes[:, :, 0].unsqueeze(2) + 0.5 * widths
+    ctr_y = boxes[:, :, 1].unsqueeze(2) + 0.5 * heights
+
+    pred_ctr_x = (d[:, :, :, 0] * widths).add_(ctr_x)
+    pred_ctr_y = (d[:, :, :, 1] * heights).add_(ctr_y)
+    half_w = torch.exp(d[:, :, :, 2]).mul_(widths).mul_(0.5)
+    half_h = torch.exp(d[:, :, :, 3]).mul_(heights).mul_(0.5)
+
+    if out is None:
+        out = deltas.new(deltas.size())
+    pred_boxes = out.view(d.size())
+    # x1, y1, x2, y2
+    torch.sub(pred_ctr_x, half_w, out=pred_boxes[:, :, :, 0])
+    torch.sub(pred_ctr_y, half_h, out=pred_boxes[:, :, :, 1])
+    torch.add(pred_ctr_x, half_w, out=pred_boxes[:, :, :, 2])
+    torch.add(pred_ctr_y, half_h, out=pred_boxes[:, :, :, 3])
+
+    return out
 
 def clip_boxes_batch(boxes, im_shape, batch_size):
     """
@@ -123,12 +117,16 @@ def clip_boxes_batch(boxes, im_shape, batch_size):
     return boxes
 
 def clip_boxes(boxes, im_shape, batch_size):
-
-    for i in range(batch_size):
-        boxes[i,:,0::4].clamp_(0, im_shape[i, 1]-1)
-        boxes[i,:,1::4].clamp_(0, im_shape[i, 0]-1)
-        boxes[i,:,2::4].clamp_(0, im_shape[i, 1]-1)
-        boxes[i,:,3::4].clamp_(0, im_shape[i, 0]-1)
+    """
+    Clip boxes (b, N, 4 * k) to the image boundaries of im_shape (b, >=2
+    as height, width), in place, all the images at once.
+    """
+    coords = boxes.view(boxes.size(0), -1, 4)
+    # x2 and y2 bounds of every image, broadcast over its boxes
+    bounds = im_shape[:, :2].type_as(boxes) - 1
+    bounds = bounds[:, [1, 0, 1, 0]].view(-1, 1, 4)
+    coords.clamp_(min=0)
+    torch.min(coords, bounds, out=coords)
 
     return boxes
 
@@ -167,91 +165,55 @@ def bbox_overlaps(anchors, gt_boxes):
 
 def bbox_overlaps_batch(anchors, gt_boxes):
     """
-    anchors: (N, 4) ndarray of float
-    gt_boxes: (b, K, 5) ndarray of float
+    anchors: (N, 4) tensor of float, shared by the batch, or (b, N, 4)
+             or (b, N, 5) with the batch index first
+    gt_boxes: (b, K, 5) tensor of float
 
-    overlaps: (N, K) ndarray of overlap between boxes and query_boxes
+    overlaps: (b, N, K) tensor of overlap between boxes and query_boxes,
+              0 with empty gt boxes and -1 for empty anchors
     """
     batch_size = gt_boxes.size(0)
 
-
     if anchors.dim() == 2:
-
-        N = anchors.size(0)
-        K = gt_boxes.size(1)
-
-        anchors = anchors.view(1, N, 4).expand(batch_size, N, 4).contiguous()
-        gt_boxes = gt_boxes[:,:,:4].contiguous()
-
-
-        gt_boxes_x = (gt_boxes[:,:,2] - gt_boxes[:,:,0] + 1)
-        gt_boxes_y = (gt_boxes[:,:,3] - gt_boxes[:,:,1] + 1)
-        gt_boxes_area = (gt_boxes_x * gt_boxes_y).view(batch_size, 1, K)
-
-        anchors_boxes_x = (anchors[:,:,2] - anchors[:,:,0] + 1)
-        anchors_boxes_y = (anchors[:,:,3] - anchors[:,:,1] + 1)
-        anchors_area = (anchors_boxes_x * anchors_boxes_y).view(batch_size, N, 1)
-
-        gt_area_zero = (gt_boxes_x == 1) & (gt_boxes_y == 1)
-        anchors_area_zero = (anchors_boxes_x == 1) & (anchors_boxes_y == 1)
-
-        boxes = anchors.view(batch_size, N, 1, 4).expand(batch_size, N, K, 4)
-        query_boxes = gt_boxes.view(batch_size, 1, K, 4).expand(batch_size, N, K, 4)
-
-        iw = (torch.min(boxes[:,:,:,2], query_boxes[:,:,:,2]) -
-            torch.max(boxes[:,:,:,0], query_boxes[:,:,:,0]) + 1)
-        iw[iw < 0] = 0
-
-        ih = (torch.min(boxes[:,:,:,3], query_boxes[:,:,:,3]) -
-            torch.max(boxes[:,:,:,1], query_boxes[:,:,:,1]) + 1)
-        ih[ih < 0] = 0
-        ua = anchors_area + gt_boxes_area - (iw * ih)
-        overlaps = iw * ih / ua
-
-        # mask the overlap here.
-        overlaps.masked_fill_(gt_area_zero.view(batch_size, 1, K).expand(batch_size, N, K), 0)
-        overlaps.masked_fill_(anchors_area_zero.view(batch_size, N, 1).expand(batch_size, N, K), -1)
-
+        # broadcast over the batch, not copied
+        anchors = anchors.unsqueeze(0)
     elif anchors.dim() == 3:
-        N = anchors.size(1)
-        K = gt_boxes.size(1)
-
-        if anchors.size(2) == 4:
-            anchors = anchors[:,:,:4].contiguous()
-        else:
-            anchors = anchors[:,:,1:5].contiguous()
-
-        gt_boxes = gt_boxes[:,:,:4].contiguous()
+        if anchors.size(2) != 4:
+            anchors = anchors[:, :, 1:5]
+    else:
+        raise ValueError('anchors input dimension is not correct.')
 
-        gt_boxes_x = (gt_boxes[:,:,2] - gt_boxes[:,:,0] + 1)
-        gt_boxes_y = (gt_boxes[:,:,3] - gt_boxes[:,:,1] + 1)
-        gt_boxes_area = (gt_boxes_x * gt_boxes_y).view(batch_size, 1, K)
+    N = anchors.size(1)
+    K = gt_boxes.size(1)
 
-        anchors_boxes_x = (anchors[:,:,2] - anchors[:,:,0] + 1)
-        anchors_boxes_y = (anchors[:,:,3] - anchors[:,:,1] + 1)
-        anchors_area = (anchors_boxes_x * anchors_boxes_y).view(batch_size, N, 1)
+    gt_boxes_x = (gt_boxes[:,:,2] - gt_boxes[:,:,0] + 1)
+    gt_boxes_y = (gt_boxes[:,:,3] - gt_boxes[:,:,1] + 1)
+    gt_boxes_area = (gt_boxes_x * gt_boxes_y).unsqueeze(1)
 
-        gt_area_zero = (gt_boxes_x == 1) & (gt_boxes_y == 1)
-        anchors_area_zero = (anchors_boxes_x == 1) & (anchors_boxes_y == 1)
+    anchors_boxes_x = (anchors[:,:,2] - anchors[:,:,0] + 1)
+    anchors_boxes_y = (anchors[:,:,3] - anchors[:,:,1] + 1)
+    anchors_area = (anchors_boxes_x * anchors_boxes_y).unsqueeze(2)
 
-        boxes = anchors.view(batch_size, N, 1, 4).expand(batch_size, N, K, 4)
-        query_boxes = gt_boxes.view(batch_size, 1, K, 4).expand(batch_size, N, K, 4)
+    gt_area_zero = (gt_boxes_x == 1) & (gt_boxes_y == 1)
+    anchors_area_zero = (anchors_boxes_x == 1) & (anchors_boxes_y == 1)
 
-        iw = (torch.min(boxes[:,:,:,2], query_boxes[:,:,:,2]) -
-            torch.max(boxes[:,:,:,0], query_boxes[:,:,:,0]) + 1)
-        iw[iw < 0] = 0
+    # (b, N, K) intersections, computed in place with a single temporary
+    boxes = anchors[:,:,:4].unsqueeze(2)
+    query_boxes = gt_boxes[:,:,:4].unsqueeze(1)
+    iw = torch.min(boxes[:,:,:,2], query_boxes[:,:,:,2])
+    tmp = torch.max(boxes[:,:,:,0], query_boxes[:,:,:,0])
+    iw.sub_(tmp).add_(1).clamp_(min=0)
 
-        ih = (torch.min(boxes[:,:,:,3], query_boxes[:,:,:,3]) -
-            torch.max(boxes[:,:,:,1], query_boxes[:,:,:,1]) + 1)
-        ih[ih < 0] = 0
-        ua = anchors_area + gt_boxes_area - (iw * ih)
+    ih = torch.min(boxes[:,:,:,3], query_boxes[:,:,:,3])
+    torch.max(boxes[:,:,:,1], query_boxes[:,:,:,1], out=tmp)
+    ih.sub_(tmp).add_(1).clamp_(min=0)
 
-        overlaps = iw * ih / ua
+    inter = iw.mul_(ih)
+    torch.add(anchors_area, gt_boxes_area, out=tmp)
+    overlaps = inter.div_(tmp.sub_(inter))
 
-        # mask the overlap here.
-        overlaps.masked_fill_(gt_area_zero.view(batch_size, 1, K).expand(batch_size, N, K), 0)
-        overlaps.masked_fill_(anchors_area_zero.view(batch_size, N, 1).expand(batch_size, N, K), -1)
-    else:
-        raise ValueError('anchors input dimension is not correct.')
+    # mask the overlap here.
+    overlaps.masked_fill_(gt_area_zero.view(batch_size, 1, K).expand(batch_size, N, K), 0)
+    overlaps.masked_fill_(anchors_area_zero.view(-1, N, 1).expand(batch_size, N, K), -1)
 
     return overlaps
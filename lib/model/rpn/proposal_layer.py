@@ -16,8 +16,9 @@ import math
 import yaml
 from model.utils.config import cfg
 from .generate_anchors import generate_anchors
+from .anchor_grid import anchor_grids
 from .bbox_transform import bbox_transform_inv, clip_boxes, clip_boxes_batch
-from model.nms.nms_wrapper import nms
+from model.nms.nms_wrapper import nms, batched_nms
 
 import pdb
 
@@ -77,19 +78,11 @@ class _ProposalLayer(nn.Module):
         batch_size = bbox_deltas.size(0)
 
         feat_height, feat_width = scores.size(2), scores.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(scores).float()
-
         A = self._num_anchors
-        K = shifts.size(0)
+        K = feat_height * feat_width
 
-        self._anchors = self._anchors.type_as(scores)
-        # anchors = self._anchors.view(1, A, 4) + shifts.view(1, K, 4).permute(1, 0, 2).contiguous()
-        anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
+        # shifted anchors of every cell, built once per feature map size
+        anchors = anchor_grids.get(self._anchors, feat_height, feat_width, self._feat_stride, scores)
         anchors = anchors.view(1, K * A, 4).expand(batch_size, K * A, 4)
 
         # Transpose and reshape predicted bbox transformations to get them
@@ -124,39 +117,28 @@ class _ProposalLayer(nn.Module):
         proposals_keep = proposals
         _, order = torch.sort(scores_keep, 1, True)
 
+        # 3. remove predicted boxes with either height or width < threshold
+        # (NOTE: convert min_size to input image scale stored in im_info[2])
+
+        # 4. sort all (proposal, score) pairs by score from highest to lowest
+        # 5. take top pre_nms_topN (e.g. 6000)
+        if pre_nms_topN > 0 and pre_nms_topN < scores_keep.size(1):
+            order = order[:, :pre_nms_topN]
+        proposals_sorted = proposals_keep.gather(1, order.unsqueeze(2).expand(
+            batch_size, order.size(1), 4))
+
+        # 6. apply nms (e.g. threshold = 0.7) to all images at once
+        # 7. take after_nms_topN (e.g. 300)
+        # 8. return the top proposals (-> RoIs top)
+        keep_idx, _ = batched_nms(proposals_sorted, nms_thresh, max_keep=post_nms_topN)
+        num_keep = keep_idx.size(1)
+        proposals_kept = proposals_sorted.gather(1, keep_idx.clamp(min=0).unsqueeze(2).expand(
+            batch_size, num_keep, 4))
+
+        # padding 0 at the end.
         output = scores.new(batch_size, post_nms_topN, 5).zero_()
-        for i in range(batch_size):
-            # # 3. remove predicted boxes with either height or width < threshold
-            # # (NOTE: convert min_size to input image scale stored in im_info[2])
-            proposals_single = proposals_keep[i]
-            scores_single = scores_keep[i]
-
-            # # 4. sort all (proposal, score) pairs by score from highest to lowest
-            # # 5. take top pre_nms_topN (e.g. 6000)
-            order_single = order[i]
-
-            if pre_nms_topN > 0 and pre_nms_topN < scores_keep.numel():
-                order_single = order_single[:pre_nms_topN]
-
-            proposals_single = proposals_single[order_single, :]
-            scores_single = scores_single[order_single].view(-1,1)
-
-            # 6. apply nms (e.g. threshold = 0.7)
-            # 7. take after_nms_topN (e.g. 300)
-            # 8. return the top proposals (-> RoIs top)
-
-            keep_idx_i = nms(torch.cat((proposals_single, scores_single), 1), nms_thresh)
-            keep_idx_i = keep_idx_i.long().view(-1)
-
-            if post_nms_topN > 0:
-                keep_idx_i = keep_idx_i[:post_nms_topN]
-            proposals_single = proposals_single[keep_idx_i, :]
-            scores_single = scores_single[keep_idx_i, :]
-
-            # padding 0 at the end.
-            num_proposal = proposals_single.size(0)
-            output[i,:,0] = i
-            output[i,:num_proposal,1:] = proposals_single
+        output[:, :, 0] = torch.arange(0, batch_size).type_as(scores).view(-1, 1)
+        output[:, :num_keep, 1:] = proposals_kept * (keep_idx >= 0).type_as(scores).unsqueeze(2)
 
         return output
 
@@ -74,21 +74,12 @@ class _ProposalTargetLayer(nn.Module):
             bbox_target (ndarray): b x N x 4K blob of regression targets
             bbox_inside_weights (ndarray): b x N x 4K blob of loss weights
         """
-        batch_size = labels_batch.size(0)
-        rois_per_image = labels_batch.size(1)
-        clss = labels_batch
-        bbox_targets = bbox_target_data.new(batch_size, rois_per_image, 4).zero_()
-        bbox_inside_weights = bbox_target_data.new(bbox_targets.size()).zero_()
-
-        for b in range(batch_size):
-            # assert clss[b].sum() > 0
-            if clss[b].sum() == 0:
-                continue
-            inds = torch.nonzero(clss[b] > 0).view(-1)
-            for i in range(inds.numel()):
-                ind = inds[i]
-                bbox_targets[b, ind, :] = bbox_target_data[b, ind, :]
-                bbox_inside_weights[b, ind, :] = self.BBOX_INSIDE_WEIGHTS
+        # the rows of the fg rois (class > 0) of all the images at once
+        fg_mask = (labels_batch > 0).unsqueeze(2).expand_as(bbox_target_data)
+        zeros = bbox_target_data.new(bbox_target_data.size()).zero_()
+        bbox_targets = torch.where(fg_mask, bbox_target_data, zeros)
+        bbox_inside_weights = torch.where(
+            fg_mask, self.BBOX_INSIDE_WEIGHTS.view(1, 1, 4).expand_as(bbox_target_data), zeros)
 
         return bbox_targets, bbox_inside_weights
 
@@ -116,6 +107,11 @@ class _ProposalTargetLayer(nn.Module):
     def _sample_rois_pytorch(self, all_rois, gt_boxes, fg_rois_per_image, rois_per_image, num_classes):
         """Generate a random sample of RoIs comprising foreground and background
         examples.
+
+        All the images are sampled at once on the device of the rois: the fg
+        rois without replacement, up to fg_rois_per_image, then the bg rois
+        with replacement; the rois of an image with fg or bg rois only are
+        all drawn with replacement from those.
         """
         # overlaps: (rois x gt_boxes)
 
@@ -125,84 +121,50 @@ class _ProposalTargetLayer(nn.Module):
 
         batch_size = overlaps.size(0)
         num_proposal = overlaps.size(1)
-        num_boxes_per_img = overlaps.size(2)
 
-        offset = torch.arange(0, batch_size)*gt_boxes.size(1)
-        offset = offset.view(-1, 1).type_as(gt_assignment) + gt_assignment
+        labels = gt_boxes[:,:,4].gather(1, gt_assignment)
+
+        fg_mask = max_overlaps >= cfg.TRAIN.FG_THRESH
+        # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
+        bg_mask = (max_overlaps < cfg.TRAIN.BG_THRESH_HI) & (max_overlaps >= cfg.TRAIN.BG_THRESH_LO)
+        fg_num_rois = fg_mask.long().sum(1, keepdim=True)
+        bg_num_rois = bg_mask.long().sum(1, keepdim=True)
+        if ((fg_num_rois == 0) & (bg_num_rois == 0)).any():
+            raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
 
-        labels = gt_boxes[:,:,4].contiguous().view(-1).index(offset.view(-1))\
-                                                            .view(batch_size, -1)
+        # the fg (bg) rois of every image first, in random order: the
+        # first k columns are a sample of k of them without replacement
+        fg_order = torch.sort(max_overlaps.new(max_overlaps.size()).uniform_()
+                              + 2 * fg_mask.eq(0).type_as(max_overlaps), 1)[1]
+        bg_order = torch.sort(max_overlaps.new(max_overlaps.size()).uniform_()
+                              + 2 * bg_mask.eq(0).type_as(max_overlaps), 1)[1]
 
-        labels_batch = labels.new(batch_size, rois_per_image).zero_()
-        rois_batch  = all_rois.new(batch_size, rois_per_image, 5).zero_()
-        gt_rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
         # Guard against the case when an image has fewer than max_fg_rois_per_image
-        # foreground RoIs
-        for i in range(batch_size):
-
-            fg_inds = torch.nonzero(max_overlaps[i] >= cfg.TRAIN.FG_THRESH).view(-1)
-            fg_num_rois = fg_inds.numel()
-
-            # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
-            bg_inds = torch.nonzero((max_overlaps[i] < cfg.TRAIN.BG_THRESH_HI) &
-                                    (max_overlaps[i] >= cfg.TRAIN.BG_THRESH_LO)).view(-1)
-            bg_num_rois = bg_inds.numel()
-
-            if fg_num_rois > 0 and bg_num_rois > 0:
-                # sampling fg
-                fg_rois_per_this_image = min(fg_rois_per_image, fg_num_rois)
-                
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault. 
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                #rand_num = torch.randperm(fg_num_rois).long().cuda()
-                rand_num = torch.from_numpy(np.random.permutation(fg_num_rois)).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num[:fg_rois_per_this_image]]
-
-                # sampling bg
-                bg_rois_per_this_image = rois_per_image - fg_rois_per_this_image
-
-                # Seems torch.rand has a bug, it will generate very large number and make an error. 
-                # We use numpy rand instead. 
-                #rand_num = (torch.rand(bg_rois_per_this_image) * bg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(bg_rois_per_this_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                bg_inds = bg_inds[rand_num]
-
-            elif fg_num_rois > 0 and bg_num_rois == 0:
-                # sampling fg
-                #rand_num = torch.floor(torch.rand(rois_per_image) * fg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(rois_per_image) * fg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num]
-                fg_rois_per_this_image = rois_per_image
-                bg_rois_per_this_image = 0
-            elif bg_num_rois > 0 and fg_num_rois == 0:
-                # sampling bg
-                #rand_num = torch.floor(torch.rand(rois_per_image) * bg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(rois_per_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-
-                bg_inds = bg_inds[rand_num]
-                bg_rois_per_this_image = rois_per_image
-                fg_rois_per_this_image = 0
-            else:
-                raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
-                
-            # The indices that we're selecting (both fg and bg)
-            keep_inds = torch.cat([fg_inds, bg_inds], 0)
-
-            # Select sampled values from various arrays:
-            labels_batch[i].copy_(labels[i][keep_inds])
-
-            # Clamp labels for the background RoIs to 0
-            if fg_rois_per_this_image < rois_per_image:
-                labels_batch[i][fg_rois_per_this_image:] = 0
-
-            rois_batch[i] = all_rois[i][keep_inds]
-            rois_batch[i,:,0] = i
-
-            gt_rois_batch[i] = gt_boxes[i][gt_assignment[i][keep_inds]]
+        # foreground RoIs, and against images without fg or bg rois
+        fg_rois_per_this_image = torch.where(bg_num_rois > 0, fg_num_rois.clamp(max=fg_rois_per_image),
+                                             fg_num_rois.clamp(max=1) * rois_per_image)
+        slots = torch.arange(0, rois_per_image).type_as(fg_num_rois).view(1, -1)
+        rand_fg = (max_overlaps.new(batch_size, rois_per_image).uniform_()
+                   * fg_num_rois.type_as(max_overlaps)).long()
+        rand_bg = (max_overlaps.new(batch_size, rois_per_image).uniform_()
+                   * bg_num_rois.type_as(max_overlaps)).long()
+        fg_pos = torch.where(bg_num_rois > 0, slots.expand_as(rand_fg), rand_fg)
+        is_fg = slots < fg_rois_per_this_image
+
+        # The indices that we're selecting (both fg and bg)
+        keep_inds = torch.where(is_fg,
+                                fg_order.gather(1, fg_pos.clamp(max=num_proposal - 1)),
+                                bg_order.gather(1, rand_bg.clamp(max=num_proposal - 1)))
+
+        # Select sampled values from various arrays, and clamp labels for
+        # the background RoIs to 0
+        labels_batch = labels.gather(1, keep_inds) * is_fg.type_as(labels)
+
+        rois_batch = all_rois.gather(1, keep_inds.unsqueeze(2).expand(batch_size, rois_per_image, 5))
+        rois_batch[:,:,0] = torch.arange(0, batch_size).type_as(all_rois).view(-1, 1)
+
+        gt_rois_batch = gt_boxes.gather(1, gt_assignment.gather(1, keep_inds).unsqueeze(2)
+                                        .expand(batch_size, rois_per_image, gt_boxes.size(2)))
 
         bbox_target_data = self._compute_targets_pytorch(
                 rois_batch[:,:,1:5], gt_rois_batch[:,:,:4])
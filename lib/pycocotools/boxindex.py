@@ -0,0 +1,200 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import mmap
+import numpy as np
+
+# BoxIndex is a columnar index of COCO annotations or results: ids, image
+# ids, category ids, [x y w h] boxes, scores, areas and crowd flags in
+# contiguous NumPy arrays, the rows sorted by (image id, category id) and
+# kept in their original order within a pair. The rows of an image are
+# imgOffsets[i]:imgOffsets[i+1] for the image imgKeys[i].
+#
+# Unlike a dict of annotation dicts, the arrays hold no Python object per
+# box, so forked processes (DataLoader workers, process pools) reading
+# them do not write to, and copy, the pages they live in; shareMemory()
+# moves them to a single shared anonymous mapping.
+#
+# Usage:
+#  index = BoxIndex.fromAnns(json.load(open(resFile)))
+#  rows = index.rows(imgId, catIds)
+#  index.bboxes[rows], index.scores[rows]
+#  cocoDt = cocoGt.loadRes(index)
+
+
+class BoxIndex(object):
+    FIELDS = [('ids', np.int64, ()), ('imgIds', np.int64, ()), ('catIds', np.int64, ()),
+              ('bboxes', np.float64, (4,)), ('scores', np.float64, ()),
+              ('areas', np.float64, ()), ('iscrowd', np.uint8, ()), ('order', np.int64, ())]
+
+    def __init__(self, arrays, hasScores=False):
+        '''
+        Initialize BoxIndex from its columns
+        :param arrays (dict): array of every name in FIELDS, rows sorted by (imgIds, catIds),
+                              and optionally imgKeys and imgOffsets as given by arrays()
+        :param hasScores (bool): whether the boxes are results with a score
+        :return: None
+        '''
+        for name, dtype, _ in self.FIELDS:
+            setattr(self, name, np.asarray(arrays[name], dtype=dtype))
+        self.hasScores = hasScores
+        if 'imgKeys' in arrays:
+            self.imgKeys = np.asarray(arrays['imgKeys'], dtype=np.int64)
+            self.imgOffsets = np.asarray(arrays['imgOffsets'], dtype=np.int64)
+        else:
+            self.imgKeys, starts = np.unique(self.imgIds, return_index=True)
+            self.imgKeys = self.imgKeys.astype(np.int64)
+            self.imgOffsets = np.append(starts, len(self.imgIds)).astype(np.int64)
+
+    @classmethod
+    def fromAnns(cls, anns):
+        '''
+        Build the index of a list of annotation or result dicts; results
+        without an id get the ids of loadRes (position in the list + 1)
+        :param anns (object array): annotation or result dicts with a bbox
+        :return: index (BoxIndex)
+        '''
+        n = len(anns)
+        bboxes = np.array([ann['bbox'] for ann in anns], dtype=np.float64).reshape(n, 4)
+        hasScores = n > 0 and 'score' in anns[0]
+        arrays = {
+            'ids':      [ann.get('id', i + 1) for i, ann in enumerate(anns)],
+            'imgIds':   [ann['image_id'] for ann in anns],
+            'catIds':   [ann['category_id'] for ann in anns],
+            'bboxes':   bboxes,
+            'scores':   [ann['score'] for ann in anns] if hasScores else np.zeros(n),
+            'areas':    [ann['area'] if 'area' in ann else ann['bbox'][2] * ann['bbox'][3] for ann in anns],
+            'iscrowd':  [ann.get('iscrowd', 0) for ann in anns],
+            'order':    np.arange(n),
+        }
+        arrays = dict((name, np.asarray(arrays[name], dtype=dtype).reshape((n,) + shape))
+                      for name, dtype, shape in cls.FIELDS)
+        # stable: boxes of an (image, category) pair keep their order
+        perm = np.lexsort((arrays['catIds'], arrays['imgIds']))
+        return cls(dict((name, array[perm]) for name, array in arrays.items()), hasScores)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def arrays(self):
+        '''
+        :return: arrays (dict): all the arrays of the index, to save or share them
+        '''
+        names = [name for name, _, _ in self.FIELDS] + ['imgKeys', 'imgOffsets']
+        return dict((name, getattr(self, name)) for name in names)
+
+    def imgRange(self, imgId):
+        '''
+        :return: start, end (int): rows of the image imgId
+        '''
+        i = np.searchsorted(self.imgKeys, imgId)
+        if i == len(self.imgKeys) or self.imgKeys[i] != imgId:
+            return 0, 0
+        return int(self.imgOffsets[i]), int(self.imgOffsets[i + 1])
+
+    def rows(self, imgId, catIds=None):
+        '''
+        Rows of the boxes of an image, in the order of catIds then in
+        their original order, as the boxes of (imgId, catId) for catId in catIds
+        :param imgId (int): image id
+        :param catIds (int array): category ids, all if None
+        :return: rows (int array)
+        '''
+        start, end = self.imgRange(imgId)
+        if catIds is None or start == end:
+            return np.arange(start, end)
+        catIds = np.asarray(catIds, dtype=np.int64).reshape(-1)
+        if len(catIds) == 0:
+            return np.arange(0)
+        sorter = np.argsort(catIds, kind='mergesort')
+        pos = np.searchsorted(catIds, self.catIds[start:end], sorter=sorter).clip(max=len(catIds) - 1)
+        rank = sorter[pos]
+        keep = np.nonzero(catIds[rank] == self.catIds[start:end])[0]
+        return start + keep[np.argsort(rank[keep], kind='mergesort')]
+
+    def count(self, imgId, catIds=None):
+        '''
+        :return: number of boxes of an image in the categories catIds
+        '''
+        if catIds is None:
+            start, end = self.imgRange(imgId)
+            return end - start
+        return len(self.rows(imgId, catIds))
+
+    def getAnnIds(self, imgIds=[], catIds=[], areaRng=[], iscrowd=None):
+        '''
+        Same as COCO.getAnnIds on the indexed annotations, in the same order
+        :return: ids (int array): integer array of ann ids
+        '''
+        if len(self) == 0:
+            return []
+        if len(imgIds) == 0:
+            rows = np.argsort(self.order)
+        else:
+            inds = np.searchsorted(self.imgKeys, imgIds).clip(max=len(self.imgKeys) - 1)
+            found = self.imgKeys[inds] == np.asarray(imgIds)
+            starts = np.where(found, self.imgOffsets[inds], 0)
+            lengths = np.where(found, self.imgOffsets[inds + 1] - starts, 0)
+            imgPos = np.repeat(np.arange(len(imgIds)), lengths)
+            rows = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[imgPos]
+            # images in the order of imgIds, their boxes in their original order
+            rows = rows[np.lexsort((self.order[rows], imgPos))]
+        keep = np.ones(len(rows), dtype=bool)
+        if len(imgIds) > 0 or len(catIds) > 0 or len(areaRng) > 0:
+            if len(catIds) > 0:
+                keep &= np.isin(self.catIds[rows], catIds)
+            if len(areaRng) > 0:
+                keep &= (self.areas[rows] > areaRng[0]) & (self.areas[rows] < areaRng[1])
+        if not iscrowd == None:
+            keep &= self.iscrowd[rows] == iscrowd
+        return self.ids[rows[keep]].tolist()
+
+    def toAnns(self, rows=None):
+        '''
+        Result dicts of loadRes (image_id, category_id, bbox and score if
+        any), in their original order
+        :param rows (int array): rows to convert, all if None
+        :return: anns (object array)
+        '''
+        rows = np.argsort(self.order) if rows is None else np.asarray(rows)
+        anns = []
+        for imgId, catId, bb, score in zip(self.imgIds[rows].tolist(), self.catIds[rows].tolist(),
+                                           self.bboxes[rows].tolist(), self.scores[rows].tolist()):
+            ann = {'image_id': imgId, 'category_id': catId, 'bbox': bb}
+            if self.hasScores:
+                ann['score'] = score
+            anns.append(ann)
+        return anns
+
+    def shareMemory(self):
+        '''
+        Move the arrays to one anonymous shared mapping, whose pages forked
+        processes share instead of copying them on write
+        :return: self
+        '''
+        if getattr(self, '_buffer', None) is not None:
+            # already in a shared mapping, or in a memory-mapped file
+            return self
+        arrays = sorted(self.arrays().items())
+        offsets, size = [], 0
+        for _, array in arrays:
+            size = (size + 63) // 64 * 64
+            offsets.append(size)
+            size += array.nbytes
+        self._buffer = mmap.mmap(-1, max(size, 1))
+        for (name, array), offset in zip(arrays, offsets):
+            shared = np.frombuffer(self._buffer, dtype=array.dtype, count=array.size, offset=offset)
+            shared = shared.reshape(array.shape)
+            shared[...] = array
+            setattr(self, name, shared)
+        return self
+
+    def __getstate__(self):
+        # pickled as plain arrays
+        state = self.__dict__.copy()
+        state.pop('_buffer', None)
+        for key, value in state.items():
+            if isinstance(value, np.ndarray):
+                state[key] = np.array(value)
+        return state
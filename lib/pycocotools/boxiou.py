@@ -0,0 +1,85 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+
+# Box IoU of mask.iou (bbIou of maskApi.c) without the compiled extension,
+# for all the pairs of a set of detections and a set of gts at once, or of
+# a batch of such sets:
+#  ious = iou(dt, gt, iscrowd)
+#  dt [... x N x 4], gt [... x G x 4] boxes [x y w h], iscrowd [... x G]
+#  ious [... x N x G]
+# The leading batch dimensions broadcast; sets of different sizes can be
+# padded with empty boxes, whose IoU is 0. For a crowd gt the union is the
+# area of the detection. The result always has this shape, N or G being 0
+# included, unlike the [] of mask.iou. NumPy arrays and lists give float64
+# arrays equal to mask.iou; torch tensors are computed with torch, in
+# their dtype and on their device.
+
+
+def _isTensor(x):
+    return type(x).__module__.startswith('torch')
+
+
+def iou(dt, gt, iscrowd=None):
+    '''
+    IoU of every detection with every gt, see above
+    :param dt (float [...xNx4]): detection boxes [x y w h]
+    :param gt (float [...xGx4]): gt boxes [x y w h]
+    :param iscrowd (bool [...xG]): crowd flag of every gt, none if None
+    :return: ious (float [...xNxG])
+    '''
+    if _isTensor(dt) or _isTensor(gt):
+        return _iouTorch(dt, gt, iscrowd)
+    dt = np.asarray(dt, dtype=np.float64)
+    gt = np.asarray(gt, dtype=np.float64)
+    dt = dt.reshape(_boxShape(dt))
+    gt = gt.reshape(_boxShape(gt))
+    d, g = dt[..., :, None, :], gt[..., None, :, :]
+
+    w = np.minimum(d[..., 2] + d[..., 0], g[..., 2] + g[..., 0]) - np.maximum(d[..., 0], g[..., 0])
+    h = np.minimum(d[..., 3] + d[..., 1], g[..., 3] + g[..., 1]) - np.maximum(d[..., 1], g[..., 1])
+    inter = w * h
+    da = d[..., 2] * d[..., 3]
+    ga = g[..., 2] * g[..., 3]
+    union = da + ga - inter
+    if iscrowd is not None:
+        crowd = np.asarray(iscrowd, dtype=bool)
+        union = np.where(crowd.reshape(crowd.shape[:-1] + (1,) + crowd.shape[-1:]), da, union)
+
+    ious = np.zeros(inter.shape, dtype=np.float64)
+    valid = (w > 0) & (h > 0)
+    ious[valid] = inter[valid] / union[valid]
+    return ious
+
+
+def _boxShape(boxes):
+    # [x y w h] boxes as [... x N x 4]; a flat list is N boxes, an empty one none
+    if boxes.ndim == 1:
+        return (-1, 4)
+    return boxes.shape
+
+
+def _iouTorch(dt, gt, iscrowd):
+    import torch
+    dt = dt if _isTensor(dt) else torch.from_numpy(np.asarray(dt, dtype=np.float64))
+    gt = gt if _isTensor(gt) else torch.from_numpy(np.asarray(gt, dtype=np.float64)).type_as(dt)
+    if dt.dim() == 1:
+        dt = dt.view(-1, 4)
+    if gt.dim() == 1:
+        gt = gt.view(-1, 4)
+    d, g = dt.unsqueeze(-2), gt.unsqueeze(-3)
+
+    w = torch.min(d[..., 2] + d[..., 0], g[..., 2] + g[..., 0]) - torch.max(d[..., 0], g[..., 0])
+    h = torch.min(d[..., 3] + d[..., 1], g[..., 3] + g[..., 1]) - torch.max(d[..., 1], g[..., 1])
+    inter = w * h
+    da = d[..., 2] * d[..., 3]
+    ga = g[..., 2] * g[..., 3]
+    union = da + ga - inter
+    if iscrowd is not None:
+        crowd = iscrowd if _isTensor(iscrowd) else torch.from_numpy(np.asarray(iscrowd, dtype=np.uint8))
+        crowd = (crowd.to(dt.device) != 0).unsqueeze(-2).expand_as(union)
+        union = torch.where(crowd, da.expand_as(union), union)
+    valid = (w > 0) & (h > 0)
+    return torch.where(valid, inter / union, torch.zeros_like(inter))
@@ -32,6 +32,7 @@ __version__ = '1.0.1'
 #  segToMask  - Convert polygon segmentation to binary mask.
 #  showAnns   - Display the specified annotations.
 #  loadRes    - Load algorithm results and create API for accessing them.
+#  boxIndex   - Columnar index of the boxes of all anns (see BoxIndex).
 #  download   - Download COCO images from mscoco.org server.
 # Throughout the API "ann"=annotation, "cat"=category, and "img"=image.
 # Help on each functions can be accessed by: "help COCO>function".
@@ -58,6 +59,8 @@ import urllib
 import copy
 import itertools
 from . import mask
+from .boxindex import BoxIndex
+from . import jsoncache
 import os
 try:
     unicode        # Python 2
@@ -65,11 +68,12 @@ except NameError:
     unicode = str  # Python 3
     
 class COCO:
-    def __init__(self, annotation_file=None):
+    def __init__(self, annotation_file=None, cacheDir=None):
         """
         Constructor of Microsoft COCO helper class for reading and visualizing annotations.
         :param annotation_file (str): location of annotation file
         :param image_folder (str): location to the folder that hosts images.
+        :param cacheDir (str): if given, annotation_file is read from its binary cache there (see jsoncache)
         :return:
         """
         # load dataset
@@ -79,15 +83,42 @@ class COCO:
         self.catToImgs = {}
         self.imgs = {}
         self.cats = {}
+        self._loadAnns = None
         if not annotation_file == None:
             print('loading annotations into memory...')
             tic = time.time()
-            dataset = json.load(open(annotation_file, 'r'))
+            if cacheDir is None:
+                dataset, boxIndex, loadAnns = json.load(open(annotation_file, 'r')), None, None
+            else:
+                dataset, boxIndex, loadAnns = jsoncache.loadAnnotations(annotation_file, cacheDir)
             print('Done (t=%0.2fs)'%(time.time()- tic))
             self.dataset = dataset
-            self.createIndex()
+            if loadAnns is None:
+                self.createIndex(boxIndex)
+            else:
+                # from the cache: anns, imgToAnns and catToImgs are built on first use
+                self._loadAnns = loadAnns
+                del self.anns, self.imgToAnns, self.catToImgs
+                self.imgs = dict((img['id'], img) for img in dataset.get('images', []))
+                self.cats = dict((cat['id'], cat) for cat in dataset.get('categories', []))
+                self.boxIndex = boxIndex
+
+    def __getattr__(self, name):
+        if name == 'boxIndex':
+            # built on first use, unless read from the cache
+            anns = self.__dict__.get('dataset', {}).get('annotations')
+            self.boxIndex = BoxIndex.fromAnns(anns) \
+                if anns is not None and all('bbox' in ann for ann in anns) else None
+            return self.boxIndex
+        loadAnns = self.__dict__.get('_loadAnns')
+        if loadAnns is None or not name in ('anns', 'imgToAnns', 'catToImgs'):
+            raise AttributeError(name)
+        self._loadAnns = None
+        self.dataset['annotations'] = loadAnns()
+        self.createIndex(self.boxIndex)
+        return getattr(self, name)
 
-    def createIndex(self):
+    def createIndex(self, boxIndex=None):
         # create index
         print('creating index...')
         anns = {}
@@ -124,6 +155,12 @@ class COCO:
         self.catToImgs = catToImgs
         self.imgs = imgs
         self.cats = cats
+        # arrays of the boxes of all anns, for getAnnIds and the RL dataset,
+        # built from the anns on first use of boxIndex if not given
+        if boxIndex is None:
+            self.__dict__.pop('boxIndex', None)
+        else:
+            self.boxIndex = boxIndex
 
     def info(self):
         """
@@ -145,6 +182,10 @@ class COCO:
         imgIds = imgIds if type(imgIds) == list else [imgIds]
         catIds = catIds if type(catIds) == list else [catIds]
 
+        # the box index if read from the cache or already built
+        boxIndex = self.__dict__.get('boxIndex')
+        if boxIndex is not None:
+            return boxIndex.getAnnIds(imgIds, catIds, areaRng, iscrowd)
         if len(imgIds) == len(catIds) == len(areaRng) == 0:
             anns = self.dataset['annotations']
         else:
@@ -287,7 +328,7 @@ class COCO:
     def loadRes(self, resFile):
         """
         Load result file and return a result api object.
-        :param   resFile (str)     : file name of result file
+        :param   resFile (str)     : file name of result file, or list of results, or BoxIndex of results
         :return: res (obj)         : result api object
         """
         res = COCO()
@@ -297,7 +338,12 @@ class COCO:
 
         print('Loading and preparing results...     ')
         tic = time.time()
-        anns    = json.load(open(resFile))
+        if type(resFile) == str or type(resFile) == unicode:
+            anns = json.load(open(resFile))
+        elif isinstance(resFile, BoxIndex):
+            anns = resFile.toAnns()
+        else:
+            anns = resFile
         assert type(anns) == list, 'results in not an array of objects'
         annsImgIds = [ann['image_id'] for ann in anns]
         assert set(annsImgIds) == (set(annsImgIds) & set(self.getImgIds())), \
@@ -7,6 +7,7 @@ import datetime
 import time
 from collections import defaultdict
 from . import mask
+from . import boxiou
 import copy
 
 try:
@@ -182,16 +183,19 @@ class COCOeval:
         if len(dt) > p.maxDets[-1]:
             dt=dt[0:p.maxDets[-1]]
 
+        # compute iou between each dt and gt region
+        iscrowd = [int(o['iscrowd']) for o in gt]
         if p.useSegm:
             g = [g['segmentation'] for g in gt]
             d = [d['segmentation'] for d in dt]
+            ious = mask.iou(d,g,iscrowd)
+        elif len(gt) == 0 or len(dt) == 0:
+            # as mask.iou
+            ious = []
         else:
             g = [g['bbox'] for g in gt]
             d = [d['bbox'] for d in dt]
-
-        # compute iou between each dt and gt region
-        iscrowd = [int(o['iscrowd']) for o in gt]
-        ious = mask.iou(d,g,iscrowd)
+            ious = boxiou.iou(d,g,iscrowd)
         return ious
 
     def evaluateImg(self, imgId, catId, aRng, maxDet):
@@ -0,0 +1,581 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import copy
+import time
+import datetime
+import multiprocessing
+import numpy as np
+from collections import defaultdict
+from . import mask
+from . import boxiou
+from .cocoeval import COCOeval
+
+# FastCOCOeval is a drop-in replacement for COCOeval whose evaluate() gives
+# the same evalImgs, and so bit-identical precision / recall after
+# accumulate(), much faster:
+#  - the greedy matching of evaluateImg runs on NumPy arrays for all IoU
+#    thresholds, all area ranges and a whole chunk of (image, category)
+#    pairs at once, one step per detection rank (see greedyMatch);
+#  - images are sharded across a process pool of num_workers processes
+#    (0 evaluates in the calling process); a worker prepares the gts and
+#    dts of its own images only, so _gts and _dts stay empty in the
+#    calling process;
+#  - accumulate() sorts the detections of a category and area range once
+#    for all maxDets and computes the precision envelope of all IoU
+#    thresholds with a reverse cumulative max instead of a Python loop
+#    over the detections, categories being spread over the pool.
+#
+# Usage is the same as for COCOeval:
+#  E = FastCOCOeval(cocoGt, cocoDt, num_workers=8)
+#  E.evaluate(); E.accumulate(); E.summarize()
+#
+# StreamingCOCOeval takes the detections of every image as arrays while
+# the test loop runs, without a results json and loadRes:
+#  E = StreamingCOCOeval(cocoGt, num_workers=4)
+#  for ...: E.add(imgId, boxes, scores, catIds)
+#  E.evaluate(); E.accumulate(); E.summarize()
+
+# COCOeval of the pool, set in every worker by _initWorker
+_worker_eval = None
+
+
+def _initWorker(cocoEval):
+    global _worker_eval
+    _worker_eval = cocoEval
+
+
+def _evaluateShard(shard):
+    # each worker only prepares the gts and dts of its own images
+    imgIds, imgInds = shard
+    _worker_eval.params.imgIds = imgIds
+    _worker_eval._prepare()
+    return _worker_eval.evaluateImgs(imgIds, imgInds)
+
+
+def _evaluateBatch(batch):
+    return _worker_eval.evaluateBatch(batch)
+
+
+def _accumulateCategory(task):
+    return _worker_eval.accumulateCategory(*task)
+
+
+def greedyMatch(ious, gtIg, iscrowd, dtValid, iouThrs):
+    '''
+    Greedy matching of evaluateImg for P (image, category) pairs at once.
+    :param ious (float [PxDxG]): dt / gt ious, dt sorted by score, -1 for padding
+    :param gtIg (bool [PxAxG]): ignore flag of every gt at every area range
+    :param iscrowd (bool [PxG]): crowd flag of every gt
+    :param dtValid (bool [PxD]): dts whose match makes the gt taken (dt id > 0)
+    :param iouThrs (float [T]): iou thresholds
+    :return: dtm (int [PxAxTxD]) matched gt index, gtm (int [PxAxTxG]) matched dt index, -1 if none
+    '''
+    P, D, G = ious.shape
+    A = gtIg.shape[1]
+    T = len(iouThrs)
+    thrs = np.minimum(np.asarray(iouThrs, dtype=np.float64), 1-1e-10).reshape(1, 1, T, 1)
+    dtm = -np.ones((P, A, T, D), dtype=np.int64)
+    gtm = -np.ones((P, A, T, G), dtype=np.int64)
+    if D == 0 or G == 0:
+        return dtm, gtm
+    taken = np.zeros((P, A, T, G), dtype=bool)
+    # a detection below the lowest threshold with every gt matches nothing
+    overlaps = ious.max(2) >= thrs.min()
+    for dind in range(D):
+        rows = np.nonzero(overlaps[:, dind])[0]
+        if len(rows) == 0:
+            continue
+        iou = ious[rows, dind].reshape(-1, 1, 1, G)
+        # if this gt already matched, and not a crowd, it is not a candidate
+        cand = ~(taken[rows] & ~iscrowd[rows].reshape(-1, 1, 1, G)) & (iou >= thrs)
+        # a regular gt always wins over an ignored one; among the candidates
+        # the best iou wins, ties going to the last gt as in evaluateImg
+        reg = cand & ~gtIg[rows].reshape(-1, A, 1, G)
+        cand = np.where(reg.any(3, keepdims=True), reg, cand)
+        vals = np.where(cand, iou, -1.)
+        last = G - 1 - np.argmax((vals == vals.max(3, keepdims=True))[:, :, :, ::-1], 3)
+        p, a, t = np.nonzero(cand.any(3))
+        m = last[p, a, t]
+        p = rows[p]
+        dtm[p, a, t, dind] = m
+        gtm[p, a, t, m] = dind
+        taken[p, a, t, m] = dtValid[p, dind]
+    return dtm, gtm
+
+
+class FastCOCOeval(COCOeval):
+    def __init__(self, cocoGt=None, cocoDt=None, num_workers=0):
+        '''
+        Initialize FastCOCOeval using coco APIs for gt and dt
+        :param cocoGt: coco object with ground truth annotations
+        :param cocoDt: coco object with detection results
+        :param num_workers: number of worker processes, 0 to evaluate in this process
+        :return: None
+        '''
+        COCOeval.__init__(self, cocoGt, cocoDt)
+        self.num_workers = num_workers
+
+    def evaluate(self):
+        '''
+        Run per image evaluation on given images and store results (a list of dict) in self.evalImgs
+        :return: None
+        '''
+        tic = time.time()
+        print('Running per image evaluation...      ')
+        p = self.params
+        p.imgIds = list(np.unique(p.imgIds))
+        if p.useCats:
+            p.catIds = list(np.unique(p.catIds))
+        p.maxDets = sorted(p.maxDets)
+        self.params=p
+        catIds = p.catIds if p.useCats else [-1]
+
+        if self.num_workers > 0 and len(p.imgIds) > 1:
+            # a few shards per worker to even out the load
+            numShards = min(len(p.imgIds), 4 * self.num_workers)
+            bounds = np.linspace(0, len(p.imgIds), numShards + 1).astype(np.int64)
+            shards = [(p.imgIds[b:e], list(range(b, e))) for b, e in zip(bounds[:-1], bounds[1:])]
+            pool = multiprocessing.Pool(self.num_workers, _initWorker, (self,))
+            try:
+                results = pool.map(_evaluateShard, shards)
+            finally:
+                pool.close()
+                pool.join()
+            self.eval = {}
+        else:
+            self._prepare()
+            results = [self.evaluateImgs(p.imgIds)]
+
+        self.ious = {}
+        for ious, _ in results:
+            self.ious.update(ious)
+        self.storeResults([chunks for _, chunks in results])
+        toc = time.time()
+        print('DONE (t=%0.2fs).'%(toc-tic))
+
+    def storeResults(self, results):
+        '''
+        Store the evaluateChunk results of all images in self.evalImgs
+        :param results: lists of evaluateChunk results
+        :return: None
+        '''
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        # evalImgs in the order of COCOeval: category, area range, image
+        evalImgs = [[[None] * len(p.imgIds) for _ in p.areaRng] for _ in catIds]
+        for chunks in results:
+            for chunk in chunks:
+                self.storeChunk(chunk, evalImgs)
+        self.evalImgs = [e for evalImgsK in evalImgs for evalImgsA in evalImgsK for e in evalImgsA]
+        self._paramsEval = copy.deepcopy(self.params)
+
+    def evaluateImgs(self, imgIds, imgInds=None, maxElems=1 << 22):
+        '''
+        Evaluate the given images for every category and area range
+        :param imgInds: indices of imgIds in params.imgIds, by default 0, 1, ...
+        :param maxElems: max size of the per chunk arrays of evaluateChunk
+        :return: ious ({(imgId, catId): ious}), chunks (list of evaluateChunk results)
+        '''
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        maxDet = p.maxDets[-1]
+        A = len(p.areaRng)
+        T = len(p.iouThrs)
+        allIous = {}
+        chunks = []
+        if imgInds is None:
+            imgInds = range(len(imgIds))
+
+        pairs = []
+        for k, catId in enumerate(catIds):
+            for i, imgId in zip(imgInds, imgIds):
+                if p.useCats:
+                    gt = self._gts[imgId,catId]
+                    dt = self._dts[imgId,catId]
+                else:
+                    gt = [_ for cId in p.catIds for _ in self._gts[imgId,cId]]
+                    dt = [_ for cId in p.catIds for _ in self._dts[imgId,cId]]
+                if len(gt) == 0 and len(dt) ==0:
+                    allIous[imgId, catId] = []
+                    continue
+
+                # same ious as computeIoU
+                dt = sorted(dt, key=lambda x: -x['score'])[0:maxDet]
+                if len(gt) == 0 or len(dt) == 0:
+                    ious = []
+                elif p.useSegm:
+                    ious = mask.iou([d['segmentation'] for d in dt], [g['segmentation'] for g in gt],
+                                    [int(o['iscrowd']) for o in gt])
+                else:
+                    ious = boxiou.iou([d['bbox'] for d in dt], [g['bbox'] for g in gt],
+                                      [int(o['iscrowd']) for o in gt])
+                allIous[imgId, catId] = ious
+                pairs.append((k, i, imgId, catId, gt, dt, ious))
+
+        # match the pairs in chunks of pairs of similar size
+        shapes = [(len(pair[5]), len(pair[4])) for pair in pairs]
+        order = sorted(range(len(pairs)), key=lambda n: shapes[n])
+        start = 0
+        while start < len(order):
+            D, G = shapes[order[start]]
+            end = start + 1
+            while end < len(order):
+                D = max(D, shapes[order[end]][0])
+                G = max(G, shapes[order[end]][1])
+                if (end - start + 1) * (A * T * (D + G) + D * G) > maxElems:
+                    break
+                end += 1
+            chunks.append(self.evaluateChunk([pairs[n] for n in order[start:end]]))
+            start = end
+        return allIous, chunks
+
+    def evaluateChunk(self, pairs):
+        '''
+        Evaluate P (image, category) pairs together, for every area range
+        :param pairs: list of (k, i, imgId, catId, gt, dt, ious), dt sorted by score
+        :return: pair infos, and dtMatches, gtMatches, dtIgnore, gtIgnore and gtIds of
+                 evaluateImg for all pairs and area ranges, padded (see storeChunk)
+        '''
+        p = self.params
+        aRng = np.array(p.areaRng, dtype=np.float64)
+        A = len(aRng)
+        T = len(p.iouThrs)
+        P = len(pairs)
+        D = max(len(pair[5]) for pair in pairs)
+        G = max(len(pair[4]) for pair in pairs)
+
+        # pairs padded to D dts and G gts
+        ious = -np.ones((P, D, G))
+        gtArea = np.zeros((P, G))
+        gtIgnore = np.zeros((P, G), dtype=bool)
+        iscrowd = np.zeros((P, G), dtype=bool)
+        gtIdList = np.zeros((P, G), dtype=np.int64)
+        dtArea = np.zeros((P, D))
+        dtIds = np.zeros((P, D))
+        for c, (_, _, _, _, gt, dt, pairIous) in enumerate(pairs):
+            if len(pairIous) > 0:
+                ious[c, :len(dt), :len(gt)] = pairIous
+            gtArea[c, :len(gt)] = [g['area'] for g in gt]
+            gtIgnore[c, :len(gt)] = [g['iscrowd'] == 1 or bool(g.get('ignore', 0)) for g in gt]
+            iscrowd[c, :len(gt)] = [int(g['iscrowd']) for g in gt]
+            gtIdList[c, :len(gt)] = [g['id'] for g in gt]
+            dtArea[c, :len(dt)] = [d['area'] for d in dt]
+            dtIds[c, :len(dt)] = [d['id'] for d in dt]
+
+        # [PxAxG] _ignore of every gt at every area range
+        aMin = aRng[:, 0].reshape(1, A, 1)
+        aMax = aRng[:, 1].reshape(1, A, 1)
+        gtArea = gtArea.reshape(P, 1, G)
+        gtIg = gtIgnore.reshape(P, 1, G) | (gtArea < aMin) | (gtArea > aMax)
+        dtInd, gtInd = greedyMatch(ious, gtIg, iscrowd, dtIds > 0, p.iouThrs)
+
+        # matched gt / dt ids, and the ignore flag of the matched gt
+        pInd = np.arange(P).reshape(P, 1, 1, 1)
+        dtm = np.zeros((P, A, T, D))
+        gtm = np.zeros((P, A, T, G))
+        dtIg = np.zeros((P, A, T, D), dtype=bool)
+        if D > 0 and G > 0:
+            matched = dtInd > -1
+            dtInd = np.maximum(dtInd, 0)
+            dtm = np.where(matched, gtIdList[pInd, dtInd].astype(np.float64), 0.)
+            gtm = np.where(gtInd > -1, dtIds[pInd, np.maximum(gtInd, 0)], 0.)
+            dtIg = matched & gtIg[pInd, np.arange(A).reshape(1, A, 1, 1), dtInd]
+        # set unmatched detections outside of area range to ignore
+        dtArea = dtArea.reshape(P, 1, 1, D)
+        dtIg |= (dtm == 0) & ((dtArea < aMin[..., None]) | (dtArea > aMax[..., None]))
+
+        # sort gt ignore last, padding after them
+        gtRank = gtIg.astype(np.int8)
+        for c, pair in enumerate(pairs):
+            gtRank[c, :, len(pair[4]):] = 2
+        gtind = np.argsort(gtRank, 2, kind='mergesort')
+        gtm = gtm[pInd, np.arange(A).reshape(1, A, 1, 1), np.arange(T).reshape(1, 1, T, 1),
+                  gtind.reshape(P, A, 1, G)]
+        gtind = np.arange(P * A).reshape(P, A, 1) * G + gtind
+        gtIg = np.take(gtIg.reshape(-1), gtind).astype(np.int64)
+        gtIds = np.take(np.repeat(gtIdList, A, 0).reshape(-1), gtind)
+
+        infos = [(k, i, imgId, catId, len(gt), [d['id'] for d in dt], [d['score'] for d in dt])
+                 for k, i, imgId, catId, gt, dt, _ in pairs]
+        return infos, dtm, gtm, dtIg, gtIg, gtIds
+
+    def storeChunk(self, chunk, evalImgs):
+        '''
+        Store the results of evaluateChunk as evaluateImg dicts in evalImgs ([K][A][I])
+        :return: None
+        '''
+        p = self.params
+        maxDet = p.maxDets[-1]
+        infos, dtm, gtm, dtIg, gtIg, gtIds = chunk
+        for c, (k, i, imgId, catId, nG, dtIdList, dtScores) in enumerate(infos):
+            nD = len(dtIdList)
+            for a in range(len(p.areaRng)):
+                evalImgs[k][a][i] = {
+                    'image_id':     imgId,
+                    'category_id':  catId,
+                    'aRng':         p.areaRng[a],
+                    'maxDet':       maxDet,
+                    'dtIds':        dtIdList,
+                    'gtIds':        gtIds[c, a, :nG].tolist(),
+                    'dtMatches':    dtm[c, a, :, :nD],
+                    'gtMatches':    gtm[c, a, :, :nG],
+                    'dtScores':     dtScores,
+                    'gtIgnore':     gtIg[c, a, :nG] if nG > 0 else np.array([]),
+                    'dtIgnore':     dtIg[c, a, :, :nD],
+                }
+
+
+    def accumulate(self, p = None):
+        '''
+        Accumulate per image evaluation results and store the result in self.eval,
+        same precision / recall as COCOeval.accumulate
+        :param p: input params for evaluation
+        :return: None
+        '''
+        print('Accumulating evaluation results...   ')
+        tic = time.time()
+        if not self.evalImgs:
+            print('Please run evaluate() first')
+        # allows input customized parameters
+        if p is None:
+            p = self.params
+        p.catIds = p.catIds if p.useCats == 1 else [-1]
+        T           = len(p.iouThrs)
+        R           = len(p.recThrs)
+        K           = len(p.catIds) if p.useCats else 1
+        A           = len(p.areaRng)
+        M           = len(p.maxDets)
+        precision   = -np.ones((T,R,K,A,M)) # -1 for the precision of absent categories
+        recall      = -np.ones((T,K,A,M))
+
+        # create dictionary for future indexing
+        _pe = self._paramsEval
+        catIds = _pe.catIds if _pe.useCats else [-1]
+        setK = set(catIds)
+        setA = set(map(tuple, _pe.areaRng))
+        setM = set(_pe.maxDets)
+        setI = set(_pe.imgIds)
+        # get inds to evaluate
+        k_list = [n for n, k in enumerate(p.catIds)  if k in setK]
+        m_list = [m for n, m in enumerate(p.maxDets) if m in setM]
+        a_list = [n for n, a in enumerate(map(lambda x: tuple(x), p.areaRng)) if a in setA]
+        i_list = [n for n, i in enumerate(p.imgIds)  if i in setI]
+        I0 = len(_pe.imgIds)
+        A0 = len(_pe.areaRng)
+        tasks = [(k0*A0*I0, [a0*I0 for a0 in a_list], m_list, i_list, p.recThrs, T) for k0 in k_list]
+        if self.num_workers > 0 and len(tasks) > 1:
+            pool = multiprocessing.Pool(self.num_workers, _initWorker, (self,))
+            try:
+                results = pool.map(_accumulateCategory, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self.accumulateCategory(*task) for task in tasks]
+        for k, (q, rc) in enumerate(results):
+            precision[:,:,k,:len(a_list),:len(m_list)] = q
+            recall[:,k,:len(a_list),:len(m_list)] = rc
+        self.eval = {
+            'params': p,
+            'counts': [T, R, K, A, M],
+            'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'precision': precision,
+            'recall':   recall,
+        }
+        toc = time.time()
+        print('DONE (t=%0.2fs).'%( toc-tic ))
+
+    def accumulateCategory(self, Nk, Na_list, m_list, i_list, recThrs, T):
+        '''
+        Precision and recall of a category at every area range and maxDet
+        :param Nk: offset of the category in self.evalImgs
+        :param Na_list: offset of every area range in the category
+        :param m_list: maxDets to evaluate
+        :param i_list: indices of the images to evaluate
+        :param recThrs: recall thresholds
+        :param T: number of iou thresholds
+        :return: precision (float [TxRxAxM]), recall (float [TxAxM]), -1 if absent
+        '''
+        R = len(recThrs)
+        precision = -np.ones((T, R, len(Na_list), len(m_list)))
+        recall = -np.ones((T, len(Na_list), len(m_list)))
+        for a, Na in enumerate(Na_list):
+            E = [self.evalImgs[Nk+Na+i] for i in i_list]
+            E = [e for e in E if not e is None]
+            if len(E) == 0:
+                continue
+            gtIg = np.concatenate([e['gtIgnore'] for e in E])
+            npig = np.count_nonzero(gtIg == 0)
+            if npig == 0:
+                continue
+            # all the stored dts, with their rank in their image: the
+            # stable sort of the first maxDet of every image is the stable
+            # sort of all of them restricted to rank < maxDet
+            numDets = np.array([len(e['dtScores']) for e in E], dtype=np.int64)
+            dtScores = np.concatenate([np.asarray(e['dtScores'], dtype=np.float64) for e in E])
+            rank = np.arange(len(dtScores)) - np.repeat(np.cumsum(numDets) - numDets, numDets)
+            order = np.argsort(-dtScores, kind='mergesort')
+            rank = rank[order]
+            dtm  = np.concatenate([e['dtMatches'] for e in E], axis=1)[:T, order]
+            dtIg = np.concatenate([e['dtIgnore']  for e in E], axis=1)[:T, order]
+            for m, maxDet in enumerate(m_list):
+                keep = rank < maxDet
+                tps = np.logical_and(               dtm[:, keep],  np.logical_not(dtIg[:, keep]) )
+                fps = np.logical_and(np.logical_not(dtm[:, keep]), np.logical_not(dtIg[:, keep]) )
+                tp_sum = np.cumsum(tps, axis=1).astype(dtype=np.float64)
+                fp_sum = np.cumsum(fps, axis=1).astype(dtype=np.float64)
+                nd = tp_sum.shape[1]
+                rc = tp_sum / npig
+                pr = tp_sum / (fp_sum+tp_sum+np.spacing(1))
+                if nd == 0:
+                    recall[:, a, m] = 0
+                    precision[:, :, a, m] = 0
+                    continue
+                recall[:, a, m] = rc[:, -1]
+                # precision envelope: reverse cumulative max along the detections
+                pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+                # recall thresholds past the last recall keep a precision of 0
+                q = np.zeros((T, R))
+                for t in range(T):
+                    inds = np.searchsorted(rc[t], recThrs)
+                    valid = inds < nd
+                    q[t, valid] = pr[t, inds[valid]]
+                precision[:, :, a, m] = q
+        return precision, recall
+
+
+class StreamingCOCOeval(FastCOCOeval):
+    def __init__(self, cocoGt, num_workers=0, batchSize=64):
+        '''
+        Initialize StreamingCOCOeval, bbox evaluation of detections added per image
+        :param cocoGt: coco object with ground truth annotations
+        :param num_workers: number of worker processes, 0 to evaluate in this process
+        :param batchSize: number of images evaluated together
+        :return: None
+        '''
+        FastCOCOeval.__init__(self, cocoGt, None, num_workers)
+        self.batchSize = batchSize
+        self._imgInds = None    # index of every image in params.imgIds, set by the first batch
+        self._pending = []      # added images not evaluated yet
+        self._results = []      # evaluateChunk results (or pending async results) of every batch
+        self._pool = None
+        self._numDets = 0
+
+    def __getstate__(self):
+        # for the workers: without the pool and the results of the calling process
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_results'] = []
+        state['_pending'] = []
+        return state
+
+    def add(self, imgId, boxes, scores, catIds):
+        '''
+        Add all the detections of an image; the image is evaluated as soon as
+        a batch of batchSize images is complete. Params can not be changed
+        once the first batch is evaluated.
+        :param imgId (int): image id
+        :param boxes (float [Nx4]): [x y w h] detection boxes
+        :param scores (float [N]): detection scores
+        :param catIds (int [N]): category ids
+        :return: None
+        '''
+        if not imgId in self.cocoGt.imgs:
+            raise Exception('Results do not correspond to current coco set')
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        catIds = np.asarray(catIds, dtype=np.int64).reshape(-1)
+        assert len(boxes) == len(scores) == len(catIds)
+        # ids as given by loadRes, in the order of addition
+        dtIds = np.arange(self._numDets + 1, self._numDets + len(boxes) + 1)
+        self._numDets += len(boxes)
+        self._pending.append((imgId, boxes, scores, catIds, dtIds))
+        if len(self._pending) >= self.batchSize:
+            self._submit()
+
+    def _submit(self):
+        if self._imgInds is None:
+            p = self.params
+            assert not p.useSegm, 'StreamingCOCOeval only evaluates bounding boxes'
+            p.imgIds = list(np.unique(p.imgIds))
+            if p.useCats:
+                p.catIds = list(np.unique(p.catIds))
+            p.maxDets = sorted(p.maxDets)
+            self._imgInds = dict((imgId, i) for i, imgId in enumerate(p.imgIds))
+            if self.num_workers > 0:
+                self._pool = multiprocessing.Pool(self.num_workers, _initWorker, (self,))
+        batch = []
+        for imgId, boxes, scores, catIds, dtIds in self._pending:
+            if imgId in self._imgInds:
+                if self._imgInds[imgId] < 0:
+                    raise Exception('detections of image {} added twice'.format(imgId))
+                batch.append((imgId, self._imgInds[imgId], boxes, scores, catIds, dtIds))
+                self._imgInds[imgId] = -1
+        self._pending = []
+        if len(batch) == 0:
+            return
+        if self._pool is not None:
+            self._results.append(self._pool.apply_async(_evaluateBatch, (batch,)))
+        else:
+            self._results.append(self.evaluateBatch(batch))
+
+    def evaluateBatch(self, batch):
+        '''
+        Evaluate a batch of images for every category and area range
+        :param batch: list of (imgId, index in params.imgIds, boxes, scores, catIds, dtIds)
+        :return: evaluateChunk results
+        '''
+        p = self.params
+        imgIds = [b[0] for b in batch]
+        if p.useCats:
+            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=imgIds, catIds=p.catIds))
+        else:
+            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=imgIds))
+        self._gts = defaultdict(list)
+        self._dts = defaultdict(list)
+        for gt in gts:
+            self._gts[gt['image_id'], gt['category_id']].append(gt)
+        catIds = set(p.catIds)
+        for imgId, _, boxes, scores, dtCatIds, dtIds in batch:
+            for bb, score, catId, dtId in zip(boxes.tolist(), scores.tolist(), dtCatIds.tolist(), dtIds.tolist()):
+                if p.useCats and not catId in catIds:
+                    continue
+                self._dts[imgId, catId].append({
+                    'id': dtId, 'image_id': imgId, 'category_id': catId, 'bbox': bb,
+                    'score': score, 'area': bb[2]*bb[3], 'iscrowd': 0})
+        _, chunks = self.evaluateImgs(imgIds, [b[1] for b in batch])
+        self._gts = defaultdict(list)
+        self._dts = defaultdict(list)
+        return chunks
+
+    def evaluate(self):
+        '''
+        Evaluate the remaining images, images never added having no detections,
+        and store the results of all images (a list of dict) in self.evalImgs
+        :return: None
+        '''
+        tic = time.time()
+        print('Running per image evaluation...      ')
+        self._submit()
+        for imgId, i in sorted(self._imgInds.items(), key=lambda x: x[1]):
+            if i >= 0:
+                self._pending.append((imgId, np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+                if len(self._pending) >= self.batchSize:
+                    self._submit()
+        self._submit()
+        if self._pool is not None:
+            try:
+                results = [r.get() for r in self._results]
+            finally:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+        else:
+            results = self._results
+        self._results = []
+        self.eval = {}
+        self.storeResults(results)
+        toc = time.time()
+        print('DONE (t=%0.2fs).'%(toc-tic))
@@ -0,0 +1,191 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import numpy as np
+from .boxindex import BoxIndex
+
+# Binary cache of parsed COCO annotation and result json files: the boxes
+# as the arrays of a BoxIndex, memory-mapped when loaded, the images,
+# categories and other small top level entries in a json header, and the
+# remaining fields of every annotation (segmentation, ...) pickled in a
+# section read only when the annotation dicts are needed.
+#
+# A cache file is valid for the source file of the same path, size and
+# mtime, and the same CACHE_VERSION; otherwise the json is parsed again
+# and the cache rewritten.
+#
+# File layout: magic, uint64 header length, json header, then the
+# sections listed in the header, each aligned to 64 bytes.
+#
+#  dataset, boxIndex, loadAnns = loadAnnotations(annFile, cacheDir)
+#  boxIndex = loadResults(resFile, cacheDir)
+
+CACHE_MAGIC = b'COCOJSON'
+CACHE_VERSION = 1
+
+# annotation fields held by the BoxIndex arrays
+COLUMNS = [('id', 'ids'), ('image_id', 'imgIds'), ('category_id', 'catIds'), ('bbox', 'bboxes'),
+           ('score', 'scores'), ('area', 'areas'), ('iscrowd', 'iscrowd')]
+
+
+def cachePath(cacheDir, filename):
+    '''
+    :return: path of the cache file of the json file filename in cacheDir
+    '''
+    name = os.path.splitext(os.path.basename(filename))[0]
+    digest = hashlib.sha1(os.path.realpath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(cacheDir, '{}_{}.bin'.format(name, digest[:12]))
+
+
+def sourceKey(filename):
+    stat = os.stat(filename)
+    return {'path': os.path.realpath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def writeCache(filename, header, arrays):
+    '''
+    Write the header (dict) and arrays (dict of np.array) to filename, atomically
+    :return: None
+    '''
+    header = dict(header, version=CACHE_VERSION, sections={})
+    arrays = dict((name, np.ascontiguousarray(array)) for name, array in arrays.items())
+    # the header size depends on the section offsets, so reserve room for it
+    pos = len(CACHE_MAGIC) + 8 + len(json.dumps(header)) + 96 * (len(arrays) + 1)
+    for name in sorted(arrays):
+        pos = (pos + 63) // 64 * 64
+        header['sections'][name] = [pos, arrays[name].dtype.str, list(arrays[name].shape)]
+        pos += arrays[name].nbytes
+    headerBytes = json.dumps(header).encode('utf-8')
+    assert len(CACHE_MAGIC) + 8 + len(headerBytes) <= min([pos] + [s[0] for s in header['sections'].values()])
+
+    cacheDir = os.path.dirname(filename)
+    if cacheDir and not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+    tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmpname, 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(np.array([len(headerBytes)], dtype=np.uint64).tobytes())
+        f.write(headerBytes)
+        for name in sorted(arrays):
+            f.seek(header['sections'][name][0])
+            f.write(arrays[name].tobytes())
+        f.truncate(max(pos, f.tell()))
+    os.rename(tmpname, filename)
+
+
+def readCache(filename, source):
+    '''
+    Read a cache file written by writeCache for the source file key
+    :return: header (dict), arrays (dict of np.memmap), or None if missing or stale
+    '''
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as f:
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+        headerLen = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(headerLen).decode('utf-8'))
+    if header.get('version') != CACHE_VERSION or header.get('source') != source:
+        return None
+    arrays = {}
+    for name, (offset, dtype, shape) in header['sections'].items():
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+    return header, arrays
+
+
+def _saveIndex(filename, source, kind, anns, boxIndex, meta=None):
+    # the fields of every annotation not in (or not in all of) the columns
+    columns = [key for key, _ in COLUMNS if all(key in ann for ann in anns)]
+    skip = set(columns)
+    extras = [dict((k, v) for k, v in ann.items() if not k in skip) for ann in anns]
+    arrays = boxIndex.arrays()
+    if any(extras):
+        arrays['extras'] = np.frombuffer(pickle.dumps(extras, protocol=2), dtype=np.uint8)
+    header = {'kind': kind, 'source': source, 'columns': columns,
+              'hasScores': boxIndex.hasScores, 'meta': meta or {}}
+    writeCache(filename, header, arrays)
+
+
+def _loadIndex(header, arrays):
+    boxIndex = BoxIndex(arrays, header['hasScores'])
+    # backed by the memory-mapped file, nothing to share
+    boxIndex._buffer = arrays['ids']
+    return boxIndex
+
+
+def _annotations(header, arrays, boxIndex):
+    '''
+    The annotation dicts of a cache file, in their original order
+    '''
+    rows = np.argsort(boxIndex.order)
+    if 'extras' in arrays:
+        extras = pickle.loads(arrays['extras'].tobytes())
+    else:
+        extras = [{} for _ in range(len(rows))]
+    columns = [(key, getattr(boxIndex, name)[rows].tolist()) for key, name in COLUMNS
+               if key in header['columns']]
+    anns = []
+    for i, extra in enumerate(extras):
+        ann = dict(extra)
+        for key, values in columns:
+            ann[key] = values[i]
+        anns.append(ann)
+    return anns
+
+
+def loadAnnotations(filename, cacheDir):
+    '''
+    Load a COCO annotation file through its cache in cacheDir
+    :param filename (str): annotation json file
+    :param cacheDir (str): cache directory
+    :return: dataset (dict), without 'annotations' if read from the cache,
+             boxIndex (BoxIndex), loadAnns (function returning the
+             annotation dicts, None if dataset has them)
+    '''
+    source = sourceKey(filename)
+    cacheFile = cachePath(cacheDir, filename)
+    cached = readCache(cacheFile, source)
+    if cached is not None and cached[0]['kind'] == 'annotations':
+        header, arrays = cached
+        boxIndex = _loadIndex(header, arrays)
+        return header['meta'], boxIndex, lambda: _annotations(header, arrays, boxIndex)
+
+    dataset = json.load(open(filename, 'r'))
+    anns = dataset.get('annotations', [])
+    if not all('bbox' in ann for ann in anns):
+        # captions, nothing to index
+        return dataset, None, None
+    boxIndex = BoxIndex.fromAnns(anns)
+    meta = dict((k, v) for k, v in dataset.items() if k != 'annotations')
+    tic = time.time()
+    _saveIndex(cacheFile, source, 'annotations', anns, boxIndex, meta)
+    print('Cached {} (t={:0.2f}s)'.format(cacheFile, time.time() - tic))
+    return dataset, boxIndex, None
+
+
+def loadResults(filename, cacheDir):
+    '''
+    Load a COCO result file through its cache in cacheDir
+    :param filename (str): result json file
+    :param cacheDir (str): cache directory
+    :return: boxIndex (BoxIndex) of the results
+    '''
+    source = sourceKey(filename)
+    cacheFile = cachePath(cacheDir, filename)
+    cached = readCache(cacheFile, source)
+    if cached is not None and cached[0]['kind'] == 'results':
+        return _loadIndex(*cached)
+
+    anns = json.load(open(filename, 'r'))
+    boxIndex = BoxIndex.fromAnns(anns)
+    _saveIndex(cacheFile, source, 'results', anns, boxIndex)
+    return boxIndex
@@ -0,0 +1,148 @@
+"""A roidb stored as flat arrays in a memory-mapped file."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pickle
+import numpy as np
+import scipy.sparse
+from pycocotools.jsoncache import writeCache, readCache
+
+# entries of a roidb dict held as columns, the others are pickled per image
+IMAGE_KEYS = ('img_id', 'image', 'width', 'height', 'flipped', 'need_crop')
+BOX_KEYS = ('boxes', 'gt_classes', 'gt_overlaps', 'seg_areas', 'gt_ishard',
+            'max_classes', 'max_overlaps')
+# optional box columns, and the flag of the images that have them
+OPTIONAL_BOX_KEYS = (('seg_areas', 1), ('gt_ishard', 2), ('max_classes', 4), ('max_overlaps', 8))
+
+
+class ColumnarRoidb(object):
+  """Read-only roidb whose boxes, classes, areas and overlaps are flat
+  arrays of all the images, the boxes of image i at rows
+  box_offsets[i]:box_offsets[i+1], and gt_overlaps a single CSR matrix.
+
+  Indexing it gives the same dicts as the list it was built from, their
+  arrays being views of the columns. Loaded with load(), the columns are
+  memory-mapped from the file, so DataLoader workers share their pages
+  instead of copying the Python objects of a list of dicts.
+  """
+
+  def __init__(self, arrays, num_classes):
+    for name, array in arrays.items():
+      setattr(self, name, array)
+    self.num_classes = num_classes
+    self._names = sorted(arrays)
+
+  @classmethod
+  def from_roidb(cls, roidb, num_classes):
+    """Columns of a list of roidb dicts."""
+    n = len(roidb)
+    num_boxes = np.array([len(entry['boxes']) for entry in roidb], dtype=np.int64)
+    box_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(num_boxes, out=box_offsets[1:])
+
+    def column(key, dtype, default=0):
+      return np.array([entry.get(key, default) for entry in roidb], dtype=dtype)
+
+    paths = [entry['image'].encode('utf-8') for entry in roidb]
+    path_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(path) for path in paths], out=path_offsets[1:])
+    arrays = {
+      'img_id': column('img_id', np.int64),
+      'width': column('width', np.int64),
+      'height': column('height', np.int64),
+      'flipped': column('flipped', np.uint8),
+      'need_crop': column('need_crop', np.uint8),
+      'box_offsets': box_offsets,
+      'path_offsets': path_offsets,
+      'paths': np.frombuffer(b''.join(paths), dtype=np.uint8),
+    }
+
+    boxes = [entry['boxes'] for entry in roidb]
+    dtype = np.result_type(*set(b.dtype for b in boxes)) if n else np.float32
+    arrays['boxes'] = np.concatenate([b.reshape(-1, 4) for b in boxes]).astype(dtype) \
+      if n else np.zeros((0, 4), dtype=dtype)
+    arrays['gt_classes'] = np.concatenate(
+      [entry['gt_classes'] for entry in roidb] + [np.zeros(0)]).astype(np.int32)
+
+    flags = np.zeros(n, dtype=np.uint8)
+    for key, flag in OPTIONAL_BOX_KEYS:
+      has = np.array([key in entry for entry in roidb], dtype=bool)
+      flags[has] |= flag
+      dtype = np.result_type(*set(entry[key].dtype for entry in roidb if key in entry)) \
+        if has.any() else np.float32
+      values = [entry[key] if key in entry else np.zeros(k, dtype=dtype) for entry, k in zip(roidb, num_boxes)]
+      arrays[key] = np.concatenate(values + [np.zeros(0, dtype=dtype)]).astype(dtype)
+    arrays['flags'] = flags
+
+    overlaps = scipy.sparse.vstack([entry['gt_overlaps'] for entry in roidb] +
+                                   [scipy.sparse.csr_matrix((0, num_classes), dtype=np.float32)]).tocsr()
+    arrays['overlap_data'] = overlaps.data.astype(np.float32)
+    arrays['overlap_indices'] = overlaps.indices.astype(np.int32)
+    arrays['overlap_indptr'] = overlaps.indptr.astype(np.int64)
+
+    # anything else (gt_attributes, gt_relations of vg, ...)
+    extras = [pickle.dumps(dict((k, v) for k, v in entry.items() if k not in IMAGE_KEYS + BOX_KEYS),
+                           protocol=2) for entry in roidb]
+    extra_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(extra) for extra in extras], out=extra_offsets[1:])
+    arrays['extras'] = np.frombuffer(b''.join(extras), dtype=np.uint8)
+    arrays['extra_offsets'] = extra_offsets
+    return cls(arrays, num_classes)
+
+  def save(self, filename, key):
+    """Write the columns to filename, for load() with the same key."""
+    writeCache(filename, {'source': key, 'num_classes': self.num_classes},
+               dict((name, getattr(self, name)) for name in self._names))
+
+  @classmethod
+  def load(cls, filename, key):
+    """The roidb saved in filename with key, memory-mapped, or None."""
+    cached = readCache(filename, key)
+    if cached is None:
+      return None
+    header, arrays = cached
+    return cls(arrays, header['num_classes'])
+
+  def __len__(self):
+    return len(self.img_id)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def image_path(self, i):
+    return self.paths[self.path_offsets[i]:self.path_offsets[i + 1]].tobytes().decode('utf-8')
+
+  def box_range(self, i):
+    return int(self.box_offsets[i]), int(self.box_offsets[i + 1])
+
+  def gt_overlaps(self, i):
+    start, end = self.box_range(i)
+    indptr = self.overlap_indptr[start:end + 1]
+    return scipy.sparse.csr_matrix(
+      (self.overlap_data[indptr[0]:indptr[-1]], self.overlap_indices[indptr[0]:indptr[-1]],
+       indptr - indptr[0]), shape=(end - start, self.num_classes))
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('roidb index out of range')
+    start, end = self.box_range(i)
+    entry = pickle.loads(self.extras[self.extra_offsets[i]:self.extra_offsets[i + 1]].tobytes())
+    entry.update({
+      'img_id': self.img_id[i].item(),
+      'image': self.image_path(i),
+      'width': self.width[i].item(),
+      'height': self.height[i].item(),
+      'flipped': bool(self.flipped[i]),
+      'need_crop': int(self.need_crop[i]),
+      'boxes': self.boxes[start:end],
+      'gt_classes': self.gt_classes[start:end],
+      'gt_overlaps': self.gt_overlaps(i),
+    })
+    for key, flag in OPTIONAL_BOX_KEYS:
+      if self.flags[i] & flag:
+        entry[key] = getattr(self, key)[start:end]
+    return entry
@@ -63,7 +63,8 @@ class roibatchLoader(data.Dataset):
     # get the anchor index for current sample index
     # here we set the anchor index to the last one
     # sample in this group
-    minibatch_db = [self._roidb[index_ratio]]
+    entry = self._roidb[index_ratio]
+    minibatch_db = [entry]
     blobs = get_minibatch(minibatch_db, self._num_classes)
     data = torch.from_numpy(blobs['data'])
     im_info = torch.from_numpy(blobs['im_info'])
@@ -85,7 +86,7 @@ class roibatchLoader(data.Dataset):
         # if the image need to crop, crop to the target size.
         ratio = self.ratio_list_batch[index]
 
-        if self._roidb[index_ratio]['need_crop']:
+        if entry['need_crop']:
             if ratio < 1:
                 # this means that data_width << data_height, we need to crop the
                 # data_height
@@ -214,3 +215,27 @@ class roibatchLoader(data.Dataset):
 
   def __len__(self):
     return len(self._roidb)
+
+
+def ratio_grouped_batches(ratio_index, batch_size):
+  """Batches of dataset indices for testing, taken in the order of
+  ratio_index (images sorted by aspect ratio, see rank_roidb_ratio), so
+  that the images of a batch need little padding."""
+  ratio_index = np.asarray(ratio_index, dtype=np.int64)
+  return [ratio_index[i:i + batch_size].tolist()
+          for i in range(0, len(ratio_index), batch_size)]
+
+
+def pad_collate(batch):
+  """Collate test samples of different sizes. Images are zero padded at
+  the bottom and right to the largest one of the batch; im_info keeps the
+  size of every image, so proposals are still clipped to the image."""
+  max_height = max(data.size(1) for data, _, _, _ in batch)
+  max_width = max(data.size(2) for data, _, _, _ in batch)
+  padding_data = torch.FloatTensor(len(batch), 3, max_height, max_width).zero_()
+  for i, (data, _, _, _) in enumerate(batch):
+    padding_data[i, :, :data.size(1), :data.size(2)] = data
+  im_info = torch.stack([im_info for _, im_info, _, _ in batch], 0)
+  gt_boxes = torch.stack([gt_boxes for _, _, gt_boxes, _ in batch], 0)
+  num_boxes = torch.LongTensor([num_boxes for _, _, _, num_boxes in batch])
+  return padding_data, im_info, gt_boxes, num_boxes
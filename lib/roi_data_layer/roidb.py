@@ -3,10 +3,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import json
+import hashlib
 import datasets
 import numpy as np
 from model.utils.config import cfg
 from datasets.factory import get_imdb
+from roi_data_layer.columnar_roidb import ColumnarRoidb
 import PIL
 import pdb
 
@@ -85,9 +89,25 @@ def filter_roidb(roidb):
     print('after filtering, there are %d images...' % (len(roidb)))
     return roidb
 
-def combined_roidb(imdb_names, training=True):
+def columnar_roidb(roidb, imdb, key):
+  """Move a roidb to a memory-mapped ColumnarRoidb, in the cache
+  directory of imdb, so the DataLoader workers share its pages. The file
+  is named after the key and reused while the key matches."""
+  digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+  filename = os.path.join(imdb.cache_path, '{}_roidb_{}.bin'.format(imdb.name, digest[:16]))
+  columnar = ColumnarRoidb.load(filename, key)
+  if columnar is None:
+    ColumnarRoidb.from_roidb(roidb, imdb.num_classes).save(filename, key)
+    columnar = ColumnarRoidb.load(filename, key)
+    if columnar is None:
+      raise RuntimeError('Could not load the columnar roidb {} just written'.format(filename))
+  print('roidb of {:d} images, {:d} boxes in {}'.format(len(columnar), len(columnar.boxes), filename))
+  return columnar
+
+def combined_roidb(imdb_names, training=True, columnar=True):
   """
-  Combine multiple roidbs
+  Combine multiple roidbs, as a ColumnarRoidb if columnar, otherwise as
+  a list of dicts
   """
 
   def get_training_roidb(imdb):
@@ -124,9 +144,21 @@ def combined_roidb(imdb_names, training=True):
   else:
     imdb = get_imdb(imdb_names)
 
+  num_images = len(roidb)
   if training:
     roidb = filter_roidb(roidb)
+  filtered = len(roidb) < num_images
 
   ratio_list, ratio_index = rank_roidb_ratio(roidb)
 
+  if columnar:
+    key = {'imdb': imdb_names, 'training': training, 'flipped': bool(cfg.TRAIN.USE_FLIPPED),
+           'proposal_method': cfg.TRAIN.PROPOSAL_METHOD, 'num_images': len(roidb),
+           'num_boxes': int(sum(len(entry['boxes']) for entry in roidb))}
+    roidb = columnar_roidb(roidb, imdb, key)
+    if len(roidbs) == 1 and not cfg.TRAIN.USE_FLIPPED and not filtered:
+      # the roidb of the images of the imdb, in order: the imdb serves it
+      # too, for evaluate_recall, instead of loading its gt roidb again
+      imdb._roidb = roidb
+
   return imdb, roidb, ratio_list, ratio_index
@@ -14,6 +14,7 @@ from config import Config
 import torch
 import torch.optim as optim
 from torch.autograd import Variable, grad
+from torch.utils.data import DataLoader, Subset
 from torch.utils.data.sampler import Sampler
 from torch.utils.data.distributed import DistributedSampler
 
@@ -21,7 +22,10 @@ from datasets.RL_coco_dataset import COCODataset, COCOTransform
 from datasets.RL_coco_loader import COCODataLoader
 from model.Reinforcement.resnet import resnet101
 from model.Reinforcement.action import Action
+from model.Reinforcement.refine import RefineEngine
+from model.Reinforcement.feature_cache import FeatureCache, trunk_digest
 from model.Reinforcement.utils import *
+from pycocotools.fasteval import StreamingCOCOeval
 
 def parse_args():
 	"""
@@ -44,6 +48,8 @@ def parse_args():
 						help='batch_size (default: 24)')
 	parser.add_argument('--log-interval', default=10, type=int,
 						help='iter logger info interval (default: 10)')
+	parser.add_argument('--refine-steps', default=0, type=int,
+						help='test with multi-step refinement, AP of every step (default: 0, off)')
 
 	args = parser.parse_args()
 	return args
@@ -80,7 +86,9 @@ def main():
 		config.dt_file,
 		bbox_action=bbox_action,
 		transform_fn=transform_fn,
-		normalize_fn=normalize_fn)
+		normalize_fn=normalize_fn,
+		label_cache_dir=config.label_cache_dir,
+		json_cache_dir=config.json_cache_dir)
 	dataloader = COCODataLoader(
 		dataset, 
 		batch_size=args.batch_size, 
@@ -131,6 +139,7 @@ def main():
 			checkpoint = torch.load(args.resume)
 			start_epoch = checkpoint['epoch']
 			model.load_state_dict(checkpoint['state_dict'], strict=False)
+		PrepareFeatureCache(model, dataset)
 		# start training
 		for epoch in range(start_epoch, config.train_max_epoch):
 			adjust_learning_rate(optimizer, epoch, 
@@ -145,13 +154,12 @@ def main():
 		checkpoint = torch.load(resume)
 		start_epoch = checkpoint['epoch']
 		model.load_state_dict(checkpoint['state_dict'], strict=False)
+		PrepareFeatureCache(model, dataset)
 		#
-		dt_boxes = Evaluate(model, dataloader, bbox_action)
-		ensure_dir(os.path.join(args.save_dir, 'jsons'))
-		filename = 'detections_{}_epoch{}_results.json'.format((args.phase, start_epoch))
-		filename = os.path.join(args.save_dir, 'jsons', filename)
-		json.dump(dt_boxes, open(filename, 'w'))
-		cocoval(args.ann_file, filename)
+		if args.refine_steps > 0:
+			RefineAndEval(model, dataloader, bbox_action)
+		else:
+			Evaluate(model, dataloader, bbox_action)
 		
 	logger.info('Exit without error.')
 
@@ -172,6 +180,43 @@ def Savecheckpoint(save_dir, epoch, model):
 		os.path.join(save_dir, 'epoch_%d.pth' % (epoch + 1)) )
 
 
+def _first(batch):
+	return batch[0]
+
+
+def PrepareFeatureCache(model, dataset):
+	"""
+	Run the frozen trunk once over the images missing from the feature
+	cache, then let the dataset return the cached features instead.
+	"""
+	global args, config
+	logger = logging.getLogger('global')
+	if not config.feature_cache_dir:
+		return
+
+	key = FeatureCache.key(trunk_digest(model), config.data_dir, repr(config.normalize),
+						dataset.transform_fn.scale_max, dataset.transform_fn.max_size,
+						config.feature_cache_fp16)
+	feature_cache = FeatureCache(os.path.join(config.feature_cache_dir, key),
+								fp16=config.feature_cache_fp16)
+	dataset.set_feature_cache(None)
+	missing = [i for i, img_id in enumerate(dataset.imgIds) if img_id not in feature_cache]
+	if len(missing) > 0:
+		logger.info('Caching trunk features of {} images in {}...'.format(
+			len(missing), feature_cache.cache_dir))
+		loader = DataLoader(Subset(dataset, missing), batch_size=1, shuffle=False,
+							num_workers=config.num_workers, collate_fn=_first)
+		trunk = model.module if args.mGPUs else model
+		trunk.eval()
+		with torch.no_grad():
+			for i, inp in enumerate(loader):
+				feat = trunk.trunk(inp[0].unsqueeze(0).cuda())
+				feature_cache.save(dataset.imgIds[missing[i]], feat[0])
+				if i % (args.log_interval * 100) == 0:
+					logger.info('Cache: [{0}/{1}]'.format(i, len(missing)))
+	dataset.set_feature_cache(feature_cache)
+
+
 def Evaluate(model, val_loader, bbox_action):
 	global args, config
 	logger = logging.getLogger('global')
@@ -182,7 +227,7 @@ def Evaluate(model, val_loader, bbox_action):
 	#Prec1 = AveMeter(len(val_loader))
 	#Prec5 = AveMeter(len(val_loader))
 	Preck = AveMeter(len(val_loader))
-	dt_boxes = []
+	coco_eval = StreamingCOCOeval(val_loader.dataset.cocoGt, num_workers=config.eval_num_workers)
 	model.eval()
 
 	start = time.time()
@@ -195,46 +240,25 @@ def Evaluate(model, val_loader, bbox_action):
 		data_time.add(time.time() - start)
 
 		# forward
-		pred, loss, _ = model(img_var, bboxes, targets, weights)
+		pred, loss, _ = model(img_var, bboxes, targets, weights,
+							trunk_feat=val_loader.dataset.feature_cache is not None)
 		loss = loss.mean()
 
 		# get output boxes
-		bboxes = inp[1].numpy()
-		bboxes[:, :, 3] = bboxes[:, :, 3] - bboxes[:, :, 1]
-		bboxes[:, :, 4] = bboxes[:, :, 4] - bboxes[:, :, 2]
-		batch_size = bboxes.shape[0]
-
-		# get output datas
-		preds = pred.cpu().data.numpy().reshape(batch_size, -1, bbox_action.num_acts)
-		targets = targets.cpu().data.numpy().reshape(batch_size, -1, bbox_action.num_acts)
-
-		# get new boxes
-		newboxes, preck = bbox_action.move_from_act(bboxes[:,:,1:5], preds, targets, maxk=1)
-		bboxes[:,:,1:5] = newboxes
-		bboxes = bboxes.reshape(-1, bboxes.shape[-1]).astype(float)
-
-		# generate detection results
-		im_infos = inp[3]
-		for j, bbox in enumerate(bboxes):
-			bid = int(bbox[0])
-			scale = im_infos[bid][2]
-			bbox[1:5] /= scale
-			
-			dtbox = {
-				'bbox': [float(bbox[1]), float(bbox[2]), float(bbox[3]), float(bbox[4])],
-				'score': float(bbox[5]),
-				'category_id': int(bbox[6]),
-				'image_id': int(bbox[7])
-			}
-			'''
-			dtbox = {
-				'bbox': [float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3])],
-				'score': float(bbox[4]),
-				'category_id': int(bbox[5]),
-				'image_id': int(bbox[6])
-			}
-			'''
-			dt_boxes.append(dtbox)
+		bboxes = inp[1].cuda(async=True)
+		bboxes[:, :, 3:5] -= bboxes[:, :, 1:3]
+		batch_size = bboxes.size(0)
+
+		# get output datas, kept on the gpu
+		preds = pred.data.view(batch_size, -1, bbox_action.num_acts)
+		targets = targets.data.view(batch_size, -1, bbox_action.num_acts)
+
+		# get new boxes, moved in place
+		_, preck = bbox_action.move_from_act(bboxes[:,:,1:5], preds, targets, maxk=1)
+		bboxes = bboxes.cpu().numpy()
+
+		# match the detections against the gts while the next batches run
+		AddDetections(coco_eval, bboxes, inp[3])
 
 		losses.add(loss.item())
 		#Prec1.add(accuracy(preds, targets, 1))
@@ -259,7 +283,91 @@ def Evaluate(model, val_loader, bbox_action):
 		start = time.time()
 	#logger.info('Prec1: %.3f Prec5: %.3f' % (Prec1.avg, Prec5.avg))
 	logger.info('Preck: %.3f' % (Preck.avg))
-	return dtboxes
+	return COCOStats(coco_eval)
+
+
+def AddDetections(coco_eval, bboxes, im_infos):
+	"""
+	Add bboxes, np.array of shape [b, n, 8]
+	(bid, x, y, w, h, score, cat_id, img_id) on resized images,
+	to the StreamingCOCOeval coco_eval, one image per bid.
+	Padded boxes (img_id 0) are skipped.
+	"""
+	bboxes = bboxes.reshape(-1, bboxes.shape[-1]).astype(float)
+	bboxes = bboxes[bboxes[:, 7] > 0]
+	for bid in np.unique(bboxes[:, 0]):
+		dets = bboxes[bboxes[:, 0] == bid]
+		scale = float(im_infos[int(bid)][2])
+		coco_eval.add(int(dets[0, 7]), dets[:, 1:5] / scale, dets[:, 5], dets[:, 6].astype(int))
+
+
+def COCOStats(coco_eval):
+	coco_eval.evaluate()
+	coco_eval.accumulate()
+	coco_eval.summarize()
+	return coco_eval.stats
+
+
+def Refine(model, val_loader, bbox_action, num_steps):
+	global args, config
+	logger = logging.getLogger('global')
+
+	engine = RefineEngine(model, bbox_action,
+						num_steps=num_steps,
+						stop_thres=config.refine_stop_thres)
+	batch_time = AveMeter(100)
+	data_time = AveMeter(100)
+	step_times = [AveMeter(len(val_loader)) for _ in range(num_steps + 1)]
+	active_nums = [AveMeter(len(val_loader)) for _ in range(num_steps)]
+	coco_evals = [StreamingCOCOeval(val_loader.dataset.cocoGt, num_workers=config.eval_num_workers)
+				for _ in range(num_steps + 1)]
+	model.eval()
+
+	start = time.time()
+	for i, inp in enumerate(val_loader):
+		# input data processing
+		img_var = inp[0].cuda(async=True)
+		bboxes = inp[1].cuda(async=True)
+		data_time.add(time.time() - start)
+
+		# trunk once, then the head on the active boxes of each step
+		steps, times, actives = engine(img_var, bboxes,
+							trunk_feat=val_loader.dataset.feature_cache is not None)
+		for step, step_bboxes in enumerate(steps):
+			AddDetections(coco_evals[step], step_bboxes, inp[3])
+			step_times[step].add(times[step])
+		for step, num in enumerate(actives):
+			active_nums[step].add(num)
+
+		batch_time.add(time.time() - start)
+		if i % args.log_interval == 0:
+			logger.info('Refine: [{0}/{1}]\t'
+						'Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
+						'Data {data_time.val:.3f} ({data_time.avg:.3f})\t'
+						'Active {active}\t'
+						.format(i, len(val_loader),
+							batch_time=batch_time,
+							data_time=data_time,
+							active=actives)
+						)
+		start = time.time()
+	return coco_evals, [t.avg for t in step_times], [n.avg for n in active_nums]
+
+
+def RefineAndEval(model, val_loader, bbox_action):
+	global args, config
+	logger = logging.getLogger('global')
+
+	coco_evals, step_times, active_nums = Refine(model, val_loader, bbox_action, args.refine_steps)
+	aps = []
+	for step, coco_eval in enumerate(coco_evals):
+		logger.info('Step {}:'.format(step))
+		aps.append(COCOStats(coco_eval)[0])
+
+	logger.info('Trunk: {:.3f}s/batch\tAP {:.4f}'.format(step_times[0], aps[0]))
+	for step in range(1, len(aps)):
+		logger.info('Step {}: {:.3f}s/batch\t{:.1f} active boxes/batch\tAP {:.4f} ({:+.4f})'.format(
+			step, step_times[step], active_nums[step - 1], aps[step], aps[step] - aps[step - 1]))
 
 
 def Train(epoch, model, train_loader, optimizer):
@@ -282,7 +390,8 @@ def Train(epoch, model, train_loader, optimizer):
 		data_time.add(time.time() - start)
 
 		# forward
-		pred, loss, noweight_loss = model(img_var, bboxes, targets, weights)
+		pred, loss, noweight_loss = model(img_var, bboxes, targets, weights,
+							trunk_feat=train_loader.dataset.feature_cache is not None)
 		loss, noweight_loss = loss.mean(), noweight_loss.mean()
 
 		# backward